@@ -0,0 +1,193 @@
+import atexit
+import datetime
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+
+# alerts with the same key within this many seconds are delivered once
+DEDUPE_SECS = 30
+# alerts waiting for the worker, newer alerts are dropped beyond this
+QUEUE_SIZE = 100
+# seconds given to the worker to deliver what is queued when the script exits
+DRAIN_SECS = 10
+
+Alert = namedtuple("Alert", ["kind", "message", "freq", "duration", "repeat", "created"])
+
+try:
+    import winsound
+
+except ImportError:
+
+    if sys.platform == "darwin":
+
+        def beep(freq, duration):
+            # brew install SoX --> install SOund eXchange universal sound sample translator on mac
+            os.system(
+                f"play -n synth {duration / 1000} sin {freq} >/dev/null 2>&1")
+    else:
+        def beep(freq, duration):
+            # apt-get install beep  --> install beep package on linux distros before running
+            os.system('beep -f %s -l %s' % (freq, duration))
+else:
+    def beep(freq, duration):
+        winsound.Beep(freq, duration)
+
+
+class SoundSink:
+    def send(self, alert):
+        for _ in range(alert.repeat):
+            beep(alert.freq, alert.duration)
+
+
+class DesktopSink:
+    """
+    Desktop notification with notify-send on linux and osascript on mac, nothing elsewhere
+    """
+
+    def send(self, alert):
+        title = f"CoWIN booking: {alert.kind}"
+        if sys.platform == "darwin":
+            script = f'display notification {json.dumps(alert.message)} with title {json.dumps(title)}'
+            subprocess.run(["osascript", "-e", script], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elif sys.platform.startswith("linux"):
+            subprocess.run(["notify-send", title, alert.message], stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+
+
+class LogSink:
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, alert):
+        created = datetime.datetime.fromtimestamp(alert.created).strftime('%Y-%m-%d %H:%M:%S')
+        with open(self.path, "a") as f:
+            f.write(f"{created} {alert.kind}: {alert.message}\n")
+
+
+class WebhookSink:
+    """
+    POSTs {"kind", "message", "created"} as json, e.g. to a local home automation or chat bridge
+    """
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, alert):
+        # plain requests, not transport: these calls are not CoWIN calls and must not show up in its hooks
+        import requests
+
+        requests.post(self.url, json={"kind": alert.kind, "message": alert.message, "created": alert.created},
+                      timeout=self.timeout)
+
+
+def build_sink(spec):
+    """
+    This function turns an --alert value into a sink: sound, desktop, log:PATH or webhook:URL
+    """
+    name, _, argument = spec.partition(":")
+    if name == "sound":
+        return SoundSink()
+    elif name == "desktop":
+        return DesktopSink()
+    elif name == "log" and argument:
+        return LogSink(argument)
+    elif name == "webhook" and argument:
+        return WebhookSink(argument)
+    raise ValueError(f"Unknown alert sink {spec}, use sound, desktop, log:PATH or webhook:URL")
+
+
+class AlertDispatcher:
+    """
+    Queue of alerts and the worker thread that hands each of them to every sink
+    """
+
+    def __init__(self, sinks, dedupe_secs=DEDUPE_SECS, queue_size=QUEUE_SIZE):
+        self.sinks = sinks
+        self.dedupe_secs = dedupe_secs
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.last_sent = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.delivered = 0
+        self.duplicates = 0
+        self.dropped = 0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="alerts", daemon=True)
+            self.thread.start()
+        return self
+
+    def notify(self, kind, message, key=None, freq=1000, duration=150, repeat=1):
+        """
+        This function queues an alert and returns at once; key defaults to the kind and message
+        """
+        now = time.time()
+        key = (kind, message) if key is None else key
+        with self.lock:
+            last_sent = self.last_sent.get(key)
+            if last_sent is not None and now - last_sent < self.dedupe_secs:
+                self.duplicates += 1
+                return
+            self.last_sent[key] = now
+        try:
+            self.queue.put_nowait(Alert(kind, message, freq, duration, repeat, now))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def drain(self, timeout=DRAIN_SECS):
+        """
+        This function waits, at most timeout seconds, for the queued alerts to be delivered
+        """
+        deadline = time.time() + timeout
+        while self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+
+    def stats(self):
+        with self.lock:
+            return {"delivered": self.delivered, "duplicates": self.duplicates, "dropped": self.dropped}
+
+    def _run(self):
+        while True:
+            alert = self.queue.get()
+            try:
+                for sink in self.sinks:
+                    try:
+                        sink.send(alert)
+                    except Exception as e:
+                        print(f"Alert to {type(sink).__name__} failed: {e}")
+                with self.lock:
+                    self.delivered += 1
+            finally:
+                self.queue.task_done()
+
+
+DISPATCHER = None
+
+
+def configure(specs=None):
+    """
+    This function sets the sinks of the alerts, from --alert values, sound when none are given
+    """
+    global DISPATCHER
+    DISPATCHER = AlertDispatcher([build_sink(spec) for spec in (specs or ["sound"])]).start()
+    return DISPATCHER
+
+
+def notify(kind, message, key=None, freq=1000, duration=150, repeat=1):
+    if DISPATCHER is None:
+        configure()
+    DISPATCHER.notify(kind, message, key, freq, duration, repeat)
+
+
+@atexit.register
+def _drain_on_exit():
+    if DISPATCHER is not None:
+        DISPATCHER.drain()
@@ -0,0 +1,650 @@
+import argparse
+import contextlib
+import copy
+import datetime
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import random
+import hashlib
+import mock_server
+import traffic
+import transport
+import utils
+from calendar_diff import CalendarSnapshot
+from captcha_prefetch import CaptchaPrefetcher
+from calendar_filter import excluded_pincode_set, iter_viable_options
+from urllib.parse import parse_qs, urlparse
+from ranking import BookingHistory, SlotRanker, default_slot_count, parse_weights
+
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {f"p{point}": None for point in points}
+    ordered = sorted(values)
+    return {f"p{point}": ordered[min(len(ordered) - 1, int(round(point / 100 * (len(ordered) - 1))))]
+            for point in points}
+
+
+def summarize(values):
+    return {"mean": statistics.mean(values) if values else None, **percentiles(values)}
+
+
+def print_report(title, report):
+    print(f"\n================================= {title} =================================")
+    print(json.dumps(report, indent=4))
+
+
+def bench_booking(args):
+    """
+    This function
+        1. Starts the stand-in with the given latency, error rates and calendar size,
+        2. Runs check_and_book for the given number of cycles with auto booking, and
+        3. Reports time to the first booking attempt, calls per cycle and cycle time percentiles
+    """
+    mock = mock_server.MockCoWIN(centers_per_location=args.centers, sessions_per_center=args.sessions,
+                                 latency=args.latency, jitter=args.jitter,
+                                 error_rates=mock_server.parse_error_rates(args.error),
+                                 book_success_rate=0.0, open_ratio=args.open_ratio, seed=args.seed)
+    server = mock_server.start_server(mock)
+    transport.set_api_base(server.url)
+
+    request_header = {"Authorization": f"Bearer {mock_server.mock_token()}", "content-type": "application/json"}
+    beneficiary_dtls = [{"bref_id": "12345678901234", "name": "Mock Beneficiary", "vaccine": "", "age": 30,
+                         "status": "Not Vaccinated", "dose1_date": "", "dose2_date": ""}]
+    location_dtls = [{"district_id": 100 + idx, "district_name": f"Mock District {100 + idx}",
+                      "alert_freq": 440 + ((2 * idx) * 110)} for idx in range(args.districts)]
+
+    calendar_snapshot = CalendarSnapshot() if args.diff else None
+    captcha_prefetcher = None
+    if args.prefetch:
+        captcha_prefetcher = CaptchaPrefetcher(lambda header: utils.generate_captcha(header, args.captcha, None, None))
+        captcha_prefetcher.set_request_header(request_header)
+        captcha_prefetcher.start()
+        time.sleep(args.latency * 4)
+    cycle_times, first_attempts, calls_per_cycle = [], [], []
+    for _ in range(args.cycles):
+        mock.reset_stats()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            utils.check_and_book(request_header, beneficiary_dtls, location_dtls, 2,
+                                 min_slots=1, ref_freq=0, auto_book="y", start_date=1, vaccine_type=None,
+                                 fee_type=["Free", "Paid"], mobile=None, captcha_automation=args.captcha,
+                                 captcha_api_choice=None, captcha_automation_api_key=None, dose_num=1,
+                                 excluded_pincodes=None, reschedule_inp=None, calendar_snapshot=calendar_snapshot,
+                                 captcha_prefetcher=captcha_prefetcher)
+        cycle_times.append(time.perf_counter() - started)
+        calls = list(mock.calls)
+        calls_per_cycle.append(len(calls))
+        attempts = [call_started for call_started, _, endpoint, _ in calls if endpoint == "schedule"]
+        if attempts:
+            first_attempts.append(min(attempts) - started)
+    server.shutdown()
+    if captcha_prefetcher is not None:
+        captcha_prefetcher.stop()
+
+    total_time = sum(cycle_times)
+    print_report("Booking path", {
+        "cycles": args.cycles,
+        "districts": args.districts,
+        "time_to_first_booking_attempt_secs": summarize(first_attempts),
+        "cycle_time_secs": summarize(cycle_times),
+        "calls_per_cycle": summarize(calls_per_cycle),
+        "calls_per_sec": sum(calls_per_cycle) / total_time if total_time else None,
+        "cycles_without_attempt": args.cycles - len(first_attempts),
+        "captcha_prefetch": captcha_prefetcher.stats() if captcha_prefetcher is not None else None,
+    })
+
+
+def time_calls(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def original_filter_centers_by_age(resp, min_age_booking):
+    # utils.filter_centers_by_age before iter_viable_options, it removes from the lists it walks, in place
+    if min_age_booking >= 45:
+        center_age_filter = 45
+    else:
+        center_age_filter = 18
+
+    if "centers" in resp:
+        for center in list(resp["centers"]):
+            for session in list(center["sessions"]):
+                if session['min_age_limit'] != center_age_filter:
+                    center["sessions"].remove(session)
+                    if len(center["sessions"]) == 0:
+                        resp["centers"].remove(center)
+    return resp
+
+
+def bench_filters(args):
+    """
+    This function times the original staged filters (age -> excluded pincodes -> viable options) against the fused
+    iter_viable_options on a synthetic calendarByDistrict response
+    """
+    resp = mock_server.generate_calendar(args.centers, args.sessions, seed=args.seed, open_ratio=args.open_ratio)
+    excluded_pincodes = [{"pincode": str(110000 + idx)} for idx in range(args.excluded)]
+    excluded = excluded_pincode_set(excluded_pincodes)
+    fee_type = ["Free", "Paid"]
+    # the original filters change the response, every call gets its own copy, made before the timing
+    copies = [copy.deepcopy(resp) for _ in range(args.repeat + 1)]
+
+    def staged():
+        filtered = original_filter_centers_by_age(copies.pop(), 30)
+        filtered = utils.filer_by_excluded_pincodes(filtered, excluded_pincodes)
+        return utils.viable_options(filtered, 1, 30, fee_type, 1)
+
+    def fused():
+        return list(iter_viable_options(resp, 30, 1, fee_type, 1, excluded_pincodes=excluded))
+
+    staged_options, fused_options = staged(), fused()
+    staged_times = time_calls(staged, args.repeat)
+    fused_times = time_calls(fused, args.repeat)
+    print_report("Calendar filters", {
+        "centers": args.centers,
+        "sessions_per_center": args.sessions,
+        "options": {"staged": len(staged_options), "fused": len(fused_options)},
+        "staged_ms": {key: value * 1000 for key, value in summarize(staged_times).items()},
+        "fused_ms": {key: value * 1000 for key, value in summarize(fused_times).items()},
+        "speedup": statistics.mean(staged_times) / statistics.mean(fused_times),
+    })
+
+
+def legacy_sort_key(option):
+    # the order of the options before SlotRanker: most capacity first, then earliest date, then by location and name
+    return -option.available, option.day, option.district.lower(), option.pincode, option.name.lower()
+
+
+def bench_ranking(args):
+    """
+    This function times the ordering of a large set of options into booking attempts: the sort by date and capacity
+    with slots sampled option by option, against SlotRanker.rank and attempts with every feature weighted
+    """
+    resp = mock_server.generate_calendar(args.centers, args.sessions, seed=args.seed, open_ratio=args.open_ratio)
+    options = list(iter_viable_options(resp, 30, 1, ["Free", "Paid"], 1))
+    rng = random.Random(args.seed)
+    history = BookingHistory()
+    center_ids = sorted({option.center_id for option in options})
+    for center_id in rng.sample(center_ids, min(len(center_ids), args.history)):
+        history.record(center_id, rng.random() < 0.2)
+    ranker = SlotRanker(parse_weights(args.weights), preferred_centers=center_ids[:10], history=history, rng=rng)
+
+    def legacy():
+        attempts = []
+        for option in sorted(options, key=legacy_sort_key):
+            slots = option.slots
+            attempts += [(option, slot) for slot in rng.sample(slots, min(len(slots), default_slot_count(slots)))]
+        return attempts
+
+    def ranked():
+        return ranker.attempts(ranker.rank(options))
+
+    legacy_times = time_calls(legacy, args.repeat)
+    ranked_times = time_calls(ranked, args.repeat)
+    print_report("Slot ranking", {
+        "centers": args.centers,
+        "options": len(options),
+        "attempts": {"legacy": len(legacy()), "ranked": len(ranked())},
+        "centers_with_history": len(history.attempts),
+        "legacy_ms": {key: value * 1000 for key, value in summarize(legacy_times).items()},
+        "ranked_ms": {key: value * 1000 for key, value in summarize(ranked_times).items()},
+        "ranked_us_per_option": statistics.mean(ranked_times) / max(1, len(options)) * 1e6,
+    })
+
+
+def parse_age_mix(spec):
+    # "18=0.7,45=0.3" -> {18: 0.7, 45: 0.3}
+    return {int(age): float(weight) for age, _, weight in (item.partition("=") for item in spec.split(","))}
+
+
+def generate_beneficiaries(count, seed=0):
+    """
+    This function returns a beneficiaries response of count beneficiaries, a third of them partially vaccinated and
+    about half of them with an active appointment
+    """
+    rng = random.Random(seed)
+    beneficiaries = []
+    for idx in range(count):
+        partially = idx % 3 == 0
+        appointments = []
+        if partially:
+            appointments.append({"name": f"Mock Center {idx}", "state_name": "Mock State", "dose": 1,
+                                 "date": "01-06-2021", "slot": "09:00AM-11:00AM", "appointment_id": f"{idx}-1",
+                                 "session_id": f"{idx}-s1"})
+        if rng.random() < 0.5:
+            appointments.append({"name": f"Mock Center {idx}", "state_name": "Mock State", "dose": 2 if partially else 1,
+                                 "date": "01-09-2021", "slot": "11:00AM-01:00PM", "appointment_id": f"{idx}-2",
+                                 "session_id": f"{idx}-s2"})
+        beneficiaries.append({
+            "beneficiary_reference_id": str(10000000000000 + idx),
+            "name": f"Mock Beneficiary {idx}",
+            "birth_year": str(rng.randint(1950, 2003)),
+            "mobile_number": "9999",
+            "vaccination_status": "Partially Vaccinated" if partially else "Not Vaccinated",
+            "vaccine": "COVISHIELD" if partially else "",
+            "dose1_date": "01-06-2021" if partially else "",
+            "dose2_date": "",
+            "appointments": appointments,
+        })
+    return beneficiaries
+
+
+def peak_memory_kb(func):
+    # traced apart from the timings, tracing makes every allocation slower
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def bench_pipeline(args):
+    """
+    This function
+        1. Generates a calendarByDistrict payload per size, with the given age mix, fee types and dose capacities,
+        2. Times every stage of the filter and booking selection path and the whole path, staged and fused, and
+           measures the peak memory of each, and
+        3. Writes the results as json and, with --history, shows the change of every p50 since the previous entry
+    """
+    fee_type = ["Free", "Paid"]
+    excluded_pincodes = [{"pincode": str(110000 + idx)} for idx in range(args.excluded)]
+    excluded = excluded_pincode_set(excluded_pincodes)
+    beneficiaries = generate_beneficiaries(args.beneficiaries, seed=args.seed)
+    required = [{"bref_id": beneficiary["beneficiary_reference_id"]} for beneficiary in beneficiaries]
+    sizes = {}
+    for centers in args.centers:
+        resp = mock_server.generate_calendar(centers, args.sessions, seed=args.seed, age_mix=args.age_mix,
+                                             paid_ratio=args.paid_ratio, open_ratio=args.open_ratio,
+                                             max_capacity=args.max_capacity,
+                                             max_dose2_capacity=args.max_dose2_capacity)
+        by_age = utils.filter_centers_by_age(resp, args.age)
+        # filer_by_excluded_pincodes replaces the centers of the dict it is given, so it gets a copy every time
+        by_pincode = utils.filer_by_excluded_pincodes(dict(by_age), excluded_pincodes)
+        options = list(iter_viable_options(resp, args.age, 1, fee_type, args.dose, excluded_pincodes=excluded))
+        ranker = SlotRanker(rng=random.Random(args.seed))
+
+        stages = {
+            "filter_centers_by_age": lambda: utils.filter_centers_by_age(resp, args.age),
+            "filer_by_excluded_pincodes": lambda: utils.filer_by_excluded_pincodes(dict(by_age), excluded_pincodes),
+            "viable_options": lambda: utils.viable_options(by_pincode, 1, args.age, fee_type, args.dose),
+            "iter_viable_options": lambda: list(iter_viable_options(resp, args.age, 1, fee_type, args.dose,
+                                                                    excluded_pincodes=excluded)),
+            "rank": lambda: ranker.rank(options),
+            "attempts": lambda: ranker.attempts(options),
+            "check_active_appointment": lambda: utils.check_active_appointment(required, beneficiaries),
+            "staged_pipeline": lambda: utils.viable_options(
+                utils.filer_by_excluded_pincodes(utils.filter_centers_by_age(resp, args.age), excluded_pincodes), 1,
+                args.age, fee_type, args.dose),
+            "pipeline": lambda: ranker.attempts(ranker.rank(list(iter_viable_options(
+                resp, args.age, 1, fee_type, args.dose, excluded_pincodes=excluded)))),
+        }
+        results = {}
+        for name, stage in stages.items():
+            timings = time_calls(stage, args.repeat)
+            results[name] = {
+                "ms": {key: value * 1000 for key, value in summarize(timings).items()},
+                "peak_kb": peak_memory_kb(stage),
+            }
+        sizes[str(centers)] = {
+            "sessions": centers * args.sessions,
+            "options": len(options),
+            "payload_kb": len(json.dumps(resp)) / 1024,
+            "stages": results,
+        }
+
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "settings": {"sessions_per_center": args.sessions, "age_mix": args.age_mix, "paid_ratio": args.paid_ratio,
+                     "open_ratio": args.open_ratio, "max_capacity": args.max_capacity,
+                     "max_dose2_capacity": args.max_dose2_capacity, "age": args.age, "dose": args.dose,
+                     "excluded": args.excluded, "beneficiaries": args.beneficiaries, "repeat": args.repeat,
+                     "seed": args.seed},
+        "sizes": sizes,
+    }
+    print_report("Filter and booking selection", report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+    if args.history:
+        history = []
+        if os.path.exists(args.history):
+            with open(args.history) as f:
+                history = json.load(f)
+        if history:
+            previous = history[-1]
+            since = previous["commit"] or previous["timestamp"]
+            for centers, size in sizes.items():
+                for name, result in size["stages"].items():
+                    before = previous["sizes"].get(centers, {}).get("stages", {}).get(name)
+                    if before and before["ms"]["p50"]:
+                        change = result["ms"]["p50"] / before["ms"]["p50"] - 1
+                        print(f"{centers} centers, {name}: p50 {change:+.1%} since {since}")
+        history.append(report)
+        with open(args.history, "w") as f:
+            json.dump(history, f, indent=4)
+
+
+def recorded_locations(records):
+    """
+    This function returns the search option and the locations polled in a recording, from its calendar urls
+    """
+    districts, pincodes = {}, {}
+    for record in records:
+        parts = urlparse(record["url"])
+        query = parse_qs(parts.query)
+        if parts.path.endswith("/calendarByDistrict"):
+            district_id = query["district_id"][0]
+            districts.setdefault(district_id, {"district_id": district_id, "district_name": f"District {district_id}",
+                                               "alert_freq": 440 + ((2 * len(districts)) * 110)})
+        elif parts.path.endswith("/calendarByPin"):
+            pincode = query["pincode"][0]
+            pincodes.setdefault(pincode, {"pincode": pincode, "alert_freq": 440 + ((2 * len(pincodes)) * 110)})
+    if districts:
+        return 2, list(districts.values())
+    return 1, list(pincodes.values())
+
+
+def bench_replay(args):
+    """
+    This function
+        1. Replays a recording made with --record, latencies multiplied by --scale,
+        2. Runs check_and_book once per recorded poll cycle on the locations the recording polled, and
+        3. Reports cycle times and a digest of the booking attempts made, to compare two versions of the code
+    """
+    records = traffic.load_recording(args.recording)
+    search_option, location_dtls = recorded_locations(records)
+    if not location_dtls:
+        sys.exit(f"{args.recording} has no calendar calls")
+    calendar_calls = sum(1 for record in records if "/calendarBy" in record["url"])
+    cycles = args.cycles or max(1, calendar_calls // len(location_dtls))
+
+    adapter = traffic.start_replay(args.recording, args.scale)
+    attempts = []
+
+    def record_attempt(method, url, response, elapsed):
+        if url in (utils.BOOKING_URL, utils.RESCHEDULE_URL):
+            body = json.loads(response.request.body)
+            attempts.append((body["session_id"], body["slot"], response.status_code))
+
+    transport.add_response_hook(record_attempt)
+    request_header = {"Authorization": f"Bearer {mock_server.mock_token()}", "content-type": "application/json"}
+    beneficiary_dtls = [{"bref_id": "12345678901234", "name": "Replay Beneficiary", "vaccine": "", "age": args.age,
+                         "status": "Not Vaccinated", "dose1_date": "", "dose2_date": ""}]
+    calendar_snapshot = CalendarSnapshot() if args.diff else None
+    cycle_times, attempts_per_cycle = [], []
+    # the slots of a session are sampled at random, seeded so that two runs attempt the same ones
+    random.seed(args.seed)
+    try:
+        for _ in range(cycles):
+            before = len(attempts)
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                utils.check_and_book(request_header, beneficiary_dtls, location_dtls, search_option,
+                                     min_slots=1, ref_freq=0, auto_book="y", start_date=1, vaccine_type=None,
+                                     fee_type=["Free", "Paid"], mobile=None, captcha_automation=args.captcha,
+                                     captcha_api_choice=None, captcha_automation_api_key=None, dose_num=1,
+                                     excluded_pincodes=None, reschedule_inp=None,
+                                     calendar_snapshot=calendar_snapshot)
+            cycle_times.append(time.perf_counter() - started)
+            attempts_per_cycle.append(len(attempts) - before)
+    finally:
+        transport.remove_response_hook(record_attempt)
+        transport.set_adapter(None)
+
+    print_report("Replay", {
+        "recording": args.recording,
+        "records": len(records),
+        "locations": len(location_dtls),
+        "cycles": cycles,
+        "scale": args.scale,
+        "cycle_time_secs": summarize(cycle_times),
+        "attempts_per_cycle": summarize(attempts_per_cycle),
+        "attempts": len(attempts),
+        "booked": sum(1 for _, _, status in attempts if status == 200),
+        # the same recording and code attempt the same slots in the same order, a changed digest means they changed
+        "attempts_digest": hashlib.sha256(json.dumps(attempts).encode()).hexdigest()[:16],
+        "replay": adapter.stats(),
+    })
+
+
+def bench_captcha(args):
+    """
+    This function times the captcha pipeline per captcha: loading the local model, decoding with it, svg -> png
+    for the api solvers, and png -> gif for the manual window
+    """
+    import captcha
+
+    model = mock_server.load_captcha_model()
+    raw_svgs = [mock_server.generate_captcha_svg(model)[0] for _ in range(args.count)]
+    svgs = [captcha.captcha_svg({"captcha": svg}) for svg in raw_svgs]
+    pngs = [captcha.render_captcha_png(svg) for svg in svgs]
+
+    started = time.perf_counter()
+    decoder = captcha.CaptchaDecoder.from_file(captcha.MODEL_PATH)
+    model_load_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    for svg in raw_svgs:
+        decoder.decode(svg)
+    decode_secs = time.perf_counter() - started
+
+    def per_captcha(func, inputs):
+        timings = []
+        for item in inputs:
+            started = time.perf_counter()
+            func(item)
+            timings.append(time.perf_counter() - started)
+        return {key: value * 1000 for key, value in summarize(timings).items()}
+
+    print_report("Captcha", {
+        "captchas": args.count,
+        "model_load_ms": model_load_ms,
+        "decodes_per_sec": args.count / decode_secs,
+        "decode_ms": per_captcha(decoder.decode, raw_svgs),
+        "svg_to_png_ms": per_captcha(captcha.render_captcha_png, svgs),
+        "png_to_gif_ms": per_captcha(captcha.png_to_gif, pngs),
+    })
+
+
+# what each captcha mode imports on its first captcha, on top of the cold start
+CAPTCHA_MODE_IMPORTS = {
+    "ai": [],
+    "manual": ["svglib.svglib", "reportlab.graphics.renderPM", "PIL.Image", "PySimpleGUI"],
+    "api": ["svglib.svglib", "reportlab.graphics.renderPM", "anticaptchaofficial.imagecaptcha", "twocaptchaapi"],
+}
+
+
+def parse_importtime(stderr):
+    """
+    This function reads the "import time: self | cumulative | name" lines of python -X importtime into
+    (module, self_us, cumulative_us, depth) tuples
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def time_startup(code):
+    """
+    This function runs the code in a fresh interpreter with -X importtime, and returns the wall time in seconds
+    and the parsed imports
+    """
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], stderr=subprocess.PIPE,
+                            stdout=subprocess.DEVNULL, universal_newlines=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall_secs = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return wall_secs, parse_importtime(result.stderr)
+
+
+def bench_startup(args):
+    """
+    This function
+        1. Times a cold import of utils, which is what the booking script loads before its first prompt, and of
+           the extra modules of each captcha mode,
+        2. Reports the slowest imports by cumulative time, and
+        3. Appends the report to the history file, if given, and shows the change from the previous entry
+    """
+    modes = {}
+    slowest = {}
+    for mode in args.mode:
+        code = "; ".join(["import utils"] + [f"import {module}" for module in CAPTCHA_MODE_IMPORTS[mode]])
+        wall_times = []
+        import_times = []
+        for _ in range(args.runs):
+            wall_secs, imports = time_startup(code)
+            wall_times.append(wall_secs)
+            import_times.append(sum(cumulative for name, self_us, cumulative, depth in imports if depth == 0))
+            for name, self_us, cumulative, depth in imports:
+                slowest[name] = max(slowest.get(name, 0), cumulative)
+        modes[mode] = {
+            "wall_ms": {key: value * 1000 for key, value in summarize(wall_times).items()},
+            "import_ms": {key: value / 1000 for key, value in summarize(import_times).items()},
+        }
+
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "modes": modes,
+        "slowest_imports_ms": {name: cumulative / 1000 for name, cumulative in
+                               sorted(slowest.items(), key=lambda item: -item[1])[:args.top]},
+    }
+    print_report("Startup", report)
+
+    if args.history:
+        history = []
+        if os.path.exists(args.history):
+            with open(args.history) as f:
+                history = json.load(f)
+        if history:
+            previous = history[-1]
+            for mode, timings in modes.items():
+                if mode in previous["modes"]:
+                    change = timings["wall_ms"]["p50"] - previous["modes"][mode]["wall_ms"]["p50"]
+                    print(f"{mode}: p50 cold start {change:+.1f} ms since {previous['timestamp']}")
+        history.append(report)
+        with open(args.history, "w") as f:
+            json.dump(history, f, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the booking path")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    booking = commands.add_parser("booking", help="poll -> filter -> captcha -> book against the stand-in")
+    booking.add_argument("--cycles", type=int, default=10)
+    booking.add_argument("--districts", type=int, default=4)
+    booking.add_argument("--centers", type=int, default=10, help="Centers per district")
+    booking.add_argument("--sessions", type=int, default=7, help="Sessions per center")
+    booking.add_argument("--open-ratio", type=float, default=0.05, help="Share of sessions with capacity")
+    booking.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response")
+    booking.add_argument("--jitter", type=float, default=0.0)
+    booking.add_argument("--error", action="append", help="endpoint:status=probability, e.g. calendar:500=0.05")
+    booking.add_argument("--captcha", default="ai", choices=["ai"], help="Captcha mode used for the attempts")
+    booking.add_argument("--seed", type=int, default=0)
+    booking.add_argument("--diff", action="store_true", help="Keep a CalendarSnapshot across cycles")
+    booking.add_argument("--prefetch", action="store_true", help="Keep a solved captcha ready with CaptchaPrefetcher")
+    booking.set_defaults(func=bench_booking)
+
+    filters = commands.add_parser("filters", help="staged vs fused filtering of a calendar response")
+    filters.add_argument("--centers", type=int, default=500)
+    filters.add_argument("--sessions", type=int, default=7, help="Sessions per center")
+    filters.add_argument("--open-ratio", type=float, default=0.3, help="Share of sessions with capacity")
+    filters.add_argument("--excluded", type=int, default=10, help="Number of excluded pincodes")
+    filters.add_argument("--repeat", type=int, default=50)
+    filters.add_argument("--seed", type=int, default=0)
+    filters.set_defaults(func=bench_filters)
+
+    ranking = commands.add_parser("ranking", help="options to booking attempts, sort and sample vs SlotRanker")
+    ranking.add_argument("--centers", type=int, default=5000)
+    ranking.add_argument("--sessions", type=int, default=7, help="Sessions per center")
+    ranking.add_argument("--open-ratio", type=float, default=0.3, help="Share of sessions with capacity")
+    ranking.add_argument("--history", type=int, default=200, help="Number of centers with earlier attempts")
+    ranking.add_argument("--weights", default="free=1,fee=1", help="--rank-weights of the ranker")
+    ranking.add_argument("--repeat", type=int, default=20)
+    ranking.add_argument("--seed", type=int, default=0)
+    ranking.set_defaults(func=bench_ranking)
+
+    captcha = commands.add_parser("captcha", help="local decoder throughput and per captcha render latency")
+    captcha.add_argument("--count", type=int, default=200)
+    captcha.set_defaults(func=bench_captcha)
+
+    pipeline = commands.add_parser("pipeline", help="every filter and booking selection stage at several sizes")
+    pipeline.add_argument("--centers", type=int, action="append",
+                          help="Centers of the generated payload, may be repeated; 10, 100, 1000 and 5000 by default")
+    pipeline.add_argument("--sessions", type=int, default=7, help="Sessions per center")
+    pipeline.add_argument("--age-mix", type=parse_age_mix, default={18: 0.5, 45: 0.5},
+                          help="Weights of the session age limits, e.g. 18=0.7,45=0.3")
+    pipeline.add_argument("--paid-ratio", type=float, default=0.2, help="Share of paid centers")
+    pipeline.add_argument("--open-ratio", type=float, default=0.3, help="Share of sessions with capacity")
+    pipeline.add_argument("--max-capacity", type=int, default=50, help="Most dose1 capacity of a session")
+    pipeline.add_argument("--max-dose2-capacity", type=int, help="Most dose2 capacity of a session")
+    pipeline.add_argument("--age", type=int, default=30, help="Age the sessions are filtered for")
+    pipeline.add_argument("--dose", type=int, default=1, choices=[1, 2])
+    pipeline.add_argument("--excluded", type=int, default=10, help="Number of excluded pincodes")
+    pipeline.add_argument("--beneficiaries", type=int, default=100,
+                          help="Beneficiaries of the check_active_appointment stage")
+    pipeline.add_argument("--repeat", type=int, default=20)
+    pipeline.add_argument("--seed", type=int, default=0)
+    pipeline.add_argument("--output", help="JSON file the report is written to")
+    pipeline.add_argument("--history", help="JSON file the report is appended to, to compare commits")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    replay = commands.add_parser("replay", help="check_and_book on a recording made with --record")
+    replay.add_argument("recording", help="gzip JSONL file written by --record")
+    replay.add_argument("--scale", type=float, default=0.0, help="Multiply the recorded latencies by this")
+    replay.add_argument("--cycles", type=int, help="Poll cycles to run, as many as recorded by default")
+    replay.add_argument("--age", type=int, default=30, help="Age of the beneficiary the sessions are filtered for")
+    replay.add_argument("--captcha", default="ai", choices=["ai"], help="Captcha mode used for the attempts")
+    replay.add_argument("--diff", action="store_true", help="Keep a CalendarSnapshot across cycles")
+    replay.add_argument("--seed", type=int, default=0)
+    replay.set_defaults(func=bench_replay)
+
+    startup = commands.add_parser("startup", help="cold start import time, per captcha mode")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--mode", action="append", choices=sorted(CAPTCHA_MODE_IMPORTS),
+                         help="Captcha modes to time, all by default")
+    startup.add_argument("--top", type=int, default=10, help="Number of slowest imports to show")
+    startup.add_argument("--history", help="JSON file the report is appended to, to track cold start over time")
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    if args.command == "startup" and not args.mode:
+        args.mode = sorted(CAPTCHA_MODE_IMPORTS)
+    if args.command == "pipeline" and not args.centers:
+        args.centers = [10, 100, 1000, 5000]
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import threading
+import time
+
+# a booking made this recently is assumed not to show in the capacity another loop sees yet
+RECENT_BOOKING_SECS = 60
+# returned by attempt() when the seats are taken, a booking function that fails returns None
+CLAIM_REFUSED = "claim refused"
+
+
+class BookingCoordinator:
+    """
+    Shared by booking loops that run at the same time for beneficiaries of one mobile number.
+
+    A loop claims a session before attempting it, and a session is skipped while the claims in flight and its
+    recent bookings already cover the capacity the loop saw, so two loops do not go for the same last slot. Claims
+    never wait for a booking. booking_lock is held from fetching a captcha to the booking response, as CoWIN keeps
+    one captcha per mobile number; the backoff between retries is outside it.
+    """
+
+    def __init__(self, recent_secs=RECENT_BOOKING_SECS):
+        self.recent_secs = recent_secs
+        self.lock = threading.Lock()
+        self.booking_lock = threading.Lock()
+        self.in_flight = {}
+        self.bookings = {}
+        self.started = {}
+        self.booked = {}
+
+    def start(self, name):
+        with self.lock:
+            self.started.setdefault(name, time.time())
+
+    def finish(self, name):
+        with self.lock:
+            self.booked[name] = time.time()
+
+    def claim(self, session_id, available):
+        """
+        This function claims a seat of the session, it returns False when the seats are already taken
+        """
+        with self.lock:
+            now = time.time()
+            recent = [booked_at for booked_at in self.bookings.get(session_id, []) if now - booked_at < self.recent_secs]
+            self.bookings[session_id] = recent
+            if self.in_flight.get(session_id, 0) + len(recent) >= available:
+                return False
+            self.in_flight[session_id] = self.in_flight.get(session_id, 0) + 1
+            return True
+
+    def release(self, session_id, booked=False):
+        with self.lock:
+            self.in_flight[session_id] -= 1
+            if booked:
+                self.bookings.setdefault(session_id, []).append(time.time())
+
+    def attempt(self, session_id, available, book):
+        """
+        This function
+            1. Claims a seat of the session, returning CLAIM_REFUSED without booking when it cannot,
+            2. Calls book(), without holding the lock, and
+            3. Releases the claim and returns the booking status
+        """
+        if not self.claim(session_id, available):
+            return CLAIM_REFUSED
+        booking_status = None
+        try:
+            booking_status = book()
+        finally:
+            self.release(session_id, booked=booking_status == 1000)
+        return booking_status
+
+    def report(self):
+        """
+        This function returns the time to booking of every loop, None for the ones not booked
+        """
+        with self.lock:
+            return {name: round(self.booked[name] - started, 1) if name in self.booked else None
+                    for name, started in self.started.items()}
@@ -0,0 +1,71 @@
+class CalendarDelta:
+    """
+    Changes between two poll cycles: sessions that newly opened, sessions with more capacity, sessions that went away
+    """
+
+    def __init__(self, opened, increased, closed):
+        self.opened = opened
+        self.increased = increased
+        self.closed = closed
+
+    @property
+    def changed(self):
+        return self.opened + self.increased
+
+    def __bool__(self):
+        return bool(self.opened or self.increased or self.closed)
+
+    def __repr__(self):
+        return f"CalendarDelta(opened={len(self.opened)}, increased={len(self.increased)}, closed={len(self.closed)})"
+
+
+class CalendarSnapshot:
+    """
+    Calendar state of the previous poll cycle, keyed by session_id.
+
+    It also remembers the raw response of every location, so an unchanged response is not parsed and filtered again.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.locations = {}
+
+    def location_options(self, location_id, content):
+        """
+        This function returns the options built from the previous response of the location if it is unchanged, else None
+        """
+        cached = self.locations.get(location_id)
+        if cached is not None and cached[0] == hash(content) and cached[1] == content:
+            return cached[2]
+        return None
+
+    def remember_location(self, location_id, content, options):
+        self.locations[location_id] = (hash(content), content, options)
+
+    def update(self, options):
+        """
+        This function
+            1. Compares the options of this cycle with the previous cycle,
+            2. Keeps the options of this cycle as the new state, and
+            3. Returns the CalendarDelta
+        """
+        current = {}
+        opened = []
+        increased = []
+        for option in options:
+            session_id = option.session_id
+            current[session_id] = option
+            previous = self.sessions.get(session_id)
+            if previous is None:
+                opened.append(option)
+            elif option.available > previous.available:
+                increased.append(option)
+        closed = [option for session_id, option in self.sessions.items() if session_id not in current]
+        self.sessions = current
+        return CalendarDelta(opened, increased, closed)
+
+    def forget(self, session_id):
+        """
+        This function drops a session from the state, so that it shows up as opened again in the next cycle
+        """
+        self.sessions.pop(session_id, None)
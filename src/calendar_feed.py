@@ -0,0 +1,93 @@
+import threading
+import time
+import transport
+from concurrent.futures import ThreadPoolExecutor
+
+# maximum number of calendar requests in flight at once when a cycle is prefetched
+FEED_FETCH_WORKERS = 8
+
+
+class CalendarFeed:
+    """
+    Calendar responses of one poll cycle, shared by every profile that polls the same locations: each url is
+    fetched once per cycle and the response is handed to all of them.
+
+    Only 200 responses are kept, so a 401 for one token does not reach profiles polling with another one.
+
+    Loops that poll on their own pace, instead of in cycles, pass max_age: a response is then served until it is
+    that many seconds old, and a url being fetched is waited for rather than fetched a second time.
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self.responses = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.fetched = 0
+        self.served = 0
+
+    def new_cycle(self):
+        with self.lock:
+            self.responses = {}
+
+    def prefetch(self, request_header, urls):
+        """
+        This function fetches the urls not fetched yet in this cycle, at most FEED_FETCH_WORKERS at a time
+        """
+        with self.lock:
+            missing = [url for url in dict.fromkeys(urls) if self._cached(url) is None]
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(FEED_FETCH_WORKERS, len(missing))) as pool:
+                list(pool.map(lambda url: self.get(request_header, url), missing))
+
+    def get(self, request_header, url):
+        while True:
+            with self.lock:
+                cached = self._cached(url)
+                if cached is not None:
+                    self.served += 1
+                    return cached
+                pending = self.pending.get(url)
+                if pending is None:
+                    pending = self.pending[url] = threading.Event()
+                    break
+            # another caller is fetching the url, use its response unless it failed
+            pending.wait()
+
+        try:
+            resp = transport.get(url, headers=request_header)
+            with self.lock:
+                self.fetched += 1
+                self.served += 1
+                if resp.status_code == 200:
+                    self.responses[url] = (resp, time.time())
+            return resp
+        finally:
+            with self.lock:
+                del self.pending[url]
+            pending.set()
+
+    def _cached(self, url):
+        cached = self.responses.get(url)
+        if cached is not None and (self.max_age is None or time.time() - cached[1] < self.max_age):
+            return cached[0]
+        return None
+
+    def fetch_calendars(self, request_header, base_url, location_ids, start_dates):
+        """
+        This function is a drop-in for utils.fetch_calendars that serves the responses of this cycle
+        """
+        urls = [base_url.format(location_id, start_date) for location_id in location_ids for start_date in start_dates]
+        self.prefetch(request_header, urls)
+
+        def fetch(url):
+            try:
+                return self.get(request_header, url), None
+            except Exception as e:
+                return None, e
+
+        return [fetch(url) for url in urls]
+
+    def stats(self):
+        with self.lock:
+            return {"fetched": self.fetched, "served": self.served}
@@ -0,0 +1,81 @@
+import datetime
+from collections import namedtuple
+
+# one viable session; the first DISPLAY_FIELD_COUNT fields are the ones shown to the user, day is the parsed date
+Option = namedtuple("Option", ["name", "district", "pincode", "vaccine", "fee_type", "fee", "available", "date",
+                               "slots", "center_id", "session_id", "day"])
+DISPLAY_FIELD_COUNT = 9
+
+
+def parse_date(date):
+    """
+    This function parses a CoWIN dd-mm-yyyy date, much faster than datetime.strptime
+    """
+    return datetime.date(int(date[6:10]), int(date[3:5]), int(date[0:2]))
+
+
+def display_rows(options):
+    """
+    This function returns the header and rows to show the options in a table, without copying them
+    """
+    header = ["idx"] + list(Option._fields[:DISPLAY_FIELD_COUNT])
+    rows = [(idx + 1,) + option[:DISPLAY_FIELD_COUNT] for idx, option in enumerate(options)]
+    return header, rows
+
+
+def excluded_pincode_set(excluded_pincodes):
+    """
+    This function turns the saved [{"pincode": "110001"}, ...] list into a set of pincode strings
+    """
+    if not excluded_pincodes:
+        return frozenset()
+    return frozenset(str(item["pincode"]) for item in excluded_pincodes)
+
+
+def iter_viable_options(resp, min_age_booking, minimum_slots, fee_type, dose_num, vaccine_type=None,
+                        excluded_pincodes=frozenset()):
+    """
+    This function
+        1. Walks the centers and sessions of a calendar response once, without changing it,
+        2. Keeps sessions of the age group of min_age_booking, open to that age, of a center with an accepted fee
+           type and pincode, of the given vaccine, with at least minimum_slots capacity for dose_num, and
+        3. Yields an Option for every session kept
+    """
+    center_age_filter = 45 if min_age_booking >= 45 else 18
+    dose_key = f"available_capacity_dose{dose_num}"
+    days = {}
+
+    for center in resp.get("centers", ()):
+        if center["fee_type"] not in fee_type:
+            continue
+        if excluded_pincodes and str(center["pincode"]) in excluded_pincodes:
+            continue
+        for session in center["sessions"]:
+            min_age_limit = session["min_age_limit"]
+            if min_age_limit != center_age_filter or min_age_limit > min_age_booking:
+                continue
+            if vaccine_type and session["vaccine"] != vaccine_type:
+                continue
+            available_capacity = min(session[dose_key], session["available_capacity"])
+            if available_capacity < minimum_slots:
+                continue
+            date = session["date"]
+            day = days.get(date)
+            if day is None:
+                day = days[date] = parse_date(date)
+            yield Option(center["name"], center["district_name"], center["pincode"], session["vaccine"],
+                         center["fee_type"], session.get("fee", "0"), available_capacity, date, session["slots"],
+                         center["center_id"], session["session_id"], day)
+
+
+def unique_sessions(options):
+    """
+    This function keeps the first option of every session, e.g. of a session returned for two date windows
+    """
+    seen = set()
+    unique = []
+    for option in options:
+        if option.session_id not in seen:
+            seen.add(option.session_id)
+            unique.append(option)
+    return unique
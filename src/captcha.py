@@ -1,29 +1,57 @@
-from svglib.svglib import svg2rlg
-from reportlab.graphics import renderPM
-import PySimpleGUI as sg
+# svglib, reportlab, PIL, PySimpleGUI and the solver clients are slow to import, so each is imported by the
+# function of the captcha mode that needs it; the "ai" mode imports none of them
 import re
-from PIL import Image
-from anticaptchaofficial.imagecaptcha import imagecaptcha
-from twocaptchaapi import TwoCaptchaApi
-from bs4 import BeautifulSoup
+import io
 import json
 import base64
 import os
 import sys
+from functools import lru_cache
 
+MODEL_PATH = os.path.join(os.path.dirname(sys.argv[0]), "model.txt")
+
+# tags and attributes of the svg paths, and pieces of the path data, read by the local decoder
+PATH_TAG = re.compile(r'<path\b[^>]*>', re.IGNORECASE)
+FILL_ATTRIBUTE = re.compile(r'\sfill\s*=\s*["\']([^"\']*)["\']', re.IGNORECASE)
+PATH_ATTRIBUTE = re.compile(r'\sd\s*=\s*["\']([^"\']*)["\']', re.IGNORECASE)
+MOVE_INDEX = re.compile(r'M(\d+)')
+NOT_A_COMMAND = re.compile(r'[^A-Z]+')
+
+# paths drawn with fill="none" are noise lines over the captcha text
+NOISE_PATHS = re.compile('(<path d=)(.*?)(fill=\"none\"/>)')
+
+
+def captcha_svg(resp):
+    return NOISE_PATHS.sub('', resp['captcha'])
 
-def captcha_builder_manual(resp):
-    with open('captcha.svg', 'w') as f:
-        f.write(re.sub('(<path d=)(.*?)(fill="none"/>)', '', resp['captcha']))
 
-    drawing = svg2rlg('captcha.svg')
-    renderPM.drawToFile(drawing, "captcha.png", fmt="PNG")
+def render_captcha_png(svg):
+    """
+    This function renders the captcha svg to png bytes in memory
+    """
+    from svglib.svglib import svg2rlg
+    from reportlab.graphics import renderPM
 
-    im = Image.open('captcha.png')
+    drawing = svg2rlg(io.BytesIO(svg.encode('utf-8')))
+    return renderPM.drawToString(drawing, fmt="PNG")
+
+
+def png_to_gif(png):
+    from PIL import Image
+
+    im = Image.open(io.BytesIO(png))
     im = im.convert('RGB').convert('P', palette=Image.ADAPTIVE)
-    im.save('captcha.gif')
+    buffer = io.BytesIO()
+    im.save(buffer, format='GIF')
+    return buffer.getvalue()
+
+
+def captcha_builder_manual(resp):
+    import PySimpleGUI as sg
+
+    gif = png_to_gif(render_captcha_png(captcha_svg(resp)))
 
-    layout = [[sg.Image('captcha.gif')],
+    layout = [[sg.Image(data=base64.b64encode(gif))],
               [sg.Text("Enter Captcha Below")],
               [sg.Input(key='input')],
               [sg.Button('Submit', bind_return_key=True)]]
@@ -38,21 +66,19 @@ def captcha_builder_manual(resp):
 
 
 def captcha_builder_api(resp, api_key, which_captcha):
-    with open('captcha.svg', 'w') as f:
-        f.write(re.sub('(<path d=)(.*?)(fill=\"none\"/>)', '', resp['captcha']))
-
-    drawing = svg2rlg('captcha.svg')
-    renderPM.drawToFile(drawing, "captcha.png", fmt="PNG")
+    png = render_captcha_png(captcha_svg(resp))
 
     if which_captcha == '0':  # anticaptchaofficial
+        from anticaptchaofficial.imagecaptcha import imagecaptcha
         solver = imagecaptcha()
         solver.set_verbose(1)
         solver.set_key(api_key)
-        captcha_text = solver.solve_and_return_solution("captcha.png")
+        captcha_text = solver.solve_and_return_solution(None, body=png)
 
     elif which_captcha == '1':  # twocaptchaapi
+        from twocaptchaapi import TwoCaptchaApi
         api = TwoCaptchaApi(api_key)
-        captcha_predicted = api.solve("captcha.png")
+        captcha_predicted = api.solve(io.BytesIO(png))
         captcha_text = captcha_predicted.await_result()
     else:
         print("Invalid captcha API choice")
@@ -63,23 +89,41 @@ def captcha_builder_api(resp, api_key, which_captcha):
     return captcha_text
 
 
+class CaptchaDecoder:
+    """
+    Local captcha solver: every filled path of the svg is a character, identified by its sequence of path commands
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            return cls(json.loads(base64.b64decode(f.read().encode('ascii'))))
+
+    def decode(self, svg):
+        characters = {}
+        for tag in PATH_TAG.findall(svg):
+            fill = FILL_ATTRIBUTE.search(tag)
+            path = PATH_ATTRIBUTE.search(tag)
+            if fill is None or '#' not in fill.group(1) or path is None:
+                continue
+            encoded = path.group(1).upper()
+            index = MOVE_INDEX.search(encoded)
+            if index is None:
+                continue
+            characters[int(index.group(1))] = self.model.get(NOT_A_COMMAND.sub('', encoded), '')
+        return ''.join(characters[index] for index in sorted(characters))
+
+
+@lru_cache(maxsize=None)
+def get_decoder():
+    """
+    This function loads the local model once per process, on first use
+    """
+    return CaptchaDecoder.from_file(MODEL_PATH)
+
+
 def captcha_builder_auto(resp):
-    model = open(os.path.join(os.path.dirname(sys.argv[0]), "model.txt")).read()
-    svg_data = resp['captcha']
-    soup = BeautifulSoup(svg_data, 'html.parser')
-    model = json.loads(base64.b64decode(model.encode('ascii')))
-    CAPTCHA = {}
-
-    for path in soup.find_all('path', {'fill': re.compile("#")}):
-        ENCODED_STRING = path.get('d').upper()
-        INDEX = re.findall('M(\d+)', ENCODED_STRING)[0]
-        ENCODED_STRING = re.findall("([A-Z])", ENCODED_STRING)
-        ENCODED_STRING = "".join(ENCODED_STRING)
-        CAPTCHA[int(INDEX)] = model.get(ENCODED_STRING)
-
-    CAPTCHA = sorted(CAPTCHA.items())
-    CAPTCHA_STRING = ''
-
-    for char in CAPTCHA:
-        CAPTCHA_STRING += char[1]
-    return CAPTCHA_STRING
+    return get_decoder().decode(resp['captcha'])
@@ -0,0 +1,136 @@
+import threading
+import time
+
+
+class CaptchaPrefetcher:
+    """
+    Keeps one solved captcha ready, so that a booking attempt does not wait for getRecaptcha and the solver.
+
+    CoWIN keeps a single captcha per user, so nothing is fetched in the background between take() and refill(),
+    i.e. while a booking attempt may be fetching or using a captcha of its own, and take() waits for a fetch that
+    is already in flight rather than racing it. Loops booking at the same time can share one prefetcher, busy counts
+    their attempts between take() and refill(). Captchas are only fetched while set_active(True), i.e. while there
+    are slots to book, and not after a booking went through.
+    """
+
+    def __init__(self, fetch, max_age=60):
+        # fetch(request_header) returns a solved captcha or None
+        self.fetch = fetch
+        self.max_age = max_age
+        self.request_header = None
+        self.ready = None
+        self.busy = 0
+        self.active = False
+        self.fetching = False
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = None
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.saved_secs = 0.0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="captcha-prefetch", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def set_request_header(self, request_header):
+        """
+        This function sets the request header to fetch with, a captcha fetched with another token is never used
+        """
+        with self.condition:
+            self.request_header = request_header
+            self.condition.notify_all()
+
+    def set_active(self, active):
+        """
+        This function starts or stops fetching captchas, e.g. when slots are found or no longer available
+        """
+        with self.condition:
+            self.active = active
+            self.condition.notify_all()
+
+    def take(self):
+        """
+        This function returns the ready captcha, or None when there is none or it is older than max_age
+        """
+        with self.condition:
+            self.busy += 1
+            while self.fetching:
+                self.condition.wait()
+            ready, self.ready = self.ready, None
+            if ready is None:
+                self.misses += 1
+                return None
+            captcha, fetched_at, fetch_secs, authorization = ready
+            if authorization != self.request_header.get("Authorization"):
+                self.misses += 1
+                return None
+            if time.time() - fetched_at > self.max_age:
+                self.expired += 1
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_secs += fetch_secs
+            return captcha
+
+    def refill(self, more=True):
+        """
+        This function is called once the booking attempt is done with its captcha, to fetch the next one unless more
+        is False, e.g. after a booking that went through
+        """
+        with self.condition:
+            self.busy = max(self.busy - 1, 0)
+            if not more:
+                self.active = False
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            attempts = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": round(self.hits / attempts, 2) if attempts else None,
+                "saved_secs": round(self.saved_secs, 2),
+            }
+
+    def _wait_for_work(self):
+        with self.condition:
+            while not self.stopped:
+                fresh = (self.ready is not None and time.time() - self.ready[1] <= self.max_age
+                         and self.ready[3] == self.request_header.get("Authorization"))
+                if self.active and not self.busy and self.request_header is not None and not fresh:
+                    self.fetching = True
+                    return self.request_header
+                self.condition.wait(self.max_age / 2)
+            return None
+
+    def _run(self):
+        while True:
+            request_header = self._wait_for_work()
+            if request_header is None:
+                return
+            authorization = request_header.get("Authorization")
+            started = time.perf_counter()
+            try:
+                captcha = self.fetch(request_header)
+            except Exception as e:
+                print(f"Captcha prefetch failed: {e}")
+                captcha = None
+            fetch_secs = time.perf_counter() - started
+            with self.condition:
+                self.fetching = False
+                if captcha:
+                    self.ready = (captcha, time.time(), fetch_secs, authorization)
+                self.condition.notify_all()
+            if not captcha:
+                time.sleep(5)
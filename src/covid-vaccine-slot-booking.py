@@ -1,44 +1,120 @@
 import argparse
-import jwt
+import alerts
+import metrics
+import otp_sources
+import threading
+import traffic
+import transport
+import utils
 from types import SimpleNamespace
+from booking_coordinator import BookingCoordinator
+from calendar_feed import CalendarFeed
+from calendar_diff import CalendarSnapshot
+from captcha_prefetch import CaptchaPrefetcher
+from headless import apply_args, collect_details, exit_on_errors, get_token, load_config, validate_config
+from poll_scheduler import PollScheduler
+from ranking import BookingHistory, SlotRanker, parse_weights
+from retry import POLICIES
+from token_manager import TokenManager
 from utils import *
-from useragent import get_user_agent
 
 
-def is_token_valid(token):
-    payload = jwt.decode(token, options={"verify_signature": False})
-    remaining_seconds = payload['exp'] - int(time.time())
-    if remaining_seconds <= 1 * 30:  # 30 secs early before expiry for clock issues
-        return False
-    if remaining_seconds <= 60:
-        print("Token is about to expire in next 1 min ...")
-    return True
+# parallel booking loops share calendar responses up to this many seconds old
+PARALLEL_FEED_MAX_AGE = 5
+# only one booking loop at a time asks for the OTP when it is entered by hand
+MANUAL_OTP_LOCK = threading.Lock()
 
 
 def multi_cycle_book(request_header, token, mobile, otp_pref, base_request_header, otp_validation_header, info,
-                     beneficiary_dtls, collected_details):
-    while True:  # infinite-loop
-        # create new request_header
-        request_header = copy.deepcopy(base_request_header)
-        request_header["Authorization"] = f"Bearer {token}"
+                     beneficiary_dtls, collected_details, captcha_max_age=None, parallel=False, slot_ranker=None,
+                     pipelined=False):
+    # the scheduler decides when to poll next from the rate budget, never sooner than refresh_freq
+    poll_scheduler = PollScheduler(min_interval=info.refresh_freq)
+    transport.add_response_hook(poll_scheduler.observe)
+    # a solved captcha is kept ready only when solving is free and needs no one at the keyboard
+    captcha_prefetcher = None
+    if captcha_max_age and info.captcha_automation == "ai":
+        captcha_prefetcher = CaptchaPrefetcher(
+            lambda header: generate_captcha(header, info.captcha_automation, info.captcha_automation_api_key,
+                                            info.captcha_api_choice),
+            max_age=captcha_max_age).start()
+    # with the OTP read from IFTTT the token is renewed in the background while polling goes on
+    renew = None
+    if otp_pref == "n":
+        renew = lambda: generate_token_OTP(mobile, base_request_header, otp_validation_header)
+    token_manager = TokenManager(token, renew=renew)
+    booking_coordinator = None
+    try:
+        if not parallel:
+            run_booking_cycles(token_manager, mobile, otp_pref, base_request_header, otp_validation_header, info,
+                               beneficiary_dtls, collected_details, CalendarSnapshot(), poll_scheduler,
+                               captcha_prefetcher, slot_ranker=slot_ranker, pipelined=pipelined)
+        else:
+            # one loop per beneficiary, all of them on the same calendar responses and one booking at a time
+            calendar_feed = CalendarFeed(max_age=PARALLEL_FEED_MAX_AGE)
+            booking_coordinator = BookingCoordinator()
+            loops = [threading.Thread(target=run_booking_cycles, name=f"booking-{beneficiary['name']}", daemon=True,
+                                      args=(token_manager, mobile, otp_pref, base_request_header,
+                                            otp_validation_header, info, [beneficiary], collected_details,
+                                            CalendarSnapshot(), poll_scheduler, captcha_prefetcher, calendar_feed,
+                                            booking_coordinator, slot_ranker),
+                                      kwargs={"pipelined": pipelined})
+                     for beneficiary in beneficiary_dtls]
+            for loop in loops:
+                loop.start()
+            for loop in loops:
+                while loop.is_alive():
+                    loop.join(1)
+    finally:
+        token_manager.stop()
+        if booking_coordinator is not None:
+            print(f"Time to booking in seconds: {booking_coordinator.report()}")
+        transport.remove_response_hook(poll_scheduler.observe)
+        if captcha_prefetcher is not None:
+            captcha_prefetcher.stop()
+            print(f"Captcha prefetch: {captcha_prefetcher.stats()}")
+
+
+def wait_for_next_poll(poll_scheduler, calls_per_cycle):
+    plan = poll_scheduler.plan(calls_per_cycle)
+    for i in range(int(round(plan["next_delay"])), 0, -1):
+        msg = (f"Next update in {i} seconds.. ({plan['calls_in_window']} calls in window of {plan['budget']}, "
+               f"backoff x{plan['backoff']}{', boosted' if plan['boosted'] else ''})")
+        print(msg, end="\r", flush=True)
+        time.sleep(1)
+
 
+def run_booking_cycles(token_manager, mobile, otp_pref, base_request_header, otp_validation_header, info,
+                       beneficiary_dtls, collected_details, calendar_snapshot, poll_scheduler, captcha_prefetcher,
+                       calendar_feed=None, booking_coordinator=None, slot_ranker=None, pipelined=False):
+    # the token manager swaps the Authorization header of this dict in place whenever the token is renewed
+    request_header = token_manager.bind(copy.deepcopy(base_request_header))
+    if captcha_prefetcher is not None:
+        captcha_prefetcher.set_request_header(request_header)
+    name = ", ".join(beneficiary["name"] for beneficiary in beneficiary_dtls)
+    # details saved by an earlier version have no date_windows
+    date_windows = getattr(info, "date_windows", 1)
+    if booking_coordinator is not None:
+        booking_coordinator.start(name)
+
+    retry = POLICIES["cycle"].start()
+    while True:  # infinite-loop
         # call function to check and book slots
         try:
-            token_valid = is_token_valid(token)
-            # If token is not, generate new one
-            if not token_valid:
+            token_manager.maybe_renew()
+            # If token is not valid, wait for the renewal or generate new one
+            if not token_manager.is_valid():
                 print('Token is INVALID.')
-                token = None
-                while token is None:
-                    if otp_pref == "n":
-                        try:
-                            token = generate_token_OTP(mobile, base_request_header, otp_validation_header)
-                        except Exception as e:
-                            print(str(e))
-                            print('OTP Retrying in 5 seconds')
-                            time.sleep(5)
-                    elif otp_pref == "y":
-                        token = generate_token_OTP_manual(mobile, base_request_header, otp_validation_header)
+                if token_manager.renew is not None:
+                    token_manager.wait_until_valid()
+                else:
+                    with MANUAL_OTP_LOCK:
+                        # another loop may have renewed it while this one waited
+                        if not token_manager.is_valid():
+                            token = None
+                            while token is None:
+                                token = generate_token_OTP_manual(mobile, base_request_header, otp_validation_header)
+                            token_manager.set_token(token)
             break_loop = check_and_book(request_header, beneficiary_dtls, info.location_dtls, info.search_option,
                                         min_slots=info.minimum_slots,
                                         ref_freq=info.refresh_freq,
@@ -52,51 +128,181 @@ def multi_cycle_book(request_header, token, mobile, otp_pref, base_request_heade
                                         captcha_automation_api_key=info.captcha_automation_api_key,
                                         dose_num=get_dose_num(collected_details),
                                         excluded_pincodes=info.excluded_pincodes,
-                                        reschedule_inp=info.reschedule_inp)
+                                        reschedule_inp=info.reschedule_inp,
+                                        calendar_snapshot=calendar_snapshot,
+                                        poll_scheduler=poll_scheduler,
+                                        captcha_prefetcher=captcha_prefetcher,
+                                        calendar_feed=calendar_feed,
+                                        booking_coordinator=booking_coordinator,
+                                        slot_ranker=slot_ranker,
+                                        date_windows=date_windows,
+                                        pipelined=pipelined)
             if break_loop == "break":
+                if booking_coordinator is not None:
+                    booking_coordinator.finish(name)
                 break
+            # every window is one more calendar call of the cycle, the poll interval stretches to stay in budget
+            retry.reset()
+            wait_for_next_poll(poll_scheduler, len(info.location_dtls) * date_windows)
 
         except Exception as e:
             print(str(e))
-            print('Retrying in 5 seconds ')
-            time.sleep(5)
+            retry.wait(f"{type(e).__name__} in the poll cycle")
+
+
+def book_for_beneficiaries(request_header, token, mobile, otp_pref, base_request_header, otp_validation_header,
+                           info, collected_details, captcha_max_age, parallel=False, slot_ranker=None,
+                           pipelined=False):
+    # prompts and captcha windows cannot be shown by several loops at once
+    if parallel and (info.auto_book == "n" or info.captcha_automation == "n"):
+        print("Parallel booking needs auto booking and captcha automation, booking one beneficiary at a time")
+        parallel = False
+    if info.minimum_slots != len(info.beneficiary_dtls) and parallel and len(info.beneficiary_dtls) > 1:
+        multi_cycle_book(request_header, token, mobile, otp_pref, base_request_header, otp_validation_header,
+                         info, info.beneficiary_dtls, collected_details, captcha_max_age, parallel=True,
+                         slot_ranker=slot_ranker, pipelined=pipelined)
+    elif info.minimum_slots != len(info.beneficiary_dtls):
+        for beneficiary in info.beneficiary_dtls:
+            multi_cycle_book(request_header, token, mobile, otp_pref, base_request_header, otp_validation_header,
+                             info, [beneficiary], collected_details, captcha_max_age, slot_ranker=slot_ranker,
+                             pipelined=pipelined)
+    else:
+        multi_cycle_book(request_header, token, mobile, otp_pref, base_request_header, otp_validation_header,
+                         info, info.beneficiary_dtls, collected_details, captcha_max_age, slot_ranker=slot_ranker,
+                         pipelined=pipelined)
+
+
+def run_headless(args, config, base_request_header, otp_validation_header, common_header, slot_ranker):
+    """
+    This function
+        1. Gets a token from --token or the OTP read from IFTTT,
+        2. Looks up the beneficiaries when the config has only their reference ids, and
+        3. Polls and books without a single prompt
+    """
+    mobile = config["mobile"]
+    token = args.token or get_token(mobile, base_request_header, otp_validation_header)
+
+    request_header = copy.deepcopy(common_header)
+    request_header["Authorization"] = f"Bearer {token}"
+    collected_details, errors = collect_details(config, request_header)
+    exit_on_errors(errors)
+
+    print("\n================================= Headless Info =================================\n")
+    display_info_dict(collected_details)
+    info = SimpleNamespace(**collected_details)
+    book_for_beneficiaries(request_header, token, mobile, "n", base_request_header, otp_validation_header, info,
+                           collected_details, args.captcha_max_age, args.parallel_beneficiaries, slot_ranker,
+                           args.pipelined)
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--token', help='Pass token directly')
+    parser.add_argument('--pool-size', type=int, default=transport.POOL_SIZE,
+                        help='Number of keep-alive connections to keep open to CoWIN')
+    parser.add_argument('--api-base', help='Send CoWIN API calls to this base url instead, e.g. a local mock_server.py')
+    parser.add_argument('--timeout', action='append',
+                        help='Connect/read timeout of an endpoint as ENDPOINT=CONNECT/READ seconds, e.g. calendar=2/6; '
+                             'endpoints: ' + ', '.join(transport.ENDPOINT_TIMEOUTS) + '; may be repeated')
+    parser.add_argument('--hedge', action='store_true',
+                        help='Send a calendar request again when it takes longer than the p95 latency, and use the '
+                             'response that comes first')
+    parser.add_argument('--otp-source', default='kvdb',
+                        help='Where the OTP SMS read automatically comes from: kvdb (the IFTTT bucket, default) or '
+                             'webhook:PORT to receive it from the SMS forwarder at http://<this machine>:PORT/otp/<mobile>')
+    parser.add_argument('--alert', action='append',
+                        help='Where alerts go: sound (default), desktop, log:PATH or webhook:URL; may be repeated')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve latency and booking metrics as Prometheus text at '
+                             'http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--record', help='Write every CoWIN call to this gzip JSONL file, tokens redacted')
+    parser.add_argument('--replay', help='Answer CoWIN calls from a --record file instead of the network')
+    parser.add_argument('--replay-scale', type=float, default=1.0,
+                        help='Multiply the recorded latencies by this on replay, 0 answers at once')
+    parser.add_argument('--captcha-max-age', type=int, default=0,
+                        help='With --captcha ai, keep a solved captcha ready for at most this many seconds while slots '
+                             'are available; 0 (default) disables prefetching')
+    parser.add_argument('--parallel-beneficiaries', action='store_true',
+                        help='When booking one beneficiary at a time, look for all of them at once instead of one '
+                             'after another; needs auto booking and captcha automation')
+    parser.add_argument('--pipelined', action='store_true',
+                        help='Keep polling the calendar while booking, and attempt the sessions of the latest poll')
+    parser.add_argument('--rank-weights',
+                        help='Weights of the slot ranking, e.g. date=1,capacity=1,preferred=2,free=0,fee=0,history=0.5; '
+                             'the sessions with the highest score are attempted first')
+    parser.add_argument('--prefer-centers', help='Comma separated center ids to attempt first, see --rank-weights')
+
+    headless = parser.add_argument_group(
+        'headless mode', 'Run without any prompt. Choices come from --config, the flags below override them. '
+                         'The OTP is read from IFTTT, see the README')
+    headless.add_argument('--headless', action='store_true', help='Implied by --config')
+    headless.add_argument('--config', help='JSON file of choices, e.g. a saved vaccine-booking-details-<mobile>.json')
+    headless.add_argument('--mobile', help='Registered mobile number')
+    headless.add_argument('--beneficiaries', help='Comma separated beneficiary reference ids')
+    headless.add_argument('--districts', help='Comma separated district ids, as ID or ID:NAME; the name is used in '
+                                              'messages and to match centers for alert beeps')
+    headless.add_argument('--pincodes', help='Comma separated pincodes, instead of districts')
+    headless.add_argument('--exclude-pincodes', help='Comma separated pincodes to avoid, with --districts')
+    headless.add_argument('--start-date', help='1 for today, 2 for tomorrow, or DD-MM-YYYY')
+    headless.add_argument('--date-windows', type=int,
+                          help='Number of consecutive 7 day windows to search from the start date, all at once')
+    headless.add_argument('--vaccine', help='COVISHIELD, COVAXIN, "SPUTNIK V" or any, for a first dose')
+    headless.add_argument('--fee-type', choices=['free', 'paid', 'any'])
+    headless.add_argument('--min-slots', type=int, help='1 to book for one beneficiary at a time')
+    headless.add_argument('--refresh-freq', type=int,
+                          help='Shortest time between calendar refreshes in seconds, at least 5; longer when the rate '
+                               'budget needs it')
+    headless.add_argument('--captcha', choices=['ai', 'api'], help='Captcha automation')
+    headless.add_argument('--captcha-api', choices=['0', '1'], help='0 for anti-captcha.com, 1 for 2captcha.com')
+    headless.add_argument('--captcha-api-key')
+    headless.add_argument('--reschedule', action='store_true',
+                          help='Reschedule the active appointment of the beneficiary instead of booking')
     args = parser.parse_args()
+    if args.replay and args.api_base:
+        parser.error("--replay answers the calls itself, it cannot be used with --api-base")
+    try:
+        transport.configure_timeouts(args.timeout)
+        alerts.configure(args.alert)
+        otp_sources.configure(args.otp_source)
+    except ValueError as e:
+        parser.error(str(e))
+
+    config = None
+    if args.headless or args.config:
+        config = apply_args(load_config(args.config) if args.config else {}, args)
+        exit_on_errors(validate_config(config))
+        utils.INTERACTIVE = False
+
+    try:
+        # one ranker for the whole run, so the booking history of a center carries over from one beneficiary to the next
+        slot_ranker = SlotRanker(parse_weights(args.rank_weights),
+                                 [center_id for center_id in (args.prefer_centers or "").split(",") if center_id.strip()],
+                                 history=BookingHistory())
+    except ValueError as e:
+        parser.error(str(e))
+
+    transport.configure(pool_size=args.pool_size)
+    if args.api_base:
+        transport.set_api_base(args.api_base)
+    if args.hedge:
+        transport.set_hedged_endpoints(["calendar"])
+    if args.metrics_port:
+        metrics.start(args.metrics_port)
+    if args.record:
+        traffic.start_recording(args.record)
+    if args.replay:
+        traffic.start_replay(args.replay, args.replay_scale)
 
     filename = 'vaccine-booking-details-'
     mobile = None
     print('Running Script')
-    beep(500, 150)
+    alerts.notify("start", "Running Script", freq=500, duration=150)
     try:
-        base_request_header = {
-            'User-Agent': get_user_agent()
-            , 'origin': 'https://selfregistration.cowin.gov.in'
-            , 'referer': 'https://selfregistration.cowin.gov.in/'
-        }
-        otp_validation_header = {
-            'User-Agent': get_user_agent()
-            , 'origin': 'https://selfregistration.cowin.gov.in'
-            , 'sec-fetch-site': 'cross-site'
-            , 'sec-fetch-mode': 'cors'
-            , 'sec-fetch-dest': 'empty'
-            , 'referer': 'https://selfregistration.cowin.gov.in/',
-        }
-
-        common_header = {
-            'User-Agent': get_user_agent()
-            , 'content-type': 'application/json'
-#            , 'origin': 'https://selfregistration.cowin.gov.in/'
-            , 'origin': '127.0.0.1'
-            , 'sec-fetch-site': 'cross-site'
-            , 'sec-fetch-mode': 'cors'
-            , 'sec-fetch-dest': 'empty'
-#            , 'referer': 'https://selfregistration.cowin.gov.in/',
-            , 'referer': '127.0.0.1',
-        }
+        base_request_header, otp_validation_header, common_header = request_headers()
+
+        if config is not None:
+            run_headless(args, config, base_request_header, otp_validation_header, common_header, slot_ranker)
+            sys.exit(0)
 
         token = None
         if args.token:
@@ -108,14 +314,14 @@ def main():
                 "\nSelect   y   :   Enter OTP manually (Default Choice)"
                 "\nSelect   n   :   Auto Read from IFTTT setup (refer to README for setup)  :  ")
             otp_pref = otp_pref if otp_pref else "y"
+            retry = POLICIES["otp"].start()
             while token is None:
                 if otp_pref.lower() == "n":
                     try:
                         token = generate_token_OTP(mobile, base_request_header, otp_validation_header)
                     except Exception as e:
                         print(str(e))
-                        print('OTP Retrying in 5 seconds')
-                        time.sleep(5)
+                        retry.wait("no token from the OTP")
                 elif otp_pref.lower() == "y":
                     token = generate_token_OTP_manual(mobile, base_request_header, otp_validation_header)
 
@@ -148,26 +354,17 @@ def main():
 
         info = SimpleNamespace(**collected_details)
 
-        if info.minimum_slots != len(info.beneficiary_dtls):
-            for beneficiary in info.beneficiary_dtls:
-                multi_cycle_book(request_header, token, mobile, otp_pref, base_request_header, otp_validation_header,
-                                 info, [beneficiary], collected_details)
-            print('\n press any key twice to exit \n')
-            os.system("pause")
-            os.system("pause")
-            sys.exit(1)
-        else:
-            multi_cycle_book(request_header, token, mobile, otp_pref, base_request_header, otp_validation_header,
-                             info, info.beneficiary_dtls, collected_details)
-
-            print('\n press any key twice to exit \n')
-            os.system("pause")
-            os.system("pause")
-            sys.exit(1)
+        book_for_beneficiaries(request_header, token, mobile, otp_pref, base_request_header, otp_validation_header,
+                               info, collected_details, args.captcha_max_age, args.parallel_beneficiaries,
+                               slot_ranker, args.pipelined)
+        print('\n press any key twice to exit \n')
+        pause()
+        pause()
+        sys.exit(1)
     except Exception as e:
         print(str(e))
         print('Exiting Script')
-        os.system("pause")
+        pause()
         sys.exit(1)
 
 
@@ -0,0 +1,225 @@
+import argparse
+import alerts
+import metrics
+import otp_sources
+import copy
+import os
+import time
+import traffic
+import transport
+import utils
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from calendar_diff import CalendarSnapshot
+from calendar_feed import CalendarFeed
+from headless import collect_details, exit_on_errors, get_token, load_config, validate_config
+from poll_scheduler import PollScheduler
+from ranking import BookingHistory, SlotRanker
+from token_manager import TokenManager
+from utils import CALENDAR_URL_DISTRICT, CALENDAR_URL_PINCODE, calendar_windows, check_and_book, generate_token_OTP, \
+    get_dose_num, request_headers, search_start_date
+
+
+def load_configs(paths):
+    """
+    This function loads and validates every profile before the first request, and exits listing all problems
+    """
+    configs = []
+    errors = []
+    for path in paths:
+        try:
+            config = load_config(path)
+        except (OSError, ValueError) as e:
+            errors.append(f"{path}: {e}")
+            continue
+        errors += [f"{path}: {error}" for error in validate_config(config)]
+        configs.append((path, config))
+    exit_on_errors(errors)
+    return configs
+
+
+def start_profile(path, config, base_request_header, otp_validation_header):
+    """
+    This function
+        1. Gets a token for the mobile number of the profile, renewed in the background from then on,
+        2. Collects the details of the profile, and
+        3. Returns the profile with the groups of beneficiaries to book for, one after another
+    """
+    mobile = config["mobile"]
+    token_manager = TokenManager(get_token(mobile, base_request_header, otp_validation_header),
+                                 renew=lambda: generate_token_OTP(mobile, base_request_header, otp_validation_header))
+    request_header = token_manager.bind(copy.deepcopy(base_request_header))
+    collected_details, errors = collect_details(config, request_header)
+    exit_on_errors([f"{path}: {error}" for error in errors])
+
+    info = SimpleNamespace(**collected_details)
+    if info.minimum_slots != len(info.beneficiary_dtls):
+        groups = [[beneficiary] for beneficiary in info.beneficiary_dtls]
+    else:
+        groups = [info.beneficiary_dtls]
+    return SimpleNamespace(name=os.path.basename(path), mobile=mobile, info=info, collected_details=collected_details,
+                           token_manager=token_manager, request_header=request_header, groups=groups,
+                           snapshot=CalendarSnapshot())
+
+
+def calendar_urls(profile):
+    """
+    This function returns the calendar urls the profile polls, the same way check_calendar_by_* builds them
+    """
+    info = profile.info
+    windows = calendar_windows(search_start_date(info.start_date), info.date_windows)
+    if info.search_option == 2:
+        return [CALENDAR_URL_DISTRICT.format(location["district_id"], start_date) for location in info.location_dtls
+                for start_date in windows]
+    return [CALENDAR_URL_PINCODE.format(location["pincode"], start_date) for location in info.location_dtls
+            for start_date in windows]
+
+
+def book_cycle(profile, calendar_feed, poll_scheduler, slot_ranker=None):
+    """
+    This function
+        1. Runs one check_and_book of the profile on the responses of this cycle,
+        2. Retires the profile when the script would exit, e.g. after a reschedule, and
+        3. Logs any other error of the profile, so that the other profiles go on
+    """
+    try:
+        result = profile_cycle(profile, calendar_feed, poll_scheduler, slot_ranker)
+    except SystemExit:
+        print(f"{profile.name}: done, no more booking for this profile")
+        profile.groups.clear()
+        return
+    except Exception as e:
+        print(f"{profile.name}: {type(e).__name__} {e}")
+        return
+    if result == "break":
+        print(f"{profile.name}: booked for {', '.join(beneficiary['name'] for beneficiary in profile.groups[0])}")
+        profile.groups.pop(0)
+        profile.snapshot = CalendarSnapshot()
+
+
+def profile_cycle(profile, calendar_feed, poll_scheduler, slot_ranker=None):
+    profile.token_manager.maybe_renew()
+    if not profile.token_manager.is_valid():
+        print(f"{profile.name}: waiting for a new token")
+        return None
+    info = profile.info
+    return check_and_book(profile.request_header, profile.groups[0], info.location_dtls, info.search_option,
+                          min_slots=info.minimum_slots,
+                          ref_freq=info.refresh_freq,
+                          auto_book=info.auto_book,
+                          start_date=info.start_date,
+                          vaccine_type=info.vaccine_type,
+                          fee_type=info.fee_type,
+                          mobile=profile.mobile,
+                          captcha_automation=info.captcha_automation,
+                          captcha_api_choice=info.captcha_api_choice,
+                          captcha_automation_api_key=info.captcha_automation_api_key,
+                          dose_num=get_dose_num(profile.collected_details),
+                          excluded_pincodes=info.excluded_pincodes,
+                          reschedule_inp=info.reschedule_inp,
+                          calendar_snapshot=profile.snapshot,
+                          poll_scheduler=poll_scheduler,
+                          calendar_feed=calendar_feed,
+                          slot_ranker=slot_ranker,
+                          date_windows=info.date_windows)
+
+
+def run_daemon(profiles, max_cycles=None):
+    """
+    This function
+        1. Fetches the union of the locations of all profiles once per cycle,
+        2. Runs the filter and booking of every profile on those responses at the same time, and
+        3. Waits for the next poll as the PollScheduler plans it, until every profile is booked
+    """
+    calendar_feed = CalendarFeed()
+    # polled as often as the profile with the shortest refresh_freq asks for, within the rate budget
+    poll_scheduler = PollScheduler(min_interval=min(profile.info.refresh_freq for profile in profiles))
+    # the booking history of a center is shared by all profiles
+    slot_ranker = SlotRanker(history=BookingHistory())
+    transport.add_response_hook(poll_scheduler.observe)
+    cycle = 0
+    try:
+        while max_cycles is None or cycle < max_cycles:
+            active = [profile for profile in profiles if profile.groups]
+            if not active:
+                print("All profiles booked")
+                break
+            cycle += 1
+            urls = list(dict.fromkeys(url for profile in active for url in calendar_urls(profile)))
+            valid = [profile for profile in active if profile.token_manager.is_valid()]
+            calendar_feed.new_cycle()
+            if valid:
+                try:
+                    calendar_feed.prefetch(valid[0].request_header, urls)
+                except Exception as e:
+                    print(f"Unable to fetch calendars: {e}")
+            with ThreadPoolExecutor(max_workers=len(active)) as pool:
+                list(pool.map(lambda profile: book_cycle(profile, calendar_feed, poll_scheduler, slot_ranker), active))
+            print(f"Cycle {cycle}: {len(urls)} locations for {len(active)} profiles, {calendar_feed.stats()}")
+
+            plan = poll_scheduler.plan(len(urls))
+            print(f"Next update in {plan['next_delay']:.0f} seconds.. ({plan['calls_in_window']} calls in window of "
+                  f"{plan['budget']})")
+            time.sleep(plan["next_delay"])
+    finally:
+        transport.remove_response_hook(poll_scheduler.observe)
+        for profile in profiles:
+            profile.token_manager.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Book for several saved profiles, polling each location once")
+    parser.add_argument('profiles', nargs='+', help='Headless configs, e.g. vaccine-booking-details-<mobile>.json')
+    parser.add_argument('--pool-size', type=int, default=transport.POOL_SIZE,
+                        help='Number of keep-alive connections to keep open to CoWIN')
+    parser.add_argument('--api-base', help='Send CoWIN API calls to this base url instead, e.g. a local mock_server.py')
+    parser.add_argument('--timeout', action='append',
+                        help='Connect/read timeout of an endpoint as ENDPOINT=CONNECT/READ seconds, e.g. calendar=2/6; '
+                             'endpoints: ' + ', '.join(transport.ENDPOINT_TIMEOUTS) + '; may be repeated')
+    parser.add_argument('--hedge', action='store_true',
+                        help='Send a calendar request again when it takes longer than the p95 latency, and use the '
+                             'response that comes first')
+    parser.add_argument('--otp-source', default='kvdb',
+                        help='Where the OTP SMS read automatically comes from: kvdb (the IFTTT bucket, default) or '
+                             'webhook:PORT to receive it from the SMS forwarder at http://<this machine>:PORT/otp/<mobile>')
+    parser.add_argument('--alert', action='append',
+                        help='Where alerts go: sound (default), desktop, log:PATH or webhook:URL; may be repeated')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve latency and booking metrics as Prometheus text at '
+                             'http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--record', help='Write every CoWIN call to this gzip JSONL file, tokens redacted')
+    parser.add_argument('--replay', help='Answer CoWIN calls from a --record file instead of the network')
+    parser.add_argument('--replay-scale', type=float, default=1.0,
+                        help='Multiply the recorded latencies by this on replay, 0 answers at once')
+    parser.add_argument('--max-cycles', type=int, help='Stop after this many poll cycles')
+    args = parser.parse_args()
+    if args.replay and args.api_base:
+        parser.error("--replay answers the calls itself, it cannot be used with --api-base")
+    try:
+        transport.configure_timeouts(args.timeout)
+        alerts.configure(args.alert)
+        otp_sources.configure(args.otp_source)
+    except ValueError as e:
+        parser.error(str(e))
+
+    configs = load_configs(args.profiles)
+    utils.INTERACTIVE = False
+    transport.configure(pool_size=args.pool_size)
+    if args.api_base:
+        transport.set_api_base(args.api_base)
+    if args.hedge:
+        transport.set_hedged_endpoints(["calendar"])
+    if args.metrics_port:
+        metrics.start(args.metrics_port)
+    if args.record:
+        traffic.start_recording(args.record)
+    if args.replay:
+        traffic.start_replay(args.replay, args.replay_scale)
+
+    base_request_header, otp_validation_header, _ = request_headers()
+    profiles = [start_profile(path, config, base_request_header, otp_validation_header) for path, config in configs]
+    run_daemon(profiles, args.max_cycles)
+
+
+if __name__ == "__main__":
+    main()
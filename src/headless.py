@@ -0,0 +1,283 @@
+import datetime
+import json
+import re
+import sys
+from collections import Counter
+from retry import POLICIES
+from utils import MAX_DATE_WINDOWS, check_active_appointment, fetch_beneficiaries, generate_token_OTP, \
+    refine_beneficiary, required_beneficiary, reschedule_beneficiary
+
+VACCINES = ["COVISHIELD", "COVAXIN", "SPUTNIK V"]
+FEE_TYPES = ["Free", "Paid"]
+# manual captcha needs a window and a person, so it is not available headless
+CAPTCHA_MODES = ["ai", "api"]
+CAPTCHA_APIS = ["0", "1"]
+# a start date further out than this is of no use, as in collect_user_details
+MAX_START_DATE_DAYS = 15
+# the keys of a saved beneficiary read by build_details and check_and_book, as required_beneficiary keeps them
+BENEFICIARY_KEYS = ["bref_id", "name", "vaccine", "age", "status", "dose1_date", "dose2_date"]
+
+PINCODE = re.compile(r"^\d{6}$")
+MOBILE = re.compile(r"^\d{10}$")
+
+
+def split_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def load_config(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def apply_args(config, args):
+    """
+    This function returns the config with the choices given on the command line put over it
+    """
+    config = dict(config)
+    if args.mobile:
+        config["mobile"] = args.mobile
+    if args.beneficiaries:
+        config.pop("beneficiary_dtls", None)
+        config["beneficiaries"] = split_list(args.beneficiaries)
+    if args.districts:
+        config["search_option"] = 2
+        config["location_dtls"] = []
+        for spec in split_list(args.districts):
+            district_id, _, district_name = spec.partition(":")
+            config["location_dtls"].append({"district_id": district_id, "district_name": district_name or district_id})
+    if args.pincodes:
+        config["search_option"] = 1
+        config["location_dtls"] = [{"pincode": pincode} for pincode in split_list(args.pincodes)]
+    if args.exclude_pincodes:
+        config["excluded_pincodes"] = [{"pincode": pincode} for pincode in split_list(args.exclude_pincodes)]
+    if args.start_date:
+        config["start_date"] = int(args.start_date) if args.start_date in ["1", "2"] else args.start_date
+    if args.date_windows is not None:
+        config["date_windows"] = args.date_windows
+    if args.vaccine:
+        config["vaccine_type"] = None if args.vaccine.lower() == "any" else args.vaccine.upper()
+    if args.fee_type:
+        config["fee_type"] = FEE_TYPES if args.fee_type.lower() == "any" else [args.fee_type.capitalize()]
+    if args.min_slots is not None:
+        config["minimum_slots"] = args.min_slots
+    if args.refresh_freq is not None:
+        config["refresh_freq"] = args.refresh_freq
+    if args.captcha:
+        config["captcha_automation"] = args.captcha
+    if args.captcha_api:
+        config["captcha_api_choice"] = args.captcha_api
+    if args.captcha_api_key:
+        config["captcha_automation_api_key"] = args.captcha_api_key
+    if args.reschedule:
+        config["reschedule_inp"] = "r"
+    return config
+
+
+def validate_config(config):
+    """
+    This function checks every choice of the config without any request, and returns the list of problems found
+    """
+    errors = []
+    if not MOBILE.match(str(config.get("mobile", ""))):
+        errors.append("mobile: a 10 digit registered mobile number is required, to renew the token")
+
+    if config.get("beneficiary_dtls"):
+        errors.extend(validate_beneficiaries(config["beneficiary_dtls"], config.get("reschedule_inp") in ["r", "R"]))
+    elif not config.get("beneficiaries"):
+        errors.append("beneficiaries: at least one beneficiary reference id is required")
+
+    search_option = config.get("search_option", 2)
+    locations = config.get("location_dtls") or []
+    if search_option not in [1, 2]:
+        errors.append("search_option: 1 for pincodes or 2 for districts")
+    elif not locations:
+        errors.append("location_dtls: at least one district or pincode to monitor is required")
+    elif search_option == 2 and not all(str(location.get("district_id", "")).isdigit() for location in locations):
+        errors.append("location_dtls: every district needs a numeric district_id")
+    elif search_option == 1 and not all(PINCODE.match(str(location.get("pincode", ""))) for location in locations):
+        errors.append("location_dtls: every pincode needs 6 digits")
+
+    excluded = config.get("excluded_pincodes") or []
+    if not all(PINCODE.match(str(item.get("pincode", ""))) for item in excluded):
+        errors.append("excluded_pincodes: every pincode needs 6 digits")
+
+    start_date = config.get("start_date", 2)
+    if start_date not in [1, 2]:
+        try:
+            days = (datetime.datetime.strptime(str(start_date), "%d-%m-%Y").date() - datetime.date.today()).days
+            if not 0 <= days <= MAX_START_DATE_DAYS:
+                errors.append(f"start_date: {start_date} is not within the next {MAX_START_DATE_DAYS} days")
+        except ValueError:
+            errors.append(f"start_date: {start_date} is not 1 (today), 2 (tomorrow) or a DD-MM-YYYY date")
+    date_windows = config.get("date_windows", 1)
+    if not isinstance(date_windows, int) or not 1 <= date_windows <= MAX_DATE_WINDOWS:
+        errors.append(f"date_windows: a number of 7 day windows to search, 1 to {MAX_DATE_WINDOWS}")
+
+    if config.get("vaccine_type") not in [None, ""] + VACCINES:
+        errors.append(f"vaccine_type: one of {VACCINES}, or none for no preference")
+    fee_type = config.get("fee_type", FEE_TYPES)
+    if not fee_type or not set(fee_type) <= set(FEE_TYPES):
+        errors.append(f"fee_type: a non empty subset of {FEE_TYPES}")
+
+    minimum_slots = config.get("minimum_slots")
+    if minimum_slots is not None and (not isinstance(minimum_slots, int) or minimum_slots < 1):
+        errors.append("minimum_slots: a number of at least 1")
+    refresh_freq = config.get("refresh_freq", 15)
+    if not isinstance(refresh_freq, int) or refresh_freq < 5:
+        errors.append("refresh_freq: a number of seconds, at least 5")
+
+    if config.get("auto_book", "y") != "y":
+        errors.append("auto_book: choosing a center by hand needs someone at the keyboard, only y is possible")
+    captcha_automation = config.get("captcha_automation", "ai")
+    if captcha_automation not in CAPTCHA_MODES:
+        errors.append(f"captcha_automation: one of {CAPTCHA_MODES}, the manual captcha window needs a person")
+    elif captcha_automation == "api":
+        if config.get("captcha_api_choice", "0") not in CAPTCHA_APIS:
+            errors.append("captcha_api_choice: 0 for anti-captcha.com or 1 for 2captcha.com")
+        if not config.get("captcha_automation_api_key"):
+            errors.append("captcha_automation_api_key: required with captcha_automation api")
+
+    if config.get("reschedule_inp") not in [None, "", "r", "R", "b", "B"]:
+        errors.append("reschedule_inp: r to reschedule the active appointment, or none")
+    return errors
+
+
+def validate_beneficiaries(beneficiary_dtls, reschedule=False):
+    """
+    This function returns the problems of saved beneficiary details, the ones the booking loop would fail on
+    """
+    errors = []
+    required = BENEFICIARY_KEYS + (["appointment_id"] if reschedule else [])
+    for idx, item in enumerate(beneficiary_dtls):
+        if not isinstance(item, dict) or not item.get("bref_id"):
+            errors.append(f"beneficiary_dtls: beneficiary {idx + 1} needs a bref_id")
+            continue
+        missing = [key for key in required if key not in item]
+        if missing:
+            errors.append(f"beneficiary_dtls: {item['bref_id']} is missing {', '.join(missing)}")
+            continue
+        if not isinstance(item["age"], int):
+            errors.append(f"beneficiary_dtls: age of {item['bref_id']} is not a number")
+        if item["status"] == "Partially Vaccinated":
+            try:
+                datetime.datetime.strptime(item["dose2_date"], "%d-%m-%Y")
+            except (TypeError, ValueError):
+                errors.append(f"beneficiary_dtls: dose2_date of {item['bref_id']} is not a DD-MM-YYYY date")
+    return errors
+
+
+def resolve_beneficiaries(config, beneficiaries):
+    """
+    This function
+        1. Picks the configured beneficiary reference ids out of the fetched beneficiaries, and
+        2. Returns the beneficiaries to book for, or to reschedule, and the list of problems found
+    """
+    bref_ids = [str(bref_id) for bref_id in config["beneficiaries"]]
+    by_id = {beneficiary["beneficiary_reference_id"]: beneficiary for beneficiary in beneficiaries}
+    missing = [bref_id for bref_id in bref_ids if bref_id not in by_id]
+    if missing:
+        return [], [f"beneficiaries: {', '.join(missing)} not registered with this mobile number"]
+
+    beneficiary_dtls = [required_beneficiary(refine_beneficiary(by_id[bref_id])) for bref_id in bref_ids]
+    active_appointment = check_active_appointment(beneficiary_dtls, beneficiaries)
+    if config.get("reschedule_inp") in ["r", "R"]:
+        if len(active_appointment) != 1:
+            return [], [f"reschedule_inp: exactly one of the beneficiaries needs an active appointment to reschedule, "
+                        f"found {len(active_appointment)}"]
+        return [reschedule_beneficiary(active_appointment[0])], []
+
+    # as the default choice of the prompt, beneficiaries with an active appointment are left out
+    booked = set(item["bref_id"] for item in active_appointment)
+    beneficiary_dtls = [beneficiary for beneficiary in beneficiary_dtls if beneficiary["bref_id"] not in booked]
+    if not beneficiary_dtls:
+        return [], ["beneficiaries: all of them have an active appointment"]
+    return beneficiary_dtls, []
+
+
+def build_details(config, beneficiary_dtls):
+    """
+    This function returns the collected_details used by the booking loop, and the list of problems found
+    """
+    errors = []
+    vaccine_types = [beneficiary["vaccine"] for beneficiary in beneficiary_dtls]
+    if len(Counter(vaccine_types)) != 1:
+        errors.append("beneficiaries: all beneficiaries in one attempt should have the same vaccine type")
+    vaccine_type = vaccine_types[0] or config.get("vaccine_type") or None
+
+    start_date = config.get("start_date", 2)
+    if all(beneficiary["status"] == "Partially Vaccinated" for beneficiary in beneficiary_dtls):
+        if start_date in [1, 2]:
+            search_date = datetime.date.today() + datetime.timedelta(days=start_date - 1)
+        else:
+            search_date = datetime.datetime.strptime(start_date, "%d-%m-%Y").date()
+        for beneficiary in beneficiary_dtls:
+            if datetime.datetime.strptime(beneficiary["dose2_date"], "%d-%m-%Y").date() > search_date:
+                errors.append(f"start_date: dose2 of {beneficiary['name']} is due on {beneficiary['dose2_date']}")
+
+    search_option = config.get("search_option", 2)
+    location_dtls = [{**location, "alert_freq": location.get("alert_freq", 440 + ((2 * idx) * 110))}
+                     for idx, location in enumerate(config["location_dtls"])]
+    minimum_slots = config.get("minimum_slots") or len(beneficiary_dtls)
+    captcha_automation = config.get("captcha_automation", "ai")
+
+    collected_details = {
+        "beneficiary_dtls": beneficiary_dtls,
+        "location_dtls": location_dtls,
+        "search_option": search_option,
+        "minimum_slots": 1 if minimum_slots == 1 else len(beneficiary_dtls),
+        "refresh_freq": config.get("refresh_freq", 15),
+        "auto_book": "y",
+        "start_date": start_date,
+        "date_windows": config.get("date_windows", 1),
+        "vaccine_type": vaccine_type,
+        "fee_type": config.get("fee_type", FEE_TYPES),
+        'captcha_automation': captcha_automation,
+        'captcha_api_choice': config.get("captcha_api_choice", "0") if captcha_automation == "api" else None,
+        'captcha_automation_api_key': config.get("captcha_automation_api_key") if captcha_automation == "api" else None,
+        'excluded_pincodes': (config.get("excluded_pincodes") or None) if search_option == 2 else None,
+        'reschedule_inp': config.get("reschedule_inp") if config.get("reschedule_inp") in ["r", "R"] else None,
+    }
+    return collected_details, errors
+
+
+def exit_on_errors(errors):
+    if errors:
+        print("Invalid headless configuration:")
+        for error in errors:
+            print(f"\t{error}")
+        sys.exit(1)
+
+
+def get_token(mobile, base_request_header, otp_validation_header):
+    """
+    This function returns a token from the OTP read from IFTTT, retrying with backoff until it gets one
+    """
+    token = None
+    retry = POLICIES["otp"].start()
+    while token is None:
+        try:
+            token = generate_token_OTP(mobile, base_request_header, otp_validation_header)
+        except Exception as e:
+            print(str(e))
+        if token is None:
+            retry.wait("no token from the OTP")
+    return token
+
+
+def collect_details(config, request_header):
+    """
+    This function
+        1. Takes the beneficiaries from the config, looking them up when it has only their reference ids, and
+        2. Returns the collected_details used by the booking loop, and the list of problems found
+    """
+    if config.get("beneficiary_dtls"):
+        beneficiary_dtls = config["beneficiary_dtls"]
+    else:
+        beneficiaries = fetch_beneficiaries(request_header)
+        if beneficiaries.status_code != 200:
+            return None, [f"beneficiaries: unable to fetch them, {beneficiaries.status_code} {beneficiaries.text}"]
+        beneficiary_dtls, errors = resolve_beneficiaries(config, beneficiaries.json()["beneficiaries"])
+        if errors:
+            return None, errors
+    return build_details(config, beneficiary_dtls)
@@ -0,0 +1,93 @@
+import threading
+import time
+from calendar_diff import CalendarSnapshot
+from ranking import Attempt
+
+
+class LiveCalendar:
+    """
+    Keeps polling the calendar in the background while check_and_book is booking, in pipelined mode.
+
+    The candidates are the sessions to attempt: a candidate missing from the latest poll (no capacity left, or
+    filtered out) is dropped, one still there takes the capacity of that poll, and a session that opened or gained
+    capacity since the previous poll becomes a candidate. attempts() ranks them again before every attempt, so
+    there is no point after which the options are too stale to try.
+    """
+
+    def __init__(self, poll, seen_options, candidates, interval):
+        # poll(snapshot) returns the options of a fresh poll, False when the token is invalid and None on errors
+        self.poll = poll
+        self.interval = interval
+        self.snapshot = CalendarSnapshot()
+        self.snapshot.update(seen_options)
+        self.candidates = {option.session_id: option for option in candidates}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.token_invalid = False
+        self.polls = 0
+        self.updated_at = time.time()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="live-calendar", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval()):
+            try:
+                options = self.poll(self.snapshot)
+            except Exception as e:
+                print(f"[live] poll failed: {e}")
+                continue
+            if options is False:
+                self.token_invalid = True
+                return
+            if options is not None and not self.stopped.is_set():
+                self.update(options)
+
+    def update(self, options):
+        fresh = {option.session_id: option for option in options}
+        with self.lock:
+            delta = self.snapshot.update(options)
+            candidates = {session_id: fresh[session_id] for session_id in self.candidates if session_id in fresh}
+            gone = len(self.candidates) - len(candidates)
+            for option in delta.changed:
+                candidates[option.session_id] = option
+            self.candidates = candidates
+            self.polls += 1
+            self.updated_at = time.time()
+        print(f"[live] poll {self.polls}: {len(candidates)} candidates, {gone} gone, {len(delta.changed)} opened or "
+              f"with more capacity")
+
+    def current(self):
+        with self.lock:
+            return list(self.candidates.values())
+
+    def attempts(self, slot_ranker, skipped_sessions=()):
+        """
+        This function yields the best attempt not made yet, ranked on the freshest candidates each time it is asked
+        for one; the slots of a session are picked the first time it comes up, as SlotRanker.attempts does
+        """
+        planned = {}
+        tried = set()
+        while not self.token_invalid:
+            best = None
+            for rank, option in enumerate(slot_ranker.rank(self.current())):
+                session_id = option.session_id
+                if session_id in skipped_sessions:
+                    continue
+                slots = planned.get(session_id)
+                if slots is None:
+                    slots = planned[session_id] = [attempt.slot for attempt in slot_ranker.attempts([option])]
+                slot = next((slot for slot in slots if (session_id, slot) not in tried), None)
+                if slot is not None:
+                    best = Attempt(rank, option, slot)
+                    break
+            if best is None:
+                return
+            tried.add((best.option.session_id, best.slot))
+            yield best
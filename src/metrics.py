@@ -0,0 +1,205 @@
+import threading
+import time
+import transport
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+# a session not seen again for this many seconds is forgotten, and counts as a new sighting when it comes back
+SIGHTING_TTL_SECS = 60 * 60
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        key = tuple(str(label) for label in labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name + format_labels(self.label_names, key), value) for key, value in self.values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def observe(self, value, *labels):
+        key = tuple(str(label) for label in labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (bucket_counts, total, count) in self.values.items():
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    samples.append((self.name + "_bucket" + format_labels(self.label_names, key, [("le", bound)]),
+                                    bucket_count))
+                samples.append((self.name + "_bucket" + format_labels(self.label_names, key, [("le", "+Inf")]), count))
+                samples.append((self.name + "_sum" + format_labels(self.label_names, key), total))
+                samples.append((self.name + "_count" + format_labels(self.label_names, key), count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        This function returns every metric in the Prometheus text format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines += [f"{sample} {value}" for sample, value in metric.samples()]
+        return "\n".join(lines) + "\n"
+
+
+class Sightings:
+    """
+    When each session was first seen, for the time from sighting to booking attempt
+    """
+
+    def __init__(self, ttl=SIGHTING_TTL_SECS):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def seen(self, session_ids):
+        now = time.time()
+        with self.lock:
+            for session_id in session_ids:
+                first_seen, _ = self.sessions.get(session_id, (now, now))
+                self.sessions[session_id] = (first_seen, now)
+            if len(self.sessions) > 10000:
+                self.sessions = {session_id: seen for session_id, seen in self.sessions.items()
+                                 if now - seen[1] < self.ttl}
+
+    def since_first_seen(self, session_id):
+        with self.lock:
+            seen = self.sessions.get(session_id)
+        if seen is None or time.time() - seen[1] >= self.ttl:
+            return None
+        return time.time() - seen[0]
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.register(Histogram("cowin_request_seconds", "Latency of API calls", ["endpoint"]))
+RESPONSES = REGISTRY.register(Counter("cowin_responses_total", "API responses", ["endpoint", "status"]))
+HEDGED_REQUESTS = REGISTRY.register(Counter("cowin_hedged_requests_total",
+                                            "Requests sent a second time after the p95 latency, by the request whose "
+                                            "response was used", ["endpoint", "winner"]))
+POLL_SECONDS = REGISTRY.register(Histogram("cowin_poll_seconds", "Time to get the calendars of all locations of a poll"))
+OPTIONS_PER_CYCLE = REGISTRY.register(Histogram("cowin_options_per_cycle", "Viable options found per poll cycle",
+                                                buckets=COUNT_BUCKETS))
+CAPTCHA_SOLVE_SECONDS = REGISTRY.register(Histogram("cowin_captcha_solve_seconds", "Time to solve a captcha",
+                                                    ["backend"]))
+BOOKING_ATTEMPT_SECONDS = REGISTRY.register(Histogram("cowin_booking_attempt_seconds",
+                                                      "Captcha and booking call of a booking attempt",
+                                                      ["kind", "status"]))
+SIGHTING_TO_ATTEMPT_SECONDS = REGISTRY.register(Histogram("cowin_sighting_to_attempt_seconds",
+                                                          "From the poll that first showed a session to an attempt "
+                                                          "to book it", buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120)))
+OTP_WAIT_SECONDS = REGISTRY.register(Histogram("cowin_otp_wait_seconds", "From the OTP request to the OTP",
+                                               ["source"], buckets=(1, 2, 5, 10, 20, 30, 60, 120, 180)))
+OTP_TIMEOUTS = REGISTRY.register(Counter("cowin_otp_timeouts_total", "OTPs that did not come in time", ["source"]))
+SIGHTINGS = Sightings()
+
+
+def endpoint_name(url):
+    # last part of the path for CoWIN calls, e.g. calendarByDistrict, and the host for any other call
+    if url.startswith(transport.COWIN_HOST):
+        return urlparse(url).path.rstrip("/").rsplit("/", 1)[-1]
+    return urlparse(url).hostname
+
+
+def observe_response(method, url, response, elapsed):
+    endpoint = endpoint_name(url)
+    REQUEST_SECONDS.observe(elapsed, endpoint)
+    RESPONSES.inc(endpoint, response.status_code)
+
+
+def observe_hedge(endpoint, winner):
+    HEDGED_REQUESTS.inc(endpoint, winner)
+
+
+class MetricsServer:
+    def __init__(self, port, host="127.0.0.1", registry=REGISTRY):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if urlparse(self.path).path != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start(port, host="127.0.0.1"):
+    """
+    This function records the latency and status of every API call, and serves the metrics on host and port, only
+    to this machine unless another host is given
+    """
+    transport.add_response_hook(observe_response)
+    transport.add_hedge_hook(observe_hedge)
+    server = MetricsServer(port, host)
+    print(f"Serving metrics at http://{host}:{server.server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,395 @@
+import argparse
+import base64
+import datetime
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+API_PREFIX = "/api/v2"
+SLOTS = ["09:00AM-11:00AM", "11:00AM-01:00PM", "01:00PM-03:00PM", "03:00PM-05:00PM"]
+VACCINES = ["COVISHIELD", "COVAXIN", "SPUTNIK V"]
+
+# endpoint name of every path handled, used as the key of latency, error rates and stats
+ENDPOINTS = {
+    "/appointment/sessions/calendarByDistrict": "calendar",
+    "/appointment/sessions/calendarByPin": "calendar",
+    "/auth/getRecaptcha": "captcha",
+    "/appointment/schedule": "schedule",
+    "/appointment/reschedule": "reschedule",
+    "/appointment/cancel": "cancel",
+    "/appointment/beneficiaries": "beneficiaries",
+    "/appointment/appointmentslip/download": "appointmentslip",
+    "/auth/generateMobileOTP": "otp",
+    "/auth/public/generateOTP": "otp",
+    "/auth/validateMobileOtp": "otp_validate",
+    "/admin/location/states": "states",
+}
+# the district list of a state is at this path followed by the state id
+DISTRICTS_PATH = "/admin/location/districts/"
+# endpoints CoWIN answers without a token
+PUBLIC_ENDPOINTS = ("otp", "otp_validate", "captcha", "states", "districts")
+
+# states and their districts for the interactive district selection, with the real CoWIN ids
+STATES = {
+    9: ("Delhi", {141: "Central Delhi", 140: "New Delhi"}),
+    16: ("Karnataka", {265: "Bangalore Urban", 276: "Bangalore Rural", 294: "BBMP"}),
+    21: ("Maharashtra", {395: "Mumbai", 363: "Pune"}),
+}
+
+MOCK_OTP = "123456"
+
+# number of coordinates taken by each svg path command
+PATH_ARGUMENTS = {"M": 2, "L": 2, "T": 2, "Q": 4, "S": 4, "C": 6, "H": 1, "V": 1, "Z": 0}
+
+
+def generate_calendar(num_centers, sessions_per_center=7, start_date=None, seed=0, district_id=1,
+                      district_name="Mock District", pincode=None, age_mix=None, paid_ratio=0.2, open_ratio=0.3,
+                      max_capacity=50, max_dose2_capacity=None):
+    """
+    This function
+        1. Builds a calendarByDistrict/calendarByPin style payload with num_centers centers,
+        2. Spreads sessions_per_center sessions over consecutive days from start_date,
+        3. Draws age limit from age_mix ({age: weight}), fee type from paid_ratio, and
+        4. Gives open_ratio of the sessions dose1 capacity up to max_capacity and dose2 capacity up to
+           max_dose2_capacity, max_capacity when not given
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime.strptime(start_date, "%d-%m-%Y") if start_date else datetime.datetime.today()
+    age_mix = age_mix or {18: 0.5, 45: 0.5}
+    ages, age_weights = list(age_mix.keys()), list(age_mix.values())
+    max_dose2_capacity = max_capacity if max_dose2_capacity is None else max_dose2_capacity
+
+    centers = []
+    for idx in range(num_centers):
+        center_id = district_id * 100000 + idx
+        fee_type = "Paid" if rng.random() < paid_ratio else "Free"
+        vaccine = rng.choice(VACCINES)
+        sessions = []
+        for day in range(sessions_per_center):
+            if rng.random() < open_ratio:
+                dose1, dose2 = rng.randint(0, max_capacity), rng.randint(0, max_dose2_capacity)
+            else:
+                dose1, dose2 = 0, 0
+            sessions.append({
+                "session_id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "date": (start + datetime.timedelta(days=day % 7)).strftime("%d-%m-%Y"),
+                "available_capacity": dose1 + dose2,
+                "available_capacity_dose1": dose1,
+                "available_capacity_dose2": dose2,
+                "min_age_limit": rng.choices(ages, age_weights)[0],
+                "vaccine": vaccine,
+                "fee": "780" if fee_type == "Paid" else "0",
+                "slots": SLOTS[:],
+            })
+        center = {
+            "center_id": center_id,
+            "name": f"Mock Center {center_id}",
+            "address": f"{idx} Mock Road",
+            "state_name": "Mock State",
+            "district_name": district_name,
+            "block_name": f"Block {idx % 10}",
+            "pincode": pincode if pincode else 110000 + idx % 100,
+            "lat": 28,
+            "long": 77,
+            "from": "09:00:00",
+            "to": "17:00:00",
+            "fee_type": fee_type,
+            "sessions": sessions,
+        }
+        if fee_type == "Paid":
+            center["vaccine_fees"] = [{"vaccine": vaccine, "fee": "780"}]
+        centers.append(center)
+    return {"centers": centers}
+
+
+def load_captcha_model():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "model.txt")) as f:
+        return json.loads(base64.b64decode(f.read().encode("ascii")))
+
+
+def generate_captcha_svg(model, length=5, rng=random):
+    """
+    This function builds an svg captcha out of glyphs of the local model, so that captcha_builder_auto can solve it
+    """
+    glyphs = rng.sample(list(model.items()), length)
+    paths = ['<path d="M0 0L150 50" stroke="#111" fill="none"/>']
+    for idx, (encoded, _) in enumerate(glyphs):
+        x = 10 + idx * 25
+        commands = [f"M{x} 40"] + [letter + " ".join([f"{x + 5} 20"] * (PATH_ARGUMENTS.get(letter, 2) // 2))
+                                   for letter in encoded[1:]]
+        paths.append(f'<path fill="#333" d="{" ".join(commands)}"/>')
+    svg = f'<svg xmlns="http://www.w3.org/2000/svg" width="150" height="50" viewBox="0,0,150,50">{"".join(paths)}</svg>'
+    return svg, "".join(text for _, text in glyphs)
+
+
+def mock_token(mobile="9999999999", valid_for=15 * 60):
+    def encode(part):
+        return base64.urlsafe_b64encode(json.dumps(part).encode()).rstrip(b"=").decode()
+
+    payload = {"user_name": str(uuid.uuid4()), "mobile": mobile, "exp": int(time.time()) + valid_for}
+    return f"{encode({'alg': 'HS256', 'typ': 'JWT'})}.{encode(payload)}.{encode('mock-signature')}"
+
+
+class MockCoWIN:
+    """
+    State of the stand-in: synthetic calendars, configured latency and error rates, and stats of the calls served
+    """
+
+    def __init__(self, centers_per_location=20, sessions_per_center=7, latency=0.0, jitter=0.0, error_rates=None,
+                 book_success_rate=1.0, open_ratio=0.3, seed=0):
+        self.centers_per_location = centers_per_location
+        self.sessions_per_center = sessions_per_center
+        self.latency = latency
+        self.jitter = jitter
+        # {endpoint: {status_code: probability}}
+        self.error_rates = error_rates or {}
+        self.book_success_rate = book_success_rate
+        self.open_ratio = open_ratio
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.model = load_captcha_model()
+        self.calendars = {}
+        self.sessions = {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def calendar(self, kind, location_id, date):
+        key = (kind, str(location_id), date)
+        with self.lock:
+            if key not in self.calendars:
+                location_seed = f"{self.seed}-{kind}-{location_id}-{date}"
+                calendar = generate_calendar(
+                    self.centers_per_location, self.sessions_per_center, start_date=date, seed=location_seed,
+                    district_id=int(location_id) if kind == "district" else 1,
+                    district_name=f"Mock District {location_id}" if kind == "district" else "Mock District",
+                    pincode=int(location_id) if kind == "pincode" else None, open_ratio=self.open_ratio)
+                for center in calendar["centers"]:
+                    for session in center["sessions"]:
+                        self.sessions[session["session_id"]] = session
+                self.calendars[key] = calendar
+            return self.calendars[key]
+
+    def record(self, endpoint, status_code, started):
+        with self.lock:
+            self.calls.append((started, time.perf_counter(), endpoint, status_code))
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls = []
+
+    def stats(self):
+        with self.lock:
+            calls = list(self.calls)
+        by_endpoint = {}
+        for _, _, endpoint, status_code in calls:
+            counts = by_endpoint.setdefault(endpoint, {})
+            counts[str(status_code)] = counts.get(str(status_code), 0) + 1
+        return {"total": len(calls), "endpoints": by_endpoint}
+
+    def injected_error(self, endpoint):
+        roll = self.rng.random()
+        for status_code, probability in self.error_rates.get(endpoint, {}).items():
+            if roll < probability:
+                return status_code
+            roll -= probability
+        return None
+
+    def wait(self):
+        delay = self.latency + (self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_call("GET")
+
+    def do_POST(self):
+        self.handle_call("POST")
+
+    def do_PUT(self):
+        self.handle_call("PUT")
+
+    def handle_call(self, method):
+        mock = self.server.mock
+        started = time.perf_counter()
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        if url.path == "/__stats":
+            return self.respond(200, mock.stats())
+
+        path = url.path[len(API_PREFIX):] if url.path.startswith(API_PREFIX) else None
+        endpoint = ENDPOINTS.get(path)
+        if endpoint is None and path is not None and path.startswith(DISTRICTS_PATH):
+            endpoint = "districts"
+        if endpoint is None:
+            return self.respond(404, {"error": f"{method} {url.path} is not mocked"})
+
+        mock.wait()
+        status_code = mock.injected_error(endpoint)
+        if status_code is None and endpoint not in PUBLIC_ENDPOINTS \
+                and not self.headers.get("Authorization", "").startswith("Bearer "):
+            status_code = 401
+        if status_code is not None:
+            self.respond(status_code, {"errorCode": "MOCK", "error": f"Injected {status_code} for {endpoint}"})
+        else:
+            status_code = getattr(self, f"serve_{endpoint}")(parse_qs(url.query), json.loads(body) if body else {})
+        mock.record(endpoint, status_code, started)
+
+    def respond(self, status_code, payload=None, content_type="application/json"):
+        if payload is None:
+            data = b""
+        elif isinstance(payload, bytes):
+            data = payload
+        else:
+            data = json.dumps(payload).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        return status_code
+
+    def serve_calendar(self, query, body):
+        kind = "district" if "district_id" in query else "pincode"
+        location_id = query.get("district_id", query.get("pincode", ["0"]))[0]
+        calendar = self.server.mock.calendar(kind, location_id, query.get("date", [""])[0])
+        vaccine = query.get("vaccine", [None])[0]
+        if vaccine:
+            calendar = {"centers": [center for center in calendar["centers"]
+                                    if center["sessions"] and center["sessions"][0]["vaccine"] == vaccine]}
+        return self.respond(200, calendar)
+
+    def serve_captcha(self, query, body):
+        svg, _ = generate_captcha_svg(self.server.mock.model, rng=self.server.mock.rng)
+        return self.respond(200, {"captcha": svg})
+
+    def take_capacity(self, session_id, doses):
+        mock = self.server.mock
+        with mock.lock:
+            session = mock.sessions.get(session_id)
+            if session is None or session["available_capacity"] < doses:
+                return False
+            if mock.rng.random() >= mock.book_success_rate:
+                return False
+            session["available_capacity"] -= doses
+            return True
+
+    def serve_schedule(self, query, body):
+        if not self.take_capacity(body.get("session_id"), len(body.get("beneficiaries", [])) or 1):
+            return self.respond(409, {"errorCode": "APPOIN0040", "error": "This vaccination center is completely booked for the selected date"})
+        return self.respond(200, {"appointment_confirmation_no": str(uuid.uuid4())})
+
+    def serve_reschedule(self, query, body):
+        if not self.take_capacity(body.get("session_id"), 1):
+            return self.respond(409, {"errorCode": "APPOIN0040", "error": "This vaccination center is completely booked for the selected date"})
+        return self.respond(204)
+
+    def serve_cancel(self, query, body):
+        return self.respond(204)
+
+    def serve_beneficiaries(self, query, body):
+        return self.respond(200, {"beneficiaries": [{
+            "beneficiary_reference_id": "12345678901234",
+            "name": "Mock Beneficiary",
+            "birth_year": "1990",
+            "gender": "Male",
+            "mobile_number": "9999",
+            "photo_id_type": "Aadhaar Card",
+            "photo_id_number": "XXXXXXXX1234",
+            "comorbidity_ind": "N",
+            "vaccination_status": "Not Vaccinated",
+            "vaccine": "",
+            "dose1_date": "",
+            "dose2_date": "",
+            "appointments": [],
+        }]})
+
+    def serve_appointmentslip(self, query, body):
+        return self.respond(200, b"%PDF-1.4 mock appointment slip", content_type="application/pdf")
+
+    def serve_states(self, query, body):
+        return self.respond(200, {"states": [{"state_id": state_id, "state_name": name}
+                                             for state_id, (name, _) in sorted(STATES.items())], "ttl": 24})
+
+    def serve_districts(self, query, body):
+        state_id = urlparse(self.path).path.rsplit("/", 1)[-1]
+        _, districts = STATES.get(int(state_id) if state_id.isdigit() else None, (None, {}))
+        return self.respond(200, {"districts": [{"district_id": district_id, "district_name": name}
+                                                for district_id, name in sorted(districts.items())], "ttl": 24})
+
+    def serve_otp(self, query, body):
+        return self.respond(200, {"txnId": str(uuid.uuid4())})
+
+    def serve_otp_validate(self, query, body):
+        # the client sends the sha256 of the OTP, as CoWIN expects it
+        if body.get("otp") != sha256(MOCK_OTP.encode("utf-8")).hexdigest():
+            return self.respond(401, {"errorCode": "USRAUT0014", "error": "Invalid OTP"})
+        return self.respond(200, {"token": mock_token()})
+
+
+def start_server(mock, host="127.0.0.1", port=0):
+    """
+    This function starts the stand-in on a background thread and returns the server, its url is server.url
+    """
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.mock = mock
+    server.url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_error_rates(specs):
+    """
+    This function turns ["calendar:500=0.05", "schedule:409=0.5"] into {"calendar": {500: 0.05}, "schedule": {409: 0.5}}
+    """
+    error_rates = {}
+    for spec in specs or []:
+        endpoint, rate = spec.split(":", 1)
+        status_code, probability = rate.split("=", 1)
+        error_rates.setdefault(endpoint, {})[int(status_code)] = float(probability)
+    return error_rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the CoWIN API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--centers", type=int, default=20, help="Centers per district/pincode")
+    parser.add_argument("--sessions", type=int, default=7, help="Sessions per center")
+    parser.add_argument("--open-ratio", type=float, default=0.3, help="Share of sessions with capacity")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to the latency")
+    parser.add_argument("--error", action="append", help="endpoint:status=probability, e.g. calendar:500=0.05")
+    parser.add_argument("--book-success-rate", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    mock = MockCoWIN(centers_per_location=args.centers, sessions_per_center=args.sessions, latency=args.latency,
+                     jitter=args.jitter, error_rates=parse_error_rates(args.error),
+                     book_success_rate=args.book_success_rate, open_ratio=args.open_ratio, seed=args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.mock = mock
+    print(f"Mock CoWIN listening on http://{args.host}:{args.port} (OTP is always {MOCK_OTP})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import re
+import requests
+import threading
+import time
+import metrics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+KVDB_BUCKET_URL = "https://kvdb.io/SK2XsE52VMgzwaZMKAK2pc/"
+# seconds to wait for a kvdb.io response, kvdb.io is not CoWIN so its calls do not go through transport
+KVDB_TIMEOUT_SECS = 10
+# seconds to wait for the OTP SMS
+OTP_TIMEOUT_SECS = 3 * 60
+
+OTP_PATTERN = re.compile(r"\b(\d{6})\b")
+
+
+def parse_otp(text):
+    """
+    This function returns the 6 digit OTP of the SMS text, or None when there is none
+    """
+    if not text:
+        return None
+    match = OTP_PATTERN.search(text)
+    return match.group(1) if match else None
+
+
+class KvdbSource:
+    """
+    The kvdb.io bucket of the mobile number, polled right after the OTP request, then less and less often
+    """
+    name = "kvdb"
+
+    def __init__(self, mobile, min_interval=0.5, max_interval=5, backoff=1.5):
+        self.storage_url = KVDB_BUCKET_URL + mobile
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+    def prepare(self):
+        print("clearing OTP bucket: " + self.storage_url)
+        requests.put(self.storage_url, data={}, timeout=KVDB_TIMEOUT_SECS)
+
+    def wait(self, timeout=OTP_TIMEOUT_SECS):
+        deadline = time.time() + timeout
+        interval = self.min_interval
+        while time.time() < deadline:
+            try:
+                response = requests.get(self.storage_url, timeout=KVDB_TIMEOUT_SECS)
+                if response.status_code == 200:
+                    otp = parse_otp(response.text)
+                    if otp:
+                        print("OTP SMS is:" + response.text)
+                        return otp
+                else:
+                    print("error fetching OTP API:" + response.text)
+            except requests.RequestException as e:
+                print(f"error fetching OTP API: {e}")
+            time.sleep(min(interval, max(0, deadline - time.time())))
+            interval = min(interval * self.backoff, self.max_interval)
+        return None
+
+
+class OtpReceiver:
+    """
+    Local http server the SMS forwarder pushes the SMS text to, as the body of a POST to /otp/<mobile> or as
+    /otp/<mobile>?message=...; /otp without a mobile number is taken for any mobile number.
+    """
+
+    def __init__(self, port, host="0.0.0.0"):
+        self.condition = threading.Condition()
+        self.received = {}
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                receiver.handle(self, self.rfile.read(length).decode("utf-8", "replace"))
+
+            def do_GET(self):
+                receiver.handle(self, "".join(parse_qs(urlparse(self.path).query).get("message", [])))
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="otp-receiver", daemon=True)
+        self.thread.start()
+        print(f"Waiting for OTP SMS on port {self.server.server_address[1]}, at /otp/<mobile>")
+
+    def handle(self, request, text):
+        parts = urlparse(request.path).path.strip("/").split("/")
+        otp = parse_otp(text)
+        if parts[0] != "otp" or otp is None:
+            request.send_response(400 if parts[0] == "otp" else 404)
+            request.end_headers()
+            return
+        mobile = parts[1] if len(parts) > 1 else None
+        with self.condition:
+            self.received[mobile] = (otp, time.time())
+            self.condition.notify_all()
+        request.send_response(204)
+        request.end_headers()
+
+    def clear(self, mobile):
+        with self.condition:
+            self.received.pop(mobile, None)
+            self.received.pop(None, None)
+
+    def wait(self, mobile, timeout):
+        """
+        This function wakes up as soon as an OTP for the mobile number arrives, it returns None on timeout
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                received = self.received.pop(mobile, None) or self.received.pop(None, None)
+                if received is not None:
+                    return received[0]
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class WebhookSource:
+    name = "webhook"
+
+    def __init__(self, receiver, mobile):
+        self.receiver = receiver
+        self.mobile = mobile
+
+    def prepare(self):
+        self.receiver.clear(self.mobile)
+
+    def wait(self, timeout=OTP_TIMEOUT_SECS):
+        return self.receiver.wait(self.mobile, timeout)
+
+
+RECEIVER = None
+
+
+def configure(spec=None):
+    """
+    This function sets where OTPs come from, from an --otp-source value: kvdb or webhook:PORT
+    """
+    global RECEIVER
+    if not spec or spec == "kvdb":
+        RECEIVER = None
+        return
+    name, _, port = spec.partition(":")
+    if name != "webhook" or not port.isdigit():
+        raise ValueError(f"Unknown OTP source {spec}, use kvdb or webhook:PORT")
+    RECEIVER = OtpReceiver(int(port))
+
+
+def get_source(mobile):
+    if RECEIVER is not None:
+        return WebhookSource(RECEIVER, mobile)
+    return KvdbSource(mobile)
+
+
+def wait_for_otp(source, requested_at, timeout=OTP_TIMEOUT_SECS):
+    """
+    This function waits for the OTP from the source, and records how long after requested_at it arrived
+    """
+    otp = source.wait(timeout)
+    if not otp:
+        metrics.OTP_TIMEOUTS.inc(source.name)
+        return otp
+    latency = time.time() - requested_at
+    metrics.OTP_WAIT_SECONDS.observe(latency, source.name)
+    print(f"OTP arrived {latency:.1f} seconds after the request")
+    return otp
@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import deque
+
+# CoWIN allows 100 calendar calls per 5 minutes per IP
+POLL_CALLS_PER_WINDOW = 100
+POLL_WINDOW_SECS = 5 * 60
+
+CALENDAR_PATH = "/appointment/sessions/calendarBy"
+
+
+class PollScheduler:
+    """
+    Spreads the calendar calls of all monitored locations inside a calls-per-window budget.
+
+    The interval shrinks for boost_secs after availability was seen and grows after 403/429 responses, always
+    without going over the budget. min_interval, e.g. the refresh frequency, is the floor of the interval except
+    while boosted, when only the budget interval is.
+    """
+
+    def __init__(self, calls_per_window=POLL_CALLS_PER_WINDOW, window_secs=POLL_WINDOW_SECS, min_interval=1,
+                 max_interval=60, boost_secs=120, boost_factor=2, max_backoff=16):
+        self.calls_per_window = calls_per_window
+        self.window_secs = window_secs
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.boost_secs = boost_secs
+        self.boost_factor = boost_factor
+        self.max_backoff = max_backoff
+        self.backoff = 1
+        self.last_availability = None
+        self.last_throttled = None
+        self.calls = deque()
+        self.lock = threading.Lock()
+
+    def observe(self, method, url, response, elapsed):
+        """
+        This function is a transport response hook, it counts calendar calls and reacts to throttling
+        """
+        if CALENDAR_PATH not in url:
+            return
+        now = time.time()
+        with self.lock:
+            self.calls.append(now)
+            if response.status_code in (403, 429):
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+                self.last_throttled = now
+            elif response.status_code == 200 and self.backoff > 1:
+                self.backoff = max(1, self.backoff / 2)
+
+    def record_availability(self, found):
+        if found:
+            self.last_availability = time.time()
+
+    def _expire(self, now):
+        while self.calls and self.calls[0] <= now - self.window_secs:
+            self.calls.popleft()
+
+    def plan(self, calls_per_cycle):
+        """
+        This function returns the current plan: budget interval, backoff, boost, usage of the window and next delay
+        """
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            calls_per_cycle = max(1, calls_per_cycle)
+            budget_interval = self.window_secs * calls_per_cycle / self.calls_per_window
+            # backoff never stretches the interval past max_interval, nor does the cap go under the budget interval
+            interval = min(max(budget_interval, self.min_interval) * self.backoff,
+                           max(budget_interval, self.max_interval))
+            boosted = (self.backoff == 1 and self.last_availability is not None
+                       and now - self.last_availability < self.boost_secs)
+            if boosted:
+                interval = max(interval / self.boost_factor, budget_interval)
+
+            # never start a cycle that would go over the budget, wait for enough calls to leave the window
+            remaining = self.calls_per_window - len(self.calls)
+            budget_wait = 0
+            if remaining < calls_per_cycle and self.calls:
+                oldest_needed = self.calls[min(len(self.calls) - 1, calls_per_cycle - remaining - 1)]
+                budget_wait = oldest_needed + self.window_secs - now
+
+            return {
+                "calls_per_cycle": calls_per_cycle,
+                "budget": f"{self.calls_per_window} calls / {self.window_secs}s",
+                "calls_in_window": len(self.calls),
+                "budget_interval": round(budget_interval, 2),
+                "backoff": self.backoff,
+                "boosted": boosted,
+                "next_delay": round(max(interval, budget_wait, 0), 2),
+            }
+
+    def next_delay(self, calls_per_cycle):
+        return self.plan(calls_per_cycle)["next_delay"]
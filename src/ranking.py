@@ -0,0 +1,121 @@
+import random
+import threading
+from collections import namedtuple
+
+# weight of each scoring feature; a higher score is attempted first
+DEFAULT_WEIGHTS = {
+    "date": 1.0,        # minus one per day after the earliest date in the options
+    "capacity": 1.0,    # up to one for sessions with CAPACITY_SCALE seats or more
+    "preferred": 2.0,   # one for a preferred center
+    "free": 0.0,        # one for a free center
+    "fee": 0.0,         # minus the fee in thousands of rupees
+    "history": 0.5,     # success rate of the earlier booking attempts at the center
+}
+CAPACITY_SCALE = 50
+
+# one booking attempt: rank is the position of the option in the ranked options
+Attempt = namedtuple("Attempt", ["rank", "option", "slot"])
+
+
+def parse_weights(spec):
+    """
+    This function turns "date=2,capacity=1" into a weights dict, the features not given keep their default
+    """
+    weights = dict(DEFAULT_WEIGHTS)
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, _, value = item.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_WEIGHTS:
+            raise ValueError(f"Unknown ranking feature {name}, use one of {', '.join(DEFAULT_WEIGHTS)}")
+        weights[name] = float(value)
+    return weights
+
+
+def default_slot_count(slots):
+    # 2 or 3 slots of a session are tried, not all of them, to keep the calls down when a center is full
+    return 2 if len(slots) <= 4 else 3
+
+
+class BookingHistory:
+    """
+    Outcome of the booking attempts per center, as a success rate that starts at 0.5 and moves with each attempt
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.attempts = {}
+        self.successes = {}
+
+    def record(self, center_id, booked):
+        with self.lock:
+            self.attempts[center_id] = self.attempts.get(center_id, 0) + 1
+            if booked:
+                self.successes[center_id] = self.successes.get(center_id, 0) + 1
+
+    def success_rates(self):
+        with self.lock:
+            return {center_id: (self.successes.get(center_id, 0) + 1) / (attempts + 2)
+                    for center_id, attempts in self.attempts.items()}
+
+
+class SlotRanker:
+    """
+    Orders the viable options with a weighted score, computed once per option, and turns them into the list of
+    (session, slot) attempts to make
+    """
+
+    def __init__(self, weights=None, preferred_centers=(), history=None, slot_count=default_slot_count, rng=random):
+        self.weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+        self.preferred_centers = frozenset(int(center_id) for center_id in preferred_centers)
+        self.history = history
+        self.slot_count = slot_count
+        self.rng = rng
+
+    def rank(self, options):
+        """
+        This function returns the options from the highest score down; ties go to the earliest date, then by
+        location and name so that the order is stable between cycles
+        """
+        if not options:
+            return []
+        weights = self.weights
+        first_day = min(option.day for option in options)
+        rates = self.history.success_rates() if self.history is not None and weights["history"] else {}
+        preferred = self.preferred_centers
+
+        def key(option):
+            score = (weights["capacity"] * min(option.available, CAPACITY_SCALE) / CAPACITY_SCALE
+                     - weights["date"] * (option.day - first_day).days)
+            if preferred and option.center_id in preferred:
+                score += weights["preferred"]
+            if weights["free"] and option.fee_type == "Free":
+                score += weights["free"]
+            if weights["fee"]:
+                score -= weights["fee"] * float(option.fee or 0) / 1000
+            if rates:
+                score += weights["history"] * rates.get(option.center_id, 0.5)
+            return -score, option.day, option.district.lower(), option.pincode, option.name.lower()
+
+        return sorted(options, key=key)
+
+    def attempts(self, ranked_options):
+        """
+        This function returns the attempts for options already ranked: slot_count(slots) random slots per session
+        """
+        attempts = []
+        for rank, option in enumerate(ranked_options):
+            slots = option.slots
+            if not slots:
+                continue
+            for slot in self.rng.sample(slots, min(len(slots), self.slot_count(slots))):
+                attempts.append(Attempt(rank, option, slot))
+        return attempts
+
+    def record(self, option, booking_status):
+        """
+        This function feeds the outcome of an attempt to the history, booking_status as book_appointment returns it
+        """
+        if self.history is not None and booking_status in (1000, 409):
+            self.history.record(option.center_id, booking_status == 1000)
@@ -0,0 +1,157 @@
+import random
+import threading
+import time
+from collections import deque
+
+# BOOKING_BREAKER opens after FAILURE_THRESHOLD failed booking calls within FAILURE_WINDOW_SECS, and lets a trial
+# attempt through after COOLDOWN_SECS
+FAILURE_THRESHOLD = 5
+FAILURE_WINDOW_SECS = 60
+COOLDOWN_SECS = 60
+
+
+class RetryPolicy:
+    """
+    The n-th retry waits base * factor ** (n - 1) seconds, at most max_delay, scaled by a random factor between
+    1 - jitter and 1 + jitter so that loops failing together do not retry together
+    """
+
+    def __init__(self, name, base, factor=2.0, max_delay=60, max_attempts=None, deadline=None, jitter=0.3,
+                 rng=random):
+        self.name = name
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.jitter = jitter
+        self.rng = rng
+
+    def start(self):
+        return Retry(self)
+
+
+class Retry:
+    """
+    Attempts of one call under a RetryPolicy, the first attempt included
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.reset()
+
+    def reset(self):
+        self.attempts = 1
+        self.started = time.time()
+
+    def next_delay(self):
+        """
+        This function returns the seconds to wait before the next attempt, None when the policy allows no more
+        """
+        policy = self.policy
+        if policy.max_attempts is not None and self.attempts >= policy.max_attempts:
+            return None
+        delay = min(policy.max_delay, policy.base * policy.factor ** (self.attempts - 1))
+        delay *= policy.rng.uniform(1 - policy.jitter, 1 + policy.jitter)
+        if policy.deadline is not None and time.time() + delay - self.started > policy.deadline:
+            return None
+        self.attempts += 1
+        return delay
+
+    def wait(self, reason):
+        """
+        This function
+            1. Logs why the call is retried and when, or that it is given up,
+            2. Sleeps until the next attempt, and
+            3. Returns False when the call is given up
+        """
+        delay = self.next_delay()
+        if delay is None:
+            print(f"[retry {self.policy.name}] {reason}; giving up after {self.attempts} attempts in "
+                  f"{time.time() - self.started:.1f} seconds")
+            return False
+        limit = f"/{self.policy.max_attempts}" if self.policy.max_attempts is not None else ""
+        print(f"[retry {self.policy.name}] {reason}; attempt {self.attempts}{limit} in {delay:.1f} seconds")
+        time.sleep(delay)
+        return True
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, window=FAILURE_WINDOW_SECS, cooldown=COOLDOWN_SECS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = deque()
+        self.state = "closed"
+        self.opened_at = None
+        self.trial_at = None
+
+    def allow(self):
+        """
+        This function returns whether an attempt may go through now; once the cooldown is over it lets one trial
+        attempt through per cooldown, until one of them succeeds or fails
+        """
+        with self.lock:
+            now = time.time()
+            if self.state == "open" and now - self.opened_at >= self.cooldown:
+                self.state = "half-open"
+                print(f"[circuit {self.name}] half-open, letting a trial attempt through")
+            if self.state == "closed":
+                return True
+            if self.state == "half-open" and (self.trial_at is None or now - self.trial_at >= self.cooldown):
+                self.trial_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures.clear()
+            if self.state != "closed":
+                print(f"[circuit {self.name}] closed, the API answers again")
+                self.state = "closed"
+                self.trial_at = None
+
+    def record_failure(self):
+        with self.lock:
+            now = time.time()
+            self.failures.append(now)
+            while self.failures and now - self.failures[0] > self.window:
+                self.failures.popleft()
+            if self.state == "half-open" or (self.state == "closed" and len(self.failures) >= self.failure_threshold):
+                print(f"[circuit {self.name}] open after {len(self.failures)} server errors in {self.window} seconds, "
+                      f"pausing for {self.cooldown} seconds")
+                self.state = "open"
+                self.opened_at = now
+                self.trial_at = None
+
+    @property
+    def is_open(self):
+        with self.lock:
+            return self.state == "open"
+
+    def retry_after(self):
+        """
+        This function returns the seconds until the next attempt may go through
+        """
+        with self.lock:
+            now = time.time()
+            if self.state == "open":
+                return max(0, self.opened_at + self.cooldown - now)
+            if self.state == "half-open" and self.trial_at is not None:
+                return max(0, self.trial_at + self.cooldown - now)
+            return 0
+
+
+POLICIES = {
+    # 5xx responses of a booking call, each attempt with a new captcha
+    "schedule": RetryPolicy("schedule", base=1, max_delay=8, max_attempts=4, deadline=30),
+    "reschedule": RetryPolicy("reschedule", base=1, max_delay=8, max_attempts=4, deadline=30),
+    # a poll cycle that raised, the booking loops never give up
+    "cycle": RetryPolicy("cycle", base=5, max_delay=120),
+    # an OTP request that did not give a token, every attempt sends an SMS
+    "otp": RetryPolicy("otp", base=5, max_delay=120),
+}
+
+BOOKING_BREAKER = CircuitBreaker("booking")
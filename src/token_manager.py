@@ -0,0 +1,105 @@
+import threading
+import time
+import jwt
+from retry import POLICIES
+
+# a token is treated as expired this many seconds early, for clock issues
+EXPIRY_MARGIN_SECS = 30
+# background renewal starts this long before expiry, enough for an OTP round trip through the SMS forwarder
+RENEW_BEFORE_SECS = 4 * 60
+
+
+def token_expiry(token):
+    return jwt.decode(token, options={"verify_signature": False})["exp"]
+
+
+class TokenManager:
+    """
+    Owns the token of a booking loop: its expiry is decoded once, and with a renew callable the token is renewed
+    on a background thread before it expires, while polling goes on with the current one.
+
+    Request headers registered with bind() get the new Authorization header as soon as a token is swapped in.
+    """
+
+    def __init__(self, token, renew=None, renew_before=RENEW_BEFORE_SECS):
+        # renew() returns a new token or None, it is retried with the exponential backoff of POLICIES["otp"] until it
+        # succeeds
+        self.renew = renew
+        self.renew_before = renew_before
+        self.condition = threading.Condition()
+        self.headers = []
+        self.renewing = False
+        self.stopped = False
+        self.token = None
+        self.expires_at = 0
+        self.set_token(token)
+
+    def set_token(self, token):
+        expires_at = token_expiry(token)
+        with self.condition:
+            self.token = token
+            self.expires_at = expires_at
+            for request_header in self.headers:
+                request_header["Authorization"] = f"Bearer {token}"
+            self.condition.notify_all()
+
+    def bind(self, request_header):
+        with self.condition:
+            request_header["Authorization"] = f"Bearer {self.token}"
+            self.headers.append(request_header)
+        return request_header
+
+    def remaining_seconds(self):
+        return self.expires_at - time.time()
+
+    def is_valid(self):
+        return self.remaining_seconds() > EXPIRY_MARGIN_SECS
+
+    def maybe_renew(self):
+        """
+        This function starts the background renewal once the token is within renew_before of its expiry
+        """
+        if self.renew is None or self.remaining_seconds() > self.renew_before:
+            return
+        with self.condition:
+            if self.renewing or self.stopped:
+                return
+            self.renewing = True
+        print(f"Token expires in {int(self.remaining_seconds())} seconds, renewing it in the background ...")
+        threading.Thread(target=self._renew, name="token-renewal", daemon=True).start()
+
+    def wait_until_valid(self, timeout=None):
+        """
+        This function blocks until a valid token is in place, it returns False on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while not self.is_valid() and not self.stopped:
+                wait = None if deadline is None else deadline - time.time()
+                if wait is not None and wait <= 0:
+                    return False
+                self.condition.wait(wait if wait is not None else 5)
+            return self.is_valid()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def _renew(self):
+        retry = POLICIES["otp"].start()
+        try:
+            while not self.stopped:
+                try:
+                    token = self.renew()
+                except Exception as e:
+                    print(str(e))
+                    token = None
+                if token:
+                    self.set_token(token)
+                    print("Token renewed in the background")
+                    return
+                retry.wait("no token from the OTP")
+        finally:
+            with self.condition:
+                self.renewing = False
@@ -0,0 +1,224 @@
+import atexit
+import base64
+import gzip
+import json
+import re
+import threading
+import time
+import requests
+import transport
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+REDACTED = "REDACTED"
+# json keys that contain any of these, in any case, never have their values written to a recording
+SECRET_KEYS = ("token", "txnid", "otp", "mobile", "secret", "photo_id", "reference_id", "bref", "appointment_id",
+               "birth")
+# keys of a beneficiary, a json object with a reference id, that are redacted as well
+PERSONAL_KEYS = {"name", "gender"}
+JWT = re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]+")
+# beneficiary reference ids, e.g. in the list of beneficiaries of a booking request
+BENEFICIARY_ID = re.compile(r"\b\d{14}\b")
+# the responses of these endpoints are recorded without a body
+DROPPED_BODIES = ("/appointment/appointmentslip",)
+# response bodies of these content types are kept as text, any other body as base64
+TEXT_CONTENT_TYPES = ("json", "text", "svg", "xml")
+
+
+def secret_key(key):
+    key = str(key).lower()
+    return any(part in key for part in SECRET_KEYS)
+
+
+def redact_string(value):
+    return BENEFICIARY_ID.sub(REDACTED, JWT.sub(REDACTED, value))
+
+
+def redact(value):
+    """
+    This function returns the json value with the values of SECRET_KEYS, the PERSONAL_KEYS of beneficiaries, every
+    JWT and every beneficiary reference id replaced by REDACTED
+    """
+    if isinstance(value, dict):
+        beneficiary = any("reference_id" in str(key).lower() for key in value)
+        return {key: REDACTED if secret_key(key) or (beneficiary and str(key).lower() in PERSONAL_KEYS)
+                else redact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        return redact_string(value)
+    return value
+
+
+def redact_text(text):
+    if not text:
+        return text
+    try:
+        return json.dumps(redact(json.loads(text)))
+    except ValueError:
+        return redact_string(text)
+
+
+def redact_url(url):
+    # the query is only rebuilt when it has a secret, so that the other urls match exactly on replay
+    parts = urlparse(url)
+    query = parse_qsl(parts.query)
+    if any(secret_key(key) for key, _ in query):
+        query = [(key, REDACTED if secret_key(key) else value) for key, value in query]
+        url = urlunparse(parts._replace(query=urlencode(query)))
+    return redact_string(url)
+
+
+def normalized_url(url):
+    # the url as requests sends it, e.g. with "SPUTNIK V" quoted, so recorded and sent urls compare equal
+    return requests.Request("GET", url).prepare().url
+
+
+def undated_url(url):
+    parts = urlparse(url)
+    query = sorted((key, value) for key, value in parse_qsl(parts.query) if key != "date")
+    return urlunparse(parts._replace(query=urlencode(query)))
+
+
+class TrafficRecorder:
+    """
+    Response hook of transport that writes every CoWIN call to the recording, from any thread
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, "at", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.count = 0
+
+    def record(self, method, url, response, elapsed):
+        if self.file is None or not url.startswith(transport.COWIN_HOST):
+            return
+        body = response.request.body if response.request is not None else None
+        if isinstance(body, bytes):
+            body = body.decode("utf-8", "replace")
+        content_type = response.headers.get("Content-Type", "")
+        entry = {
+            "at": round(time.time() - elapsed - self.started, 4),
+            "method": method,
+            "url": redact_url(url),
+            "request": redact_text(body),
+            "status": response.status_code,
+            "latency": round(elapsed, 4),
+            "content_type": content_type,
+        }
+        if any(path in url for path in DROPPED_BODIES):
+            entry["body"] = ""
+        elif any(kind in content_type for kind in TEXT_CONTENT_TYPES):
+            entry["body"] = redact_text(response.text)
+        else:
+            entry["body_b64"] = base64.b64encode(response.content).decode("ascii")
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            if self.file is not None:
+                self.file.write(line)
+                # flushed line by line, so a script that is killed leaves a recording readable up to its last call
+                self.file.flush()
+                self.count += 1
+
+    def stop(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def load_recording(path):
+    records = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+        except EOFError:
+            # the recording of a killed script has no gzip trailer, the lines flushed before are all there
+            pass
+    return records
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    requests adapter that answers from a recording instead of the network, mounted on the transport session
+    """
+
+    def __init__(self, records, scale=1.0):
+        super().__init__()
+        self.scale = scale
+        self.lock = threading.Lock()
+        self.exact = {}
+        self.undated = {}
+        self.positions = {}
+        self.served = 0
+        self.missing = 0
+        for record in records:
+            url = normalized_url(record["url"])
+            self.exact.setdefault((record["method"], url), []).append(record)
+            self.undated.setdefault((record["method"], undated_url(url)), []).append(record)
+
+    def next_record(self, method, url):
+        with self.lock:
+            for table, key in ((self.exact, (method, url)), (self.undated, (method, undated_url(url)))):
+                records = table.get(key)
+                if records:
+                    position = self.positions.get((id(table), key), 0)
+                    self.positions[(id(table), key)] = position + 1
+                    self.served += 1
+                    return records[min(position, len(records) - 1)]
+            self.missing += 1
+            return None
+
+    def send(self, request, **kwargs):
+        record = self.next_record(request.method, request.url)
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.encoding = "utf-8"
+        if record is None:
+            response.status_code = 404
+            response.headers = CaseInsensitiveDict({"Content-Type": "application/json"})
+            response._content = json.dumps({"error": f"{request.method} {request.url} is not in the recording"}).encode()
+            return response
+        if self.scale:
+            time.sleep(record["latency"] * self.scale)
+        response.status_code = record["status"]
+        response.headers = CaseInsensitiveDict({"Content-Type": record.get("content_type", "")})
+        if "body_b64" in record:
+            response._content = base64.b64decode(record["body_b64"])
+        else:
+            response._content = (record.get("body") or "").encode("utf-8")
+        return response
+
+    def close(self):
+        pass
+
+    def stats(self):
+        with self.lock:
+            return {"served": self.served, "missing": self.missing}
+
+
+def start_recording(path):
+    """
+    This function writes every CoWIN call from now on to the recording at path, until the script exits
+    """
+    recorder = TrafficRecorder(path)
+    transport.add_response_hook(recorder.record)
+    atexit.register(recorder.stop)
+    print(f"Recording CoWIN calls to {path}")
+    return recorder
+
+
+def start_replay(path, scale=1.0):
+    """
+    This function answers every call of transport from the recording at path, latencies multiplied by scale
+    """
+    adapter = ReplayAdapter(load_recording(path), scale)
+    transport.set_adapter(adapter)
+    print(f"Replaying CoWIN calls from {path}")
+    return adapter
@@ -0,0 +1,280 @@
+import os
+import threading
+import time
+import requests
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+
+# number of keep-alive connections kept open per host
+POOL_SIZE = 10
+
+# host of the CoWIN API urls, requests to it are sent to API_BASE instead when that is set (e.g. a local stand-in)
+COWIN_HOST = "https://cdn-api.co-vin.in"
+API_BASE = os.environ.get("COWIN_API_BASE")
+
+# callables hook(method, url, response, elapsed) run after every response, url is the CoWIN url asked for
+RESPONSE_HOOKS = []
+
+# adapter that answers every call instead of the network, e.g. traffic.ReplayAdapter
+ADAPTER = None
+
+# endpoint of a url: the first of these whose path fragment is in the url, "default" when none is
+ENDPOINTS = [
+    ("calendar", "/appointment/sessions/calendarBy"),
+    ("schedule", "/appointment/schedule"),
+    ("reschedule", "/appointment/reschedule"),
+    ("captcha", "/auth/getRecaptcha"),
+    ("auth", "/auth/"),
+]
+# (connect, read) timeouts in seconds per endpoint; a booking call gets longer to answer, since giving up on it
+# does not cancel it
+ENDPOINT_TIMEOUTS = {
+    "calendar": (3.05, 10),
+    "schedule": (3.05, 30),
+    "reschedule": (3.05, 30),
+    "captcha": (3.05, 10),
+    "auth": (3.05, 15),
+    "default": (5, 20),
+}
+
+# GETs of these endpoints are sent a second time once the first has taken longer than the HEDGE_PERCENTILE latency
+# of the endpoint, and the response that comes first is used
+HEDGED_ENDPOINTS = set()
+HEDGE_PERCENTILE = 95
+# latencies kept per endpoint, and how many of them are needed before any request is hedged
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+# at most this share of the recent requests of an endpoint is hedged, so a slow API does not get twice the calls
+HEDGE_MAX_RATIO = 0.1
+HEDGE_WORKERS = 16
+# callables hook(endpoint, winner) run after every hedged request, winner is "first" or "hedge"
+HEDGE_HOOKS = []
+
+_session = None
+_session_lock = threading.Lock()
+_latencies = {}
+_hedge_pool = None
+
+
+def build_session(pool_size):
+    session = requests.Session()
+    adapter = ADAPTER or HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def configure(pool_size=None):
+    """
+    This function
+        1. Sets the connection pool size, and
+        2. Replaces the shared session so that the next call uses the new pool
+    """
+    global POOL_SIZE, _session
+    with _session_lock:
+        if pool_size:
+            POOL_SIZE = pool_size
+        old_session, _session = _session, build_session(POOL_SIZE)
+    if old_session is not None:
+        old_session.close()
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session(POOL_SIZE)
+    return _session
+
+
+def set_api_base(api_base):
+    global API_BASE
+    API_BASE = api_base.rstrip("/") if api_base else None
+
+
+def set_adapter(adapter):
+    """
+    This function sends every call to the adapter from now on, None goes back to the network
+    """
+    global ADAPTER
+    ADAPTER = adapter
+    configure()
+
+
+def endpoint_of(url):
+    for endpoint, fragment in ENDPOINTS:
+        if fragment in url:
+            return endpoint
+    return "default"
+
+
+def set_endpoint_timeout(endpoint, connect, read):
+    if endpoint not in ENDPOINT_TIMEOUTS:
+        raise ValueError(f"Unknown endpoint {endpoint}, use one of {', '.join(ENDPOINT_TIMEOUTS)}")
+    ENDPOINT_TIMEOUTS[endpoint] = (connect, read)
+
+
+def parse_timeout(spec):
+    """
+    This function turns "calendar=2/6" into ("calendar", 2.0, 6.0), and "calendar=6" into ("calendar", 6.0, 6.0)
+    """
+    endpoint, _, value = spec.partition("=")
+    connect, _, read = value.partition("/")
+    try:
+        connect = float(connect)
+        read = float(read) if read else connect
+    except ValueError:
+        raise ValueError(f"Invalid timeout {spec}, use ENDPOINT=CONNECT/READ in seconds, e.g. calendar=2/6")
+    if connect <= 0 or read <= 0:
+        raise ValueError(f"Invalid timeout {spec}, the seconds have to be above 0")
+    return endpoint.strip(), connect, read
+
+
+def configure_timeouts(specs):
+    """
+    This function sets the timeouts of --timeout options, e.g. ["calendar=2/6", "schedule=3/45"]
+    """
+    for spec in specs or ():
+        set_endpoint_timeout(*parse_timeout(spec))
+
+
+def set_hedged_endpoints(endpoints):
+    HEDGED_ENDPOINTS.clear()
+    HEDGED_ENDPOINTS.update(endpoints)
+
+
+def add_hedge_hook(hook):
+    HEDGE_HOOKS.append(hook)
+
+
+class LatencyTracker:
+    """
+    Latencies of the recent responses of an endpoint, and which of its recent requests were hedged
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.hedged = deque(maxlen=window)
+
+    def add(self, elapsed):
+        with self.lock:
+            self.latencies.append(elapsed)
+
+    def percentile(self, percent):
+        """
+        This function returns the latency below which percent of the recent responses came, None with too few of them
+        """
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+    def allow_hedge(self, hedge):
+        """
+        This function records whether a slow request is hedged and returns that, hedge or not: False once
+        HEDGE_MAX_RATIO of the recent requests were hedged
+        """
+        with self.lock:
+            hedge = hedge and sum(self.hedged) < HEDGE_MAX_RATIO * self.hedged.maxlen
+            self.hedged.append(hedge)
+            return hedge
+
+
+def latency_tracker(endpoint):
+    with _session_lock:
+        tracker = _latencies.get(endpoint)
+        if tracker is None:
+            tracker = _latencies[endpoint] = LatencyTracker()
+        return tracker
+
+
+def get_hedge_pool():
+    global _hedge_pool
+    with _session_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+        return _hedge_pool
+
+
+def hedged(send, endpoint, tracker):
+    """
+    This function
+        1. Sends the request, and returns its response if it comes within the HEDGE_PERCENTILE latency,
+        2. Else sends it again, unless HEDGE_MAX_RATIO of the recent requests were already hedged, and
+        3. Returns the first response of the two; an error is only raised when both fail
+    """
+    delay = tracker.percentile(HEDGE_PERCENTILE)
+    if delay is None:
+        return send()
+    pool = get_hedge_pool()
+    first = pool.submit(send)
+    done, _ = wait([first], timeout=delay)
+    if not tracker.allow_hedge(not done):
+        return first.result()
+
+    # the request that loses goes on in the background, its response is dropped
+    futures = [first, pool.submit(send)]
+    pending = list(futures)
+    while True:
+        wait(pending, return_when=FIRST_COMPLETED)
+        for future in [future for future in pending if future.done()]:
+            pending.remove(future)
+            if future.exception() is None or not pending:
+                winner = "first" if future is first else "hedge"
+                for hook in list(HEDGE_HOOKS):
+                    hook(endpoint, winner)
+                return future.result()
+
+
+def add_response_hook(hook):
+    RESPONSE_HOOKS.append(hook)
+
+
+def remove_response_hook(hook):
+    if hook in RESPONSE_HOOKS:
+        RESPONSE_HOOKS.remove(hook)
+
+
+def request(method, url, headers=None, **kwargs):
+    """
+    This function
+        1. Sends the request over the shared keep-alive session with the timeouts of the endpoint, unless a timeout
+           is given, and hedged when the endpoint is in HEDGED_ENDPOINTS,
+        2. Runs the response hooks, and
+        3. Returns the response
+    """
+    requested_url = url
+    if API_BASE and url.startswith(COWIN_HOST):
+        url = API_BASE + url[len(COWIN_HOST):]
+    endpoint = endpoint_of(requested_url)
+    kwargs.setdefault("timeout", ENDPOINT_TIMEOUTS.get(endpoint, ENDPOINT_TIMEOUTS["default"]))
+    tracker = latency_tracker(endpoint)
+
+    def send():
+        started = time.perf_counter()
+        response = get_session().request(method, url, headers=headers, **kwargs)
+        elapsed = time.perf_counter() - started
+        tracker.add(elapsed)
+        for hook in list(RESPONSE_HOOKS):
+            hook(method, requested_url, response, elapsed)
+        return response
+
+    if method == "GET" and endpoint in HEDGED_ENDPOINTS:
+        return hedged(send, endpoint, tracker)
+    return send()
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request("PUT", url, **kwargs)
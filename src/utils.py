@@ -1,15 +1,27 @@
 import json
 import copy
 import datetime
-import random
+import os
 import requests
 import sys
 import tabulate
 import time
+import metrics
+import otp_sources
+import transport
 from inputimeout import TimeoutOccurred, inputimeout
+from live_calendar import LiveCalendar
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from hashlib import sha256
+from calendar_filter import display_rows, excluded_pincode_set, iter_viable_options, unique_sessions
+from alerts import notify
+from booking_coordinator import CLAIM_REFUSED
 from captcha import captcha_builder_manual, captcha_builder_auto, captcha_builder_api
+from ranking import SlotRanker
+from retry import BOOKING_BREAKER, POLICIES
+from useragent import get_user_agent
 
 
 BOOKING_URL = "https://cdn-api.co-vin.in/api/v2/appointment/schedule"
@@ -26,61 +38,131 @@ DOWNLOAD_APPOINTMENT = "https://cdn-api.co-vin.in/api/v2/appointment/appointment
 
 WARNING_BEEP_DURATION = (1000, 5000)
 
-try:
-    import winsound
+# maximum number of calendar requests in flight at once, 1 polls the locations one after another
+CALENDAR_FETCH_WORKERS = 8
+# most 7 day calendar windows scanned per location, 4 reaches four weeks past the start date
+MAX_DATE_WINDOWS = 4
+# shortest interval between the background polls of pipelined mode, whatever the poll scheduler allows
+MIN_LIVE_POLL_SECS = 2
+# booking status of a booking call that got no response, e.g. after a timeout or a dropped connection
+NO_RESPONSE = 0
 
-except ImportError:
-    import os
+# set to False by the headless mode, where nobody is there to press a key
+INTERACTIVE = True
 
-    if sys.platform == "darwin":
+def pause():
+    if INTERACTIVE:
+        os.system("pause")
 
-        def beep(freq, duration):
-            # brew install SoX --> install SOund eXchange universal sound sample translator on mac
-            os.system(
-                f"play -n synth {duration / 1000} sin {freq} >/dev/null 2>&1")
-    else:
-        def beep(freq, duration):
-            # apt-get install beep  --> install beep package on linux distros before running
-            os.system('beep -f %s -l %s' % (freq, duration))
-else:
-    def beep(freq, duration):
-        winsound.Beep(freq, duration)
 
+def request_headers():
+    """
+    This function returns the base, OTP validation and common request headers, each with a random user agent
+    """
+    base_request_header = {
+        'User-Agent': get_user_agent()
+        , 'origin': 'https://selfregistration.cowin.gov.in'
+        , 'referer': 'https://selfregistration.cowin.gov.in/'
+    }
+    otp_validation_header = {
+        'User-Agent': get_user_agent()
+        , 'origin': 'https://selfregistration.cowin.gov.in'
+        , 'sec-fetch-site': 'cross-site'
+        , 'sec-fetch-mode': 'cors'
+        , 'sec-fetch-dest': 'empty'
+        , 'referer': 'https://selfregistration.cowin.gov.in/',
+    }
+
+    common_header = {
+        'User-Agent': get_user_agent()
+        , 'content-type': 'application/json'
+#        , 'origin': 'https://selfregistration.cowin.gov.in/'
+        , 'origin': '127.0.0.1'
+        , 'sec-fetch-site': 'cross-site'
+        , 'sec-fetch-mode': 'cors'
+        , 'sec-fetch-dest': 'empty'
+#        , 'referer': 'https://selfregistration.cowin.gov.in/',
+        , 'referer': '127.0.0.1',
+    }
+    return base_request_header, otp_validation_header, common_header
 
-def book_appointment(request_header, details, mobile, generate_captcha_pref, api_key=None, captcha_api_choice=None):
+
+def search_start_date(start_date):
+    """
+    This function turns the start date choice, 1 for today, 2 for tomorrow or a DD-MM-YYYY date, into the date
+    """
+    if isinstance(start_date, int) and start_date == 2:
+        return (datetime.datetime.today() + datetime.timedelta(days=1)).strftime("%d-%m-%Y")
+    elif isinstance(start_date, int) and start_date == 1:
+        return datetime.datetime.today().strftime("%d-%m-%Y")
+    return start_date
+
+
+def calendar_windows(start_date, windows=1):
+    """
+    This function returns the start dates of the consecutive 7 day calendar windows to query, from start_date on
+    """
+    first = datetime.datetime.strptime(start_date, "%d-%m-%Y")
+    return [(first + datetime.timedelta(days=7 * window)).strftime("%d-%m-%Y") for window in range(max(1, windows))]
+
+
+def book_appointment(request_header, details, mobile, generate_captcha_pref, api_key=None, captcha_api_choice=None,
+                     captcha_prefetcher=None, booking_lock=None):
     """
     This function
         1. Takes details in json format
-        2. Attempts to book an appointment using the details
-        3. Returns True or False depending on Token Validity
+        2. Attempts to book an appointment using the details, with a prefetched captcha when one is ready
+        3. Holds booking_lock, when given, from fetching the captcha to the booking response
+        4. Returns True or False depending on Token Validity
     """
     try:
         valid_captcha = True
+        retry = POLICIES["schedule"].start()
         while valid_captcha:
-            captcha = generate_captcha(request_header, generate_captcha_pref, api_key, captcha_api_choice)
-            details["captcha"] = captcha
-            print(
-                "================================= ATTEMPTING BOOKING ==================================================")
-            resp = requests.post(BOOKING_URL, headers=request_header, json=details)
+            resp = None
+            error = None
+            # a new captcha of the mobile number makes the previous one invalid, loops of one number take turns
+            with booking_lock or nullcontext():
+                # refill() is owed from the take() in get_captcha on, whatever happens to the attempt
+                try:
+                    captcha = get_captcha(request_header, generate_captcha_pref, api_key, captcha_api_choice,
+                                          captcha_prefetcher)
+                    details["captcha"] = captcha
+                    print(
+                        "================================= ATTEMPTING BOOKING ==================================================")
+                    resp = transport.post(BOOKING_URL, headers=request_header, json=details)
+                except requests.RequestException as e:
+                    error = e
+                finally:
+                    if captcha_prefetcher is not None:
+                        # no captcha is needed after a booking that went through
+                        captcha_prefetcher.refill(more=resp is None or resp.status_code != 200)
+            if error is not None:
+                # no response counts as a server error, for the backoff and the breaker
+                BOOKING_BREAKER.record_failure()
+                print(f"Booking got no response: {error}")
+                if BOOKING_BREAKER.is_open or not retry.wait(f"booking got {type(error).__name__}"):
+                    return NO_RESPONSE
+                continue
+            if resp.status_code >= 500:
+                BOOKING_BREAKER.record_failure()
+            else:
+                BOOKING_BREAKER.record_success()
             #            print(f"Booking Response Code: {resp.status_code}")
             #            print(f"Booking Response : {resp.text}")
             if resp.status_code == 401:
                 print("TOKEN INVALID")
                 return resp.status_code
             elif resp.status_code == 200:
-                beep(WARNING_BEEP_DURATION[0], WARNING_BEEP_DURATION[1])
+                notify("booked", f"Booked session {details['session_id']}, slot {details['slot']}",
+                       freq=WARNING_BEEP_DURATION[0], duration=WARNING_BEEP_DURATION[1])
                 print(
                     "##############       BOOKED!                ############################        BOOKED!      ################")
                 print(
                     "                                        Hey, Hey, Hey! It's your lucky day!                                  ")
-                booked_appointment_id = resp.text
-                booked_appointment_id = (booked_appointment_id[32:68])
+                booked_appointment_id = confirmation_number(resp)
                 print(booked_appointment_id)
-                response = requests.get(DOWNLOAD_APPOINTMENT.format(booked_appointment_id), headers=request_header)
-                if response.status_code == 200:
-                    filename = "appointment_slip" + booked_appointment_id
-                    with open(filename, 'wb') as f:
-                        f.write(response.content)
+                download_appointment_slip(request_header, booked_appointment_id)
                 return 1000
             elif resp.status_code == 409:
                 # This vaccination center is completely booked for the selected date.
@@ -91,15 +173,16 @@ def book_appointment(request_header, details, mobile, generate_captcha_pref, api
                 print(f"Response: {resp.status_code} : {resp.text}")
                 return resp.status_code
             elif resp.status_code >= 500:
-                # Internal server error
+                # Internal server error, retried with backoff unless the API keeps failing
                 print(f"Response: {resp.status_code} : {resp.text}")
-                pass
+                if BOOKING_BREAKER.is_open or not retry.wait(f"booking got {resp.status_code}"):
+                    return resp.status_code
             else:
                 print(f"Response: {resp.status_code} : {resp.text}")
                 return True
     except Exception as e:
         print(str(e))
-        beep(WARNING_BEEP_DURATION[0], WARNING_BEEP_DURATION[1])
+        notify("error", str(e), freq=WARNING_BEEP_DURATION[0], duration=WARNING_BEEP_DURATION[1])
 
 
 def check_and_book(request_header, beneficiary_dtls, location_dtls, search_option, **kwargs):
@@ -112,6 +195,8 @@ def check_and_book(request_header, beneficiary_dtls, location_dtls, search_optio
         5. Returns True or False depending on Token Validity
     """
     slots_available = False
+    # background poller of pipelined mode, stopped however this function returns
+    live = None
     try:
         min_age_booking = get_min_age(beneficiary_dtls)
         minimum_slots = kwargs["min_slots"]
@@ -125,48 +210,70 @@ def check_and_book(request_header, beneficiary_dtls, location_dtls, search_optio
         captcha_api_choice = kwargs['captcha_api_choice']
         captcha_automation_api_key = kwargs['captcha_automation_api_key']
         dose_num = kwargs['dose_num']
-        excluded_pincodes = kwargs['excluded_pincodes'],
+        excluded_pincodes = kwargs['excluded_pincodes']
         reschedule_inp = kwargs['reschedule_inp']
-
-        if isinstance(start_date, int) and start_date == 2:
-            start_date = (datetime.datetime.today() + datetime.timedelta(days=1)).strftime("%d-%m-%Y")
-        elif isinstance(start_date, int) and start_date == 1:
-            start_date = datetime.datetime.today().strftime("%d-%m-%Y")
-        else:
-            pass
-
-        if search_option == 2:
-            options = check_calendar_by_district(request_header, vaccine_type, location_dtls, start_date, minimum_slots,
-                                                 min_age_booking, fee_type, dose_num, excluded_pincodes)
-        else:
-            options = check_calendar_by_pincode(request_header, vaccine_type, location_dtls, start_date, minimum_slots,
-                                                min_age_booking, fee_type, dose_num)
+        # state of the previous cycle, only the sessions that changed since then are shown and attempted
+        snapshot = kwargs.get('calendar_snapshot')
+        # when a PollScheduler is given the caller waits for the next poll, not this function
+        poll_scheduler = kwargs.get('poll_scheduler')
+        captcha_prefetcher = kwargs.get('captcha_prefetcher')
+        # calendar responses shared with other profiles polling the same locations
+        calendar_feed = kwargs.get('calendar_feed')
+        # BookingCoordinator of the loops booking for other beneficiaries at the same time
+        booking_coordinator = kwargs.get('booking_coordinator')
+        booking_lock = booking_coordinator.booking_lock if booking_coordinator is not None else None
+        # SlotRanker that orders the sessions and picks the slots to attempt
+        slot_ranker = kwargs.get('slot_ranker') or SlotRanker()
+        # number of consecutive 7 day windows queried per location, from start_date on
+        date_windows = kwargs.get('date_windows', 1)
+        # keep polling the calendar while booking, and attempt the sessions of the latest poll
+        pipelined = kwargs.get('pipelined', False)
+
+        start_date = search_start_date(start_date)
+
+        def fetch_options(calendar_snapshot):
+            if search_option == 2:
+                return check_calendar_by_district(request_header, vaccine_type, location_dtls, start_date,
+                                                  minimum_slots, min_age_booking, fee_type, dose_num,
+                                                  excluded_pincodes, calendar_snapshot, calendar_feed, date_windows)
+            return check_calendar_by_pincode(request_header, vaccine_type, location_dtls, start_date, minimum_slots,
+                                             min_age_booking, fee_type, dose_num, calendar_snapshot, calendar_feed,
+                                             date_windows)
+
+        options = fetch_options(snapshot)
 
         if isinstance(options, bool):
             return False
-
-        options = sorted(options,
-                         key=lambda k: (k["district"].lower(),
-                                        k["pincode"],
-                                        k["name"].lower(),
-                                        datetime.datetime.strptime(k["date"], "%d-%m-%Y"),
-                                        ),
-                         )
+        # the calendars could not be fetched at all this cycle
+        if options is None:
+            options = []
+
+        metrics.OPTIONS_PER_CYCLE.observe(len(options))
+        metrics.SIGHTINGS.seen(option.session_id for option in options)
+        if poll_scheduler is not None:
+            poll_scheduler.record_availability(len(options) > 0)
+
+        polled_options = options
+        if snapshot is not None:
+            delta = snapshot.update(options)
+            if delta:
+                print(f"Since last update: {len(delta.opened)} sessions opened, {len(delta.increased)} with more "
+                      f"capacity, {len(delta.closed)} gone")
+            alert_locations(location_dtls, delta.changed, search_option)
+            # a manual choice is made from the full table, auto booking only attempts what changed
+            if auto_book != 'n':
+                options = delta.changed
+
+        # captchas are prefetched only while there are slots to attempt
+        if captcha_prefetcher is not None:
+            captcha_prefetcher.set_active(len(options) > 0)
 
         if len(options) > 0:
             slots_available = True
-            options = sorted(options, key=lambda k: (k["available"], k["date"]), reverse=True)
+            options = slot_ranker.rank(options)
             print(
                 "\n=======================================               Available slots found                =======================================")
-
-            tmp_options = copy.deepcopy(options)
-            if len(tmp_options) > 0:
-                cleaned_options_for_display = []
-                for item in tmp_options:
-                    item.pop("session_id", None)
-                    item.pop("center_id", None)
-                    cleaned_options_for_display.append(item)
-                display_table(cleaned_options_for_display)
+            display_options(options)
 
             if auto_book == 'n':
                 try:
@@ -182,31 +289,33 @@ def check_and_book(request_header, beneficiary_dtls, location_dtls, search_optio
                 if reschedule_inp == "r" or reschedule_inp == "R":
                     new_req = {
                         'appointment_id': [beneficiary['appointment_id'] for beneficiary in beneficiary_dtls],
-                        'center_id': options[choice[0] - 1]['center_id'],
-                        'session_id': options[choice[0] - 1]['session_id'],
-                        'slot': options[choice[0] - 1]['slots'][choice[1] - 1],
+                        'center_id': options[choice[0] - 1].center_id,
+                        'session_id': options[choice[0] - 1].session_id,
+                        'slot': options[choice[0] - 1].slots[choice[1] - 1],
                     }
                     print(f"Booking with info: {new_req}")
                     return reschedule_appointment(request_header, new_req, mobile, captcha_automation,
-                                                  captcha_automation_api_key, captcha_api_choice)
+                                                  captcha_automation_api_key, captcha_api_choice,
+                                                  captcha_prefetcher)
                 else:
                     new_req = {
                         'beneficiaries': [beneficiary['bref_id'] for beneficiary in beneficiary_dtls],
                         'dose': dose_num,
-                        'center_id': options[choice[0] - 1]['center_id'],
-                        'session_id': options[choice[0] - 1]['session_id'],
-                        'slot': options[choice[0] - 1]['slots'][choice[1] - 1]
+                        'center_id': options[choice[0] - 1].center_id,
+                        'session_id': options[choice[0] - 1].session_id,
+                        'slot': options[choice[0] - 1].slots[choice[1] - 1]
                     }
                     print(f"Booking with info: {new_req}")
                     booking_status = book_appointment(request_header, new_req, mobile, captcha_automation,
-                                                      captcha_automation_api_key, captcha_api_choice)
+                                                      captcha_automation_api_key, captcha_api_choice,
+                                                      captcha_prefetcher)
                 if booking_status == 1000:
                     return "break"
                 else:
                     return True
-        else:
+        elif poll_scheduler is None:
             for i in range(refresh_freq, 0, -1):
-                msg = f"No viable options. Next update in {i} seconds.."
+                msg = f"No {'new ' if snapshot is not None else ''}viable options. Next update in {i} seconds.."
                 print(msg, end="\r", flush=True)
                 sys.stdout.flush()
                 time.sleep(1)
@@ -219,69 +328,117 @@ def check_and_book(request_header, beneficiary_dtls, location_dtls, search_optio
         if not slots_available:
             return True
         else:
-            # sort by date and maximum available slots
+            if pipelined:
+                live = LiveCalendar(fetch_options, polled_options, options,
+                                    lambda: live_poll_interval(poll_scheduler, refresh_freq,
+                                                               len(location_dtls) * date_windows)).start()
             start_epoch = int(time.time())
             # if captcha automation is enabled then spend maximum 30 seconds before requesting new availability status from CoWIN. here, max time for both captcha auto and manual is same
             MAX_ALLOWED_DURATION_OF_STALE_INFORMATION_IN_SECS = 1 * 30 if captcha_automation != 'n' else 1 * 60
-            # Try all available centers one by one
-            for i in range(0, len(options)):
-                option = options[i]
-                #                all_slots_of_a_center = option.get("slots", [])
-                #   randomly choosing 2/3 slots of a center instead of trying all slots one by one to minimise API hit if center is full
-                all_slots_of_a_center = (random.sample(option["slots"], 2)) if ((len(option['slots'])) <= 4) else (random.sample(option["slots"], 3))
-                if not all_slots_of_a_center:
+            # sessions whose seats are being booked by another loop
+            skipped_sessions = set()
+            # Try the ranked (session, slot) attempts one by one, in pipelined mode ranked again on every poll
+            if live is not None:
+                attempts = live.attempts(slot_ranker, skipped_sessions)
+            else:
+                attempts = slot_ranker.attempts(options)
+            for attempt in attempts:
+                i, option, selected_slot = attempt
+                if option.session_id in skipped_sessions:
                     continue
-                # Try all slots of a center one by one
-                for selected_slot in all_slots_of_a_center:
-                    current_epoch = int(time.time())
-                    if current_epoch - start_epoch >= MAX_ALLOWED_DURATION_OF_STALE_INFORMATION_IN_SECS:
-                        print(
-                            "\n\n########################            Tried too many times but still not able to book, getting new availability status from CoWIN                #####################\n\n")
-                        return True
+                current_epoch = int(time.time())
+                # the options of a live calendar are never older than the last poll
+                if live is None and current_epoch - start_epoch >= MAX_ALLOWED_DURATION_OF_STALE_INFORMATION_IN_SECS:
+                    print(
+                        "\n\n########################            Tried too many times but still not able to book, getting new availability status from CoWIN                #####################\n\n")
+                    if snapshot is not None:
+                        for remaining_option in options[i:]:
+                            snapshot.forget(remaining_option.session_id)
+                    return True
+                if not BOOKING_BREAKER.allow():
+                    print(f"\n============> Booking paused for {BOOKING_BREAKER.retry_after():.0f} more seconds, "
+                          f"CoWIN is failing")
+                    if snapshot is not None:
+                        for remaining_option in (live.current() if live is not None else options[i:]):
+                            snapshot.forget(remaining_option.session_id)
+                    return True
 
-                    try:
-                        center_id = option["center_id"]
-                        print(
-                            f"\n============> Trying Choice # {i + 1}  Center Name # {option['name']} , Center # {center_id}, Slot #{selected_slot}")
-
-                        if reschedule_inp == "r" or reschedule_inp == "R":
-                            new_req = {
-                                "appointment_id": beneficiary_dtls[0]['appointment_id'],
-                                "center_id": option["center_id"],
-                                "session_id": option["session_id"],
-                                "slot": selected_slot,
-                            }
-                            print(f"Booking with info: {new_req}")
-                            booking_status = reschedule_appointment(request_header, new_req, mobile, captcha_automation,
-                                                                    captcha_automation_api_key, captcha_api_choice)
-                        else:
-                            new_req = {
-                                "beneficiaries": [beneficiary["bref_id"] for beneficiary in beneficiary_dtls],
-                                "dose": dose_num,
-                                "center_id": option["center_id"],
-                                "session_id": option["session_id"],
-                                "slot": selected_slot,
-                            }
-                            print(f"Booking with info: {new_req}")
-                            booking_status = book_appointment(request_header, new_req, mobile, captcha_automation,
-                                                              captcha_automation_api_key, captcha_api_choice)
-                        if booking_status == 1000:
-                            return "break"
-                        # token invalid. returning 401 response code
-                        elif booking_status == 401:
-                            return True
-                        # bad request or captcha error
-                        elif booking_status == 400:
-                            pass
-                        # selected slot of the center is fully booked
-                        else:
-                            pass
-                    except IndexError:
-                        print("============> Invalid Option!")
-                        os.system("pause")
+                try:
+                    center_id = option.center_id
+                    print(
+                        f"\n============> Trying Choice # {i + 1}  Center Name # {option.name} , Center # {center_id}, Slot #{selected_slot}")
+
+                    if reschedule_inp == "r" or reschedule_inp == "R":
+                        kind = "reschedule"
+                        new_req = {
+                            "appointment_id": beneficiary_dtls[0]['appointment_id'],
+                            "center_id": option.center_id,
+                            "session_id": option.session_id,
+                            "slot": selected_slot,
+                        }
+                        book = lambda: reschedule_appointment(request_header, new_req, mobile, captcha_automation,
+                                                              captcha_automation_api_key, captcha_api_choice,
+                                                              captcha_prefetcher, booking_lock)
+                    else:
+                        kind = "book"
+                        new_req = {
+                            "beneficiaries": [beneficiary["bref_id"] for beneficiary in beneficiary_dtls],
+                            "dose": dose_num,
+                            "center_id": option.center_id,
+                            "session_id": option.session_id,
+                            "slot": selected_slot,
+                        }
+                        book = lambda: book_appointment(request_header, new_req, mobile, captcha_automation,
+                                                        captcha_automation_api_key, captcha_api_choice,
+                                                        captcha_prefetcher, booking_lock)
+                    print(f"Booking with info: {new_req}")
+                    since_sighting = metrics.SIGHTINGS.since_first_seen(option.session_id)
+                    if since_sighting is not None:
+                        metrics.SIGHTING_TO_ATTEMPT_SECONDS.observe(since_sighting)
+                    if booking_coordinator is None:
+                        booking_status = timed_booking(kind, book)
+                    else:
+                        booking_status = booking_coordinator.attempt(option.session_id, option.available,
+                                                                     lambda: timed_booking(kind, book))
+                        if booking_status == CLAIM_REFUSED:
+                            # the seats seen are being booked by another loop, look at the session again later
+                            print("============> Slots of this session are taken by another beneficiary, skipping")
+                            skipped_sessions.add(option.session_id)
+                            if snapshot is not None:
+                                snapshot.forget(option.session_id)
+                            continue
+                    slot_ranker.record(option, booking_status)
+                    if booking_status == 1000:
+                        return "break"
+                    # token invalid. returning 401 response code
+                    elif booking_status == 401:
+                        if snapshot is not None:
+                            snapshot.forget(option.session_id)
+                        return True
+                    # selected slot of the center is fully booked
+                    elif booking_status == 409:
                         pass
+                    # bad request or captcha error, attempt the session again in the next cycle
+                    elif snapshot is not None:
+                        snapshot.forget(option.session_id)
+                except IndexError:
+                    print("============> Invalid Option!")
+                    pause()
+                    pass
             # tried all slots of all centers but still not able to book then look for current status of centers
+            if live is not None and live.token_invalid:
+                return False
             return True
+    finally:
+        if live is not None:
+            live.stop()
+
+
+def live_poll_interval(poll_scheduler, refresh_freq, calls_per_cycle):
+    # the poll scheduler keeps the background polls within the rate budget, as it does the polls between cycles
+    if poll_scheduler is None:
+        return refresh_freq
+    return max(MIN_LIVE_POLL_SECS, poll_scheduler.next_delay(calls_per_cycle))
 
 
 # --------------get all pincodes to filter centers by excluded pincode ---------------#
@@ -293,7 +450,7 @@ def get_all_pincodes(request_header, district_id, start_date, min_age):
     DIST_ID = district_id
     URL = \
         CALENDAR_URL_DISTRICT.format(DIST_ID, INP_DATE)
-    response = requests.get(URL, headers=request_header)
+    response = transport.get(URL, headers=request_header)
     if response.status_code == 200:
         pincode_list = response.json()
         if "centers" in pincode_list:
@@ -338,7 +495,7 @@ def get_districts(request_header):
         2. Lists all districts in that state, prompts to select required ones, and
         3. Returns the list of districts as list(dict)
     """
-    states = requests.get("https://cdn-api.co-vin.in/api/v2/admin/location/states", headers=request_header)
+    states = transport.get("https://cdn-api.co-vin.in/api/v2/admin/location/states", headers=request_header)
 
     if states.status_code == 200:
         states = states.json()["states"]
@@ -352,7 +509,7 @@ def get_districts(request_header):
         state = int(input("\nEnter State index: "))
         state_id = states[state - 1]["state_id"]
 
-        districts = requests.get(f"https://cdn-api.co-vin.in/api/v2/admin/location/districts/{state_id}",
+        districts = transport.get(f"https://cdn-api.co-vin.in/api/v2/admin/location/districts/{state_id}",
                                  headers=request_header)
 
         if districts.status_code == 200:
@@ -382,18 +539,18 @@ def get_districts(request_header):
             print("Unable to fetch districts")
             print(districts.status_code)
             print(districts.text)
-            os.system("pause")
+            pause()
             sys.exit(1)
     else:
         print("Unable to fetch states")
         print(states.status_code)
         print(states.text)
-        os.system("pause")
+        pause()
         sys.exit(1)
 
 
 def fetch_beneficiaries(request_header):
-    return requests.get(BENEFICIARIES_URL, headers=request_header)
+    return transport.get(BENEFICIARIES_URL, headers=request_header)
 
 
 def get_required_beneficiaries(request_header, beneficiaries):
@@ -404,29 +561,7 @@ def get_required_beneficiaries(request_header, beneficiaries):
         3. Returns the list of beneficiaries as list(dict)
     """
 
-    refined_beneficiaries = []
-
-    for beneficiary in beneficiaries:
-        beneficiary["age"] = datetime.datetime.today().year - int(beneficiary["birth_year"])
-
-        if beneficiary["vaccination_status"] == "Partially Vaccinated" and len(beneficiary["dose2_date"]) == 0:
-            dose2_date_calculated = vaccine_dose2_duedate(beneficiary["vaccine"], beneficiary["dose1_date"])
-            beneficiary["dose2_date"] = dose2_date_calculated
-
-        tmp = {
-            "bref_id": beneficiary["beneficiary_reference_id"],
-            "name": beneficiary["name"],
-            "vaccine": beneficiary["vaccine"],
-            "age": beneficiary["age"],
-            "status": beneficiary["vaccination_status"],
-            "birth_year": beneficiary["birth_year"],
-            "mobile_number": beneficiary["mobile_number"],
-            "photo_id_type": beneficiary["photo_id_type"],
-            "photo_id_number": beneficiary["photo_id_number"],
-            "dose1_date": beneficiary["dose1_date"],
-            "dose2_date": beneficiary["dose2_date"],
-        }
-        refined_beneficiaries.append(tmp)
+    refined_beneficiaries = [refine_beneficiary(beneficiary) for beneficiary in beneficiaries]
 
     display_table(refined_beneficiaries)
     print(
@@ -446,15 +581,7 @@ def get_required_beneficiaries(request_header, beneficiaries):
     reqd_beneficiaries = input("\nEnter comma separated index numbers of beneficiaries to book for : ")
     beneficiary_idx = [int(idx) - 1 for idx in reqd_beneficiaries.split(",")]
     reqd_beneficiaries = [
-        {
-            "bref_id": item["bref_id"],
-            "name": item["name"],
-            "vaccine": item["vaccine"],
-            "age": item["age"],
-            "status": item["status"],
-            "dose1_date": item["dose1_date"],
-            "dose2_date": item["dose2_date"],
-        }
+        required_beneficiary(item)
         for idx, item in enumerate(refined_beneficiaries)
         if idx in beneficiary_idx
     ]
@@ -463,15 +590,55 @@ def get_required_beneficiaries(request_header, beneficiaries):
     return reqd_beneficiaries
 
 
-def clear_bucket_and_send_OTP(storage_url, mobile, request_header):
-    print("clearing OTP bucket: " + storage_url)
-    response = requests.put(storage_url, data={})
+def refine_beneficiary(beneficiary):
+    """
+    This function
+        1. Adds the age, and the dose2 due date when CoWIN has none, to a beneficiary as fetched, and
+        2. Returns the fields shown to the user
+    """
+    beneficiary["age"] = datetime.datetime.today().year - int(beneficiary["birth_year"])
+
+    if beneficiary["vaccination_status"] == "Partially Vaccinated" and len(beneficiary["dose2_date"]) == 0:
+        dose2_date_calculated = vaccine_dose2_duedate(beneficiary["vaccine"], beneficiary["dose1_date"])
+        beneficiary["dose2_date"] = dose2_date_calculated
+
+    return {
+        "bref_id": beneficiary["beneficiary_reference_id"],
+        "name": beneficiary["name"],
+        "vaccine": beneficiary["vaccine"],
+        "age": beneficiary["age"],
+        "status": beneficiary["vaccination_status"],
+        "birth_year": beneficiary["birth_year"],
+        "mobile_number": beneficiary["mobile_number"],
+        "photo_id_type": beneficiary["photo_id_type"],
+        "photo_id_number": beneficiary["photo_id_number"],
+        "dose1_date": beneficiary["dose1_date"],
+        "dose2_date": beneficiary["dose2_date"],
+    }
+
+
+def required_beneficiary(item):
+    """
+    This function returns the fields of a refined beneficiary that are kept for booking
+    """
+    return {
+        "bref_id": item["bref_id"],
+        "name": item["name"],
+        "vaccine": item["vaccine"],
+        "age": item["age"],
+        "status": item["status"],
+        "dose1_date": item["dose1_date"],
+        "dose2_date": item["dose2_date"],
+    }
+
+
+def send_OTP(mobile, request_header):
     data = {
         "mobile": mobile,
         "secret": "U2FsdGVkX1+z/4Nr9nta+2DrVJSv7KS6VoQUSQ1ZXYDx/CJUkWxFYG6P3iM/VW+6jLQ9RDQVzp/RcZ8kbT41xw==",
     }
     print(f"Requesting OTP with mobile number {mobile}..")
-    txnId = requests.post(url=OTP_PRO_URL, json=data, headers=request_header)
+    txnId = transport.post(url=OTP_PRO_URL, json=data, headers=request_header)
     if txnId.status_code == 200:
         txnId = txnId.json()["txnId"]
     else:
@@ -483,13 +650,21 @@ def clear_bucket_and_send_OTP(storage_url, mobile, request_header):
 
 
 def check_calendar_by_district(request_header, vaccine_type, location_dtls, start_date,
-                               minimum_slots, min_age_booking, fee_type, dose_num, excluded_pincodes):
+                               minimum_slots, min_age_booking, fee_type, dose_num, excluded_pincodes, snapshot=None,
+                               calendar_feed=None, date_windows=1):
     """
     This function
         1. Takes details required to check vaccination calendar
         2. Filters result by minimum number of slots available
         3. Returns False if token is invalid
         4. Returns list of vaccination centers & slots if available
+
+    When a CalendarSnapshot is given, a district whose response did not change since the last cycle reuses the
+    options of that cycle, and alerting is left to the caller. When a CalendarFeed is given, the responses come
+    from it, and the vaccine is only filtered locally so that every profile shares the same urls.
+
+    With date_windows above 1, every district is also queried for the 7 day windows after the first one, all at the
+    same time, and a session returned for more than one window is kept once.
     """
 
     try:
@@ -498,75 +673,116 @@ def check_calendar_by_district(request_header, vaccine_type, location_dtls, star
         today = datetime.datetime.today()
         base_url = CALENDAR_URL_DISTRICT
 
-        if vaccine_type:
+        if vaccine_type and calendar_feed is None:
             base_url += f"&vaccine={vaccine_type}"
 
+        excluded = excluded_pincode_set(excluded_pincodes)
         options = []
-        for location in location_dtls:
-            resp = requests.get(base_url.format(location["district_id"], start_date), headers=request_header, )
+        fetch = fetch_calendars if calendar_feed is None else calendar_feed.fetch_calendars
+        windows = calendar_windows(start_date, date_windows)
+        started = time.perf_counter()
+        calendars = fetch(request_header, base_url, [location["district_id"] for location in location_dtls],
+                          windows)
+        metrics.POLL_SECONDS.observe(time.perf_counter() - started)
+        for (location, window_start), (resp, error) in zip(
+                [(location, window_start) for location in location_dtls for window_start in windows], calendars):
+            if error is not None:
+                print(f"Unable to fetch calendar for {location['district_name']}: {error}")
+                continue
 
             if resp.status_code == 401:
                 print("TOKEN INVALID")
                 return False
 
             elif resp.status_code == 200:
-                resp = resp.json()
+                content = resp.content
+                if snapshot is not None:
+                    cached_options = snapshot.location_options((location["district_id"], window_start), content)
+                    if cached_options is not None:
+                        options += cached_options
+                        continue
 
-                resp = filter_centers_by_age(resp, min_age_booking)
-                if len(excluded_pincodes) > 1:
-                    resp = filer_by_excluded_pincodes(resp, excluded_pincodes)
+                resp = resp.json()
+                location_options = []
 
                 if "centers" in resp:
                     print(
-                        f"Total Centers available in {location['district_name']} from {start_date} as of {today.strftime('%Y-%m-%d %H:%M:%S')}: {len(resp['centers'])}")
-                    options += viable_options(resp, minimum_slots, min_age_booking, fee_type, dose_num)
+                        f"Total Centers in {location['district_name']} from {window_start} as of {today.strftime('%Y-%m-%d %H:%M:%S')}: {len(resp['centers'])}")
+                    location_options = list(iter_viable_options(resp, min_age_booking, minimum_slots, fee_type,
+                                                                dose_num, vaccine_type, excluded))
+                    options += location_options
+                if snapshot is not None:
+                    snapshot.remember_location((location["district_id"], window_start), content, location_options)
             else:
-                pass
+                print(f"Response: {resp.status_code} for district : {location['district_name']}")
 
-        for location in location_dtls:
-            if location["district_name"] in [option["district"] for option in options]:
-                for _ in range(2):
-                    beep(location["alert_freq"], 150)
+        if len(windows) > 1:
+            options = unique_sessions(options)
+        if snapshot is None:
+            alert_locations(location_dtls, options, 2)
         return options
 
     except Exception as e:
         print(str(e))
-        beep(WARNING_BEEP_DURATION[0], WARNING_BEEP_DURATION[1])
+        notify("error", str(e), freq=WARNING_BEEP_DURATION[0], duration=WARNING_BEEP_DURATION[1])
+
+
+def alert_locations(location_dtls, options, search_option):
+    """
+    This function queues an alert, with the beep frequency of the location, for every location that has options
+    """
+    if search_option == 2:
+        found = set(option.district for option in options)
+        locations = [location for location in location_dtls if location["district_name"] in found]
+    else:
+        found = set(option.pincode for option in options)
+        locations = [location for location in location_dtls if int(location["pincode"]) in found]
+    for location in locations:
+        name = location["district_name"] if search_option == 2 else location["pincode"]
+        notify("slots", f"Slots available in {name}", key=("slots", name), freq=location["alert_freq"], duration=150,
+               repeat=2)
+
+
+def fetch_calendars(request_header, base_url, location_ids, start_dates):
+    """
+    This function
+        1. Queries the calendar of every location for every start date at the same time, at most
+           CALENDAR_FETCH_WORKERS in flight
+        2. Returns one (response, error) pair per location and start date, the start dates of the first location
+           first, in the same order as location_ids and start_dates
+    """
+
+    def fetch(url):
+        try:
+            return transport.get(url, headers=request_header), None
+        except Exception as e:
+            return None, e
+
+    urls = [base_url.format(location_id, start_date) for location_id in location_ids for start_date in start_dates]
+    if not urls:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(CALENDAR_FETCH_WORKERS, len(urls)))) as pool:
+        return list(pool.map(fetch, urls))
 
 
 def generate_token_OTP(mobile, request_header, otp_validation_header):
     """
     This function generate OTP and returns a new token or None when not able to get token
     """
-    storage_url = "https://kvdb.io/SK2XsE52VMgzwaZMKAK2pc/" + mobile
-    txnId = clear_bucket_and_send_OTP(storage_url, mobile, request_header)
+    otp_source = otp_sources.get_source(mobile)
+    otp_source.prepare()
+    requested_at = time.time()
+    txnId = send_OTP(mobile, request_header)
     if txnId is None:
         return txnId
-    time.sleep(10)
-    t_end = time.time() + 60 * 3  # try to read OTP for at most 3 minutes
-    while time.time() < t_end:
-        response = requests.get(storage_url)
-        if response.status_code == 200:
-            print("OTP SMS is:" + response.text)
-            print("OTP SMS len is:" + str(len(response.text)))
-            OTP = response.text
-            OTP = OTP.replace("Your OTP to register/access CoWIN is ", "")
-            OTP = OTP.replace(". It will be valid for 3 minutes. - CoWIN", "")
-            if not OTP:
-                time.sleep(5)
-                continue
-            break
-        else:
-            # Hope it won't throw 500 error a little later, wait for 5 sec and try again
-            print("error fetching OTP API:" + response.text)
-            time.sleep(5)
+    OTP = otp_sources.wait_for_otp(otp_source, requested_at)
 
     if not OTP:
         return None
     print("Parsed OTP:" + OTP)
     data = {"otp": sha256(str(OTP.strip()).encode("utf-8")).hexdigest(), "txnId": txnId}
     print(f"Validating OTP..")
-    token = requests.post(url=OTP_VALIDATE_URL, json=data, headers=otp_validation_header)
+    token = transport.post(url=OTP_VALIDATE_URL, json=data, headers=otp_validation_header)
     if token.status_code == 200:
         token = token.json()["token"]
     else:
@@ -579,13 +795,16 @@ def generate_token_OTP(mobile, request_header, otp_validation_header):
 
 
 def check_calendar_by_pincode(request_header, vaccine_type, location_dtls, start_date,
-                              minimum_slots, min_age_booking, fee_type, dose_num):
+                              minimum_slots, min_age_booking, fee_type, dose_num, snapshot=None,
+                              calendar_feed=None, date_windows=1):
     """
     This function
         1. Takes details required to check vaccination calendar
         2. Filters result by minimum number of slots available
         3. Returns False if token is invalid
         4. Returns list of vaccination centers & slots if available
+
+    A CalendarSnapshot, a CalendarFeed and date_windows are used the same way as in check_calendar_by_district.
     """
     try:
         print(
@@ -593,37 +812,56 @@ def check_calendar_by_pincode(request_header, vaccine_type, location_dtls, start
         today = datetime.datetime.today()
         base_url = CALENDAR_URL_PINCODE
 
-        if vaccine_type:
+        if vaccine_type and calendar_feed is None:
             base_url += f"&vaccine={vaccine_type}"
 
         options = []
-        for location in location_dtls:
-            resp = requests.get(base_url.format(location["pincode"], start_date), headers=request_header)
+        fetch = fetch_calendars if calendar_feed is None else calendar_feed.fetch_calendars
+        windows = calendar_windows(start_date, date_windows)
+        started = time.perf_counter()
+        calendars = fetch(request_header, base_url, [location["pincode"] for location in location_dtls], windows)
+        metrics.POLL_SECONDS.observe(time.perf_counter() - started)
+        for (location, window_start), (resp, error) in zip(
+                [(location, window_start) for location in location_dtls for window_start in windows], calendars):
+            if error is not None:
+                print(f"Unable to fetch calendar for pincode {location['pincode']}: {error}")
+                continue
 
             if resp.status_code == 401:
                 print("TOKEN INVALID")
                 return False
 
             elif resp.status_code == 200:
+                content = resp.content
+                if snapshot is not None:
+                    cached_options = snapshot.location_options((location["pincode"], window_start), content)
+                    if cached_options is not None:
+                        options += cached_options
+                        continue
+
                 resp = resp.json()
-                resp = filter_centers_by_age(resp, min_age_booking)
+                location_options = []
                 if "centers" in resp:
                     print(
-                        f"Centers available in {location['pincode']} from {start_date} as of {today.strftime('%Y-%m-%d %H:%M:%S')}: {len(resp['centers'])}")
-                    options += viable_options(resp, minimum_slots, min_age_booking, fee_type, dose_num)
+                        f"Centers in {location['pincode']} from {window_start} as of {today.strftime('%Y-%m-%d %H:%M:%S')}: {len(resp['centers'])}")
+                    location_options = list(iter_viable_options(resp, min_age_booking, minimum_slots, fee_type,
+                                                                dose_num, vaccine_type))
+                    options += location_options
+                if snapshot is not None:
+                    snapshot.remember_location((location["pincode"], window_start), content, location_options)
             else:
                 print(f"\nno centers in response for pincode : {location['pincode']}")
                 pass
 
-        for location in location_dtls:
-            if int(location["pincode"]) in [option["pincode"] for option in options]:
-                for _ in range(2):
-                    beep(location["alert_freq"], 150)
+        if len(windows) > 1:
+            options = unique_sessions(options)
+        if snapshot is None:
+            alert_locations(location_dtls, options, 1)
         return options
 
     except Exception as e:
         print(str(e))
-        beep(WARNING_BEEP_DURATION[0], WARNING_BEEP_DURATION[1])
+        notify("error", str(e), freq=WARNING_BEEP_DURATION[0], duration=WARNING_BEEP_DURATION[1])
 
 
 def generate_token_OTP_manual(mobile, request_header, otp_validation_header):
@@ -633,7 +871,7 @@ def generate_token_OTP_manual(mobile, request_header, otp_validation_header):
 
     if not mobile:
         print("Mobile number cannot be empty")
-        os.system('pause')
+        pause()
         sys.exit()
 
     valid_token = False
@@ -641,7 +879,7 @@ def generate_token_OTP_manual(mobile, request_header, otp_validation_header):
         try:
             data = {"mobile": mobile,
                     "secret": "U2FsdGVkX1+z/4Nr9nta+2DrVJSv7KS6VoQUSQ1ZXYDx/CJUkWxFYG6P3iM/VW+6jLQ9RDQVzp/RcZ8kbT41xw=="}
-            txnId = requests.post(url=OTP_PRO_URL, json=data, headers=request_header)
+            txnId = transport.post(url=OTP_PRO_URL, json=data, headers=request_header)
 
             if txnId.status_code == 200:
                 print(f"Successfully requested OTP for mobile number {mobile} at {datetime.datetime.today()}..")
@@ -651,7 +889,7 @@ def generate_token_OTP_manual(mobile, request_header, otp_validation_header):
                 if OTP:
                     data = {"otp": sha256(str(OTP).encode('utf-8')).hexdigest(), "txnId": txnId}
                     print(f"Validating OTP..")
-                    token = requests.post(url=OTP_VALIDATE_URL, json=data, headers=otp_validation_header)
+                    token = transport.post(url=OTP_VALIDATE_URL, json=data, headers=otp_validation_header)
                     if token.status_code == 200:
                         token = token.json()['token']
                         print(f'Token Generated: {token}')
@@ -690,12 +928,12 @@ def collect_user_details(request_header):
         print("Unable to fetch beneficiaries")
         print(beneficiaries.status_code)
         print(beneficiaries.text)
-        os.system("pause")
+        pause()
         sys.exit(1)
 
     if len(beneficiary_dtls) == 0:
         print("There should be at least one beneficiary. Exiting.")
-        os.system("pause")
+        pause()
         sys.exit(1)
     active_appointment = check_active_appointment(beneficiary_dtls, beneficiaries)
     if len(active_appointment) > 0:
@@ -742,7 +980,7 @@ def collect_user_details(request_header):
             else:
                 print(
                     "\n=======================================       No eligible beneficiary selected for booking.. exiting script..          ======================================\n")
-                os.system("pause")
+                pause()
                 sys.exit(1)
     else:
         reschedule_inp = None
@@ -753,7 +991,7 @@ def collect_user_details(request_header):
 
     if len(vaccines.keys()) != 1:
         print(f"All beneficiaries in one attempt should have the same vaccine type. Found {len(vaccines.keys())}")
-        os.system("pause")
+        pause()
         sys.exit(1)
     vaccine_type = vaccine_types[0]
     if not vaccine_type:
@@ -789,6 +1027,11 @@ def collect_user_details(request_header):
             print('\nInvalid Date! Proceeding with tomorrow.')
             search_dose2_date = (datetime.datetime.today() + datetime.timedelta(days=1)).strftime("%d-%m-%Y")
 
+    date_windows = input(
+        f"\nHow many weeks from the start date should be searched? Every week is one more call per location "
+        f"(max {MAX_DATE_WINDOWS}). Default 1: ")
+    date_windows = int(date_windows) if date_windows.isdigit() and 1 <= int(date_windows) <= MAX_DATE_WINDOWS else 1
+
     if all([beneficiary['status'] == 'Partially Vaccinated' for beneficiary in beneficiary_dtls]):
         max_start_date = (datetime.datetime.today() + datetime.timedelta(days=5)).strftime("%d-%m-%Y")
         # enabling multiple beneficiaries to book for dose 2 if dose2 dates are in past for all ############
@@ -801,7 +1044,7 @@ def collect_user_details(request_header):
                     f"#############################      Please select a start date in between {beneficiary['dose2_date']} and {max_start_date}          ###############################")
                 print(
                     "\n ============================================      exiting script due to invalid start date       ======================================\n")
-                os.system("pause")
+                pause()
                 sys.exit(1)
 
     print("\n=================================        Location Info        =================================\n")
@@ -894,6 +1137,7 @@ def collect_user_details(request_header):
         "refresh_freq": refresh_freq,
         "auto_book": auto_book,
         "start_date": start_date,
+        "date_windows": date_windows,
         "vaccine_type": vaccine_type,
         "fee_type": fee_type,
         'captcha_automation': captcha_automation,
@@ -963,6 +1207,14 @@ def display_table(dict_list):
     print(tabulate.tabulate(rows, header, tablefmt="grid"))
 
 
+def display_options(options):
+    """
+    This function displays vaccination options in tabular format, without the ids used for booking
+    """
+    header, rows = display_rows(options)
+    print(tabulate.tabulate(rows, header, tablefmt="grid"))
+
+
 def display_info_dict(details):
     for key, value in details.items():
         if isinstance(value, list):
@@ -982,12 +1234,12 @@ def filter_centers_by_age(resp, min_age_booking):
         center_age_filter = 18
 
     if "centers" in resp:
-        for center in list(resp["centers"]):
-            for session in list(center["sessions"]):
-                if session['min_age_limit'] != center_age_filter:
-                    center["sessions"].remove(session)
-                    if len(center["sessions"]) == 0:
-                        resp["centers"].remove(center)
+        centers = []
+        for center in resp["centers"]:
+            sessions = [session for session in center["sessions"] if session['min_age_limit'] == center_age_filter]
+            if sessions:
+                centers.append({**center, "sessions": sessions})
+        resp = {**resp, "centers": centers}
     return resp
 
 
@@ -1004,15 +1256,35 @@ def get_min_age(beneficiary_dtls):
 
 def generate_captcha(request_header, captcha_automation, api_key, captcha_api_choice):
     print("================================= GETTING CAPTCHA ==================================================")
-    resp = requests.post(CAPTCHA_URL, headers=request_header)
+    resp = transport.post(CAPTCHA_URL, headers=request_header)
     print(f'Captcha Response Code: {resp.status_code}')
 
+    started = time.time()
     if resp.status_code == 200 and captcha_automation == "n":
-        return captcha_builder_manual(resp.json())
+        captcha = captcha_builder_manual(resp.json())
+        backend = "manual"
     elif resp.status_code == 200 and captcha_automation == "api":
-        return captcha_builder_api(resp.json(), api_key, captcha_api_choice)
+        captcha = captcha_builder_api(resp.json(), api_key, captcha_api_choice)
+        backend = "2captcha" if captcha_api_choice == "1" else "anti-captcha"
     elif resp.status_code == 200 and captcha_automation == "ai":
-        return captcha_builder_auto(resp.json())
+        captcha = captcha_builder_auto(resp.json())
+        backend = "ai"
+    else:
+        return None
+    metrics.CAPTCHA_SOLVE_SECONDS.observe(time.time() - started, backend)
+    return captcha
+
+
+def get_captcha(request_header, captcha_automation, api_key, captcha_api_choice, captcha_prefetcher=None):
+    """
+    This function returns the prefetched captcha when one is ready, else fetches and solves one now
+    """
+    if captcha_prefetcher is not None:
+        captcha = captcha_prefetcher.take()
+        if captcha is not None:
+            print("================================= USING PREFETCHED CAPTCHA =========================================")
+            return captcha
+    return generate_captcha(request_header, captcha_automation, api_key, captcha_api_choice)
 
 
 def filer_by_excluded_pincodes(resp, excluded_pincodes):
@@ -1110,7 +1382,7 @@ def confirm_and_proceed(collected_details):
     confirm = confirm if confirm else "y"
     if confirm.lower() != "y":
         print("Details not confirmed. Exiting process.")
-        os.system("pause")
+        pause()
         sys.exit()
 
 
@@ -1132,27 +1404,34 @@ def collect_reschedule_appointment_data(active_appointment_detailed):
     if reschedule_input:
         reschedule_idx = [int(idx) - 1 for idx in reschedule_input.split(",")]
         data = [
-            {"bref_id": item["bref_id"],
-             "name": item["beneficiary"],
-             "age": item["age"],
-             "center_name": item["center_name"],
-             "slot": item["slot"],
-             "appointment_id": item["appointment_id"],
-             "status": item["status"],
-             "vaccine": item["vaccine"],
-             "dose1_date": item["dose1_date"],
-             "dose2_date": item["dose2_date"],
-             }
+            reschedule_beneficiary(item)
             for idx, item in enumerate(list(active_appointment_detailed))
             if idx in reschedule_idx
         ]
         return data
     else:
         print("\n===========================      wrong input.. exiting....       ===============================")
-        os.system('pause')
+        pause()
         sys.exit()
 
 
+def reschedule_beneficiary(item):
+    """
+    This function returns the fields of an active appointment that are kept to reschedule it
+    """
+    return {"bref_id": item["bref_id"],
+            "name": item["beneficiary"],
+            "age": item["age"],
+            "center_name": item["center_name"],
+            "slot": item["slot"],
+            "appointment_id": item["appointment_id"],
+            "status": item["status"],
+            "vaccine": item["vaccine"],
+            "dose1_date": item["dose1_date"],
+            "dose2_date": item["dose2_date"],
+            }
+
+
 def check_active_appointment(reqired_beneficiaries, beneficiaries):
     active_appointments_list = []
     beneficiary_ref_ids = [beneficiary["bref_id"]
@@ -1197,18 +1476,76 @@ def check_active_appointment(reqired_beneficiaries, beneficiaries):
     return active_appointments_list
 
 
+def confirmation_number(resp):
+    """
+    This function returns the appointment id of a booking response, None when it has none
+    """
+    try:
+        return resp.json()["appointment_confirmation_no"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def download_appointment_slip(request_header, appointment_id):
+    """
+    This function saves the appointment slip to appointment_slip<appointment id>, when the id is known
+    """
+    if not isinstance(appointment_id, str):
+        print("unable to download appointment slip, the appointment id is not known")
+        return
+    response = transport.get(DOWNLOAD_APPOINTMENT.format(appointment_id), headers=request_header)
+    if response.status_code == 200:
+        with open("appointment_slip" + appointment_id, 'wb') as f:
+            f.write(response.content)
+    else:
+        print("unable to download appointment slip")
+        print(f"Response: {response.status_code} : {response.text}")
+
+
+def timed_booking(kind, book):
+    """
+    This function calls book() and records how long the attempt took, by kind and booking status
+    """
+    started = time.time()
+    booking_status = book()
+    metrics.BOOKING_ATTEMPT_SECONDS.observe(time.time() - started, kind, booking_status)
+    return booking_status
+
+
 def reschedule_appointment(request_header, details, mobile, generate_captcha_pref, api_key=None,
-                           captcha_api_choice=None):
+                           captcha_api_choice=None, captcha_prefetcher=None, booking_lock=None):
     try:
         valid_captcha = True
+        retry = POLICIES["reschedule"].start()
         while valid_captcha:
-            captcha = generate_captcha(request_header, generate_captcha_pref, api_key, captcha_api_choice)
-            details["captcha"] = captcha
-
-            print(
-                "================================= ATTEMPTING BOOKING ==================================================")
+            resp = None
+            error = None
+            with booking_lock or nullcontext():
+                try:
+                    captcha = get_captcha(request_header, generate_captcha_pref, api_key, captcha_api_choice,
+                                          captcha_prefetcher)
+                    details["captcha"] = captcha
 
-            resp = requests.post(RESCHEDULE_URL, headers=request_header, json=details)
+                    print(
+                        "================================= ATTEMPTING BOOKING ==================================================")
+
+                    resp = transport.post(RESCHEDULE_URL, headers=request_header, json=details)
+                except requests.RequestException as e:
+                    error = e
+                finally:
+                    if captcha_prefetcher is not None:
+                        captcha_prefetcher.refill(more=resp is None or resp.status_code != 204)
+            if error is not None:
+                # no response counts as a server error, for the backoff and the breaker
+                BOOKING_BREAKER.record_failure()
+                print(f"Reschedule got no response: {error}")
+                if BOOKING_BREAKER.is_open or not retry.wait(f"reschedule got {type(error).__name__}"):
+                    return True
+                continue
+            if resp.status_code >= 500:
+                BOOKING_BREAKER.record_failure()
+            else:
+                BOOKING_BREAKER.record_success()
             print(f"Booking Response Code: {resp.status_code}")
             print(f"Booking Response : {resp.text}")
 
@@ -1216,25 +1553,16 @@ def reschedule_appointment(request_header, details, mobile, generate_captcha_pre
                 print("TOKEN INVALID")
                 return False
             elif resp.status_code == 204:
-                beep(WARNING_BEEP_DURATION[0], WARNING_BEEP_DURATION[1])
+                notify("rescheduled", f"Rescheduled to session {details['session_id']}, slot {details['slot']}",
+                       freq=WARNING_BEEP_DURATION[0], duration=WARNING_BEEP_DURATION[1])
                 print("##############    RESCHEDULED!  ############################    RESCHEDULED!  ##############")
                 print("                        YOUR APPOINTMENT HAS BEEN RESCHEDULED                       ")
-                re_appointment_id = resp.text
-                re_appointment_id = (re_appointment_id[32:68])
-                response = requests.get(
-                    "https://cdn-api.co-vin.in/api/v2/appointment/appointmentslip/download?appointment_id={}".format(
-                        re_appointment_id), headers=request_header)
-                if response.status_code == 200:
-                    filename = "appointment_slip" + re_appointment_id
-                    with open(filename, 'wb') as f:
-                        f.write(response.content)
-                else:
-                    print("unable to download appointment slip")
-                    print(f"Response: {resp.status_code} : {resp.text}")
+                # a reschedule keeps the appointment id, its 204 response has no body
+                download_appointment_slip(request_header, confirmation_number(resp) or details["appointment_id"])
 
                 print("\nPress any key twice to exit program.")
-                os.system('pause')
-                os.system('pause')
+                pause()
+                pause()
                 sys.exit(1)
 
             elif resp.status_code == 409:
@@ -1246,16 +1574,17 @@ def reschedule_appointment(request_header, details, mobile, generate_captcha_pre
                 # {"errorCode":"APPOIN0011","error":"You have selected the same vaccination center and date as that of your current appointment. Please select a different vaccination center or the date for rescheduling."}
                 break
             elif resp.status_code >= 500:
-                # Server error at the time of high booking
+                # Server error at the time of high booking, retried with backoff unless the API keeps failing
                 print(f"Response: {resp.status_code} : {resp.text}")
-                pass
+                if BOOKING_BREAKER.is_open or not retry.wait(f"reschedule got {resp.status_code}"):
+                    return True
             else:
                 print(f"Response: {resp.status_code} : {resp.text}")
                 return True
 
     except Exception as e:
         print(str(e))
-        beep(WARNING_BEEP_DURATION[0], WARNING_BEEP_DURATION[1])
+        notify("error", str(e), freq=WARNING_BEEP_DURATION[0], duration=WARNING_BEEP_DURATION[1])
 
 
 def cleaned_display(appointment):
@@ -1294,7 +1623,7 @@ def cancel_appointments(request_header, active_appointments):
                 'appointment_id': value_present['appointment_id'],
                 'beneficiariesToCancel': [value_present['beneficiariesToCancel']]
             }
-            response = requests.post(CANCEL_URL, headers=request_header, json=data)
+            response = transport.post(CANCEL_URL, headers=request_header, json=data)
 
             if response.status_code == 204:
                 print("appointment of  " + str(value_present['name']) + "   has been cancelled")
@@ -1302,14 +1631,14 @@ def cancel_appointments(request_header, active_appointments):
                 try:
                     print("\n UNABLE TO CANCEL THE APPOINTMENT of   " + str(value_present['name']))
                     print(f"Response: {response.status_code} : {response.text}")
-                    os.system('pause')
+                    pause()
                     sys.exit(1)
                 except Exception as e:
                     print(str(e))
                     pass
-        os.system('pause')
+        pause()
         sys.exit(1)
     else:
         print("\n\n wrong input.. exiting the cancellation")
-        os.system('pause')
+        pause()
         sys.exit(0)
@@ -0,0 +1,94 @@
+import datetime
+import random
+import pytest
+from calendar_filter import Option
+from ranking import DEFAULT_WEIGHTS, BookingHistory, SlotRanker, parse_weights
+
+TODAY = datetime.date(2021, 6, 1)
+SLOTS = ["09:00AM-11:00AM", "11:00AM-01:00PM", "01:00PM-03:00PM", "03:00PM-05:00PM"]
+
+
+def option(session_id, center_id=1, days=0, available=10, fee_type="Free", fee="0", slots=SLOTS, name=None):
+    day = TODAY + datetime.timedelta(days=days)
+    return Option(name or f"Center {center_id}", "Bangalore", 560001, "COVISHIELD", fee_type, fee, available,
+                  day.strftime("%d-%m-%Y"), list(slots), center_id, session_id, day)
+
+
+def session_ids(options):
+    return [item.session_id for item in options]
+
+
+def test_parse_weights_keeps_defaults_for_features_not_given():
+    weights = parse_weights("date=2, capacity=0.5")
+    assert weights["date"] == 2.0
+    assert weights["capacity"] == 0.5
+    assert weights["preferred"] == DEFAULT_WEIGHTS["preferred"]
+    assert parse_weights(None) == DEFAULT_WEIGHTS
+    assert parse_weights("") == DEFAULT_WEIGHTS
+
+
+@pytest.mark.parametrize("spec", ["speed=1", "date=fast", "date"])
+def test_parse_weights_rejects_unknown_features_and_values(spec):
+    with pytest.raises(ValueError):
+        parse_weights(spec)
+
+
+def test_rank_prefers_earlier_dates_then_capacity():
+    ranker = SlotRanker()
+    options = [option("late", days=2, available=50), option("small", available=1), option("big", available=40)]
+    assert session_ids(ranker.rank(options)) == ["big", "small", "late"]
+
+
+def test_rank_weights_change_the_order():
+    options = [option("soon", center_id=1, days=0), option("preferred", center_id=2, days=1),
+               option("paid", center_id=3, fee_type="Paid", fee="1250")]
+    assert session_ids(SlotRanker(preferred_centers=["2"]).rank(options))[0] == "preferred"
+    assert session_ids(SlotRanker(parse_weights("preferred=0")).rank(options)) == ["soon", "paid", "preferred"]
+    # a fee of 1250 costs more than a day later
+    assert session_ids(SlotRanker(parse_weights("fee=1")).rank(options)) == ["soon", "preferred", "paid"]
+    assert session_ids(SlotRanker(parse_weights("free=2")).rank(options)) == ["soon", "preferred", "paid"]
+
+
+def test_rank_of_no_options_is_empty():
+    assert SlotRanker().rank([]) == []
+
+
+def test_attempts_of_single_slot_sessions():
+    ranker = SlotRanker(rng=random.Random(1))
+    ranked = ranker.rank([option("one", slots=SLOTS[:1]), option("none", days=1, slots=[])])
+    attempts = ranker.attempts(ranked)
+    assert [(attempt.rank, attempt.option.session_id, attempt.slot) for attempt in attempts] == [(0, "one", SLOTS[0])]
+
+
+def test_attempts_sample_distinct_slots_per_session():
+    ranker = SlotRanker(rng=random.Random(1))
+    attempts = ranker.attempts(ranker.rank([option("a"), option("b", days=1, slots=SLOTS + ["05:00PM-06:00PM"])]))
+    by_session = {}
+    for attempt in attempts:
+        by_session.setdefault(attempt.option.session_id, []).append(attempt.slot)
+    assert len(by_session["a"]) == 2
+    assert len(by_session["b"]) == 3
+    assert all(len(set(slots)) == len(slots) for slots in by_session.values())
+    assert [attempt.option.session_id for attempt in attempts] == ["a", "a", "b", "b", "b"]
+
+
+def test_history_moves_centers_up_and_down():
+    history = BookingHistory()
+    ranker = SlotRanker(parse_weights("history=2"), history=history)
+    options = [option("first", center_id=1), option("second", center_id=2)]
+    assert session_ids(ranker.rank(options)) == ["first", "second"]
+
+    for _ in range(3):
+        ranker.record(options[0], 409)
+        ranker.record(options[1], 1000)
+    assert session_ids(ranker.rank(options)) == ["second", "first"]
+
+
+def test_only_booking_outcomes_count_as_history():
+    history = BookingHistory()
+    ranker = SlotRanker(history=history)
+    ranker.record(option("a"), 400)
+    ranker.record(option("a"), 401)
+    assert history.success_rates() == {}
+    ranker.record(option("a"), 1000)
+    assert history.success_rates() == {1: 2 / 3}
@@ -0,0 +1,73 @@
+import json
+import requests
+import traffic
+
+BENEFICIARY = {
+    "beneficiary_reference_id": "12345678901234",
+    "name": "Asha Kumari",
+    "birth_year": "1990",
+    "gender": "Female",
+    "mobile_number": "9876543210",
+    "photo_id_type": "Aadhaar Card",
+    "photo_id_number": "XXXXXXXX4321",
+    "vaccination_status": "Not Vaccinated",
+    "appointments": [{"appointment_id": "a1b2c3d4-0000-0000-0000-000000000000", "name": "PHC Jayanagar"}],
+}
+PERSONAL_VALUES = ["12345678901234", "Asha Kumari", "1990", "Female", "9876543210", "XXXXXXXX4321",
+                   "a1b2c3d4-0000-0000-0000-000000000000"]
+
+
+def fake_response(url, body, content_type="application/json", method="GET", request_body=None):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers["Content-Type"] = content_type
+    response._content = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+    response.request = requests.Request(method, url, json=request_body).prepare()
+    return response
+
+
+def record(tmp_path, *calls):
+    path = str(tmp_path / "session.jsonl.gz")
+    recorder = traffic.TrafficRecorder(path)
+    for method, url, response in calls:
+        recorder.record(method, url, response, 0.1)
+    recorder.stop()
+    return traffic.load_recording(path)
+
+
+def test_beneficiaries_response_keeps_no_personal_data(tmp_path):
+    url = "https://cdn-api.co-vin.in/api/v2/appointment/beneficiaries"
+    records = record(tmp_path, ("GET", url, fake_response(url, {"beneficiaries": [BENEFICIARY]})))
+
+    text = json.dumps(records)
+    for value in PERSONAL_VALUES:
+        assert value not in text
+    beneficiary = json.loads(records[0]["body"])["beneficiaries"][0]
+    assert beneficiary["vaccination_status"] == "Not Vaccinated"
+    # the center an appointment is at is not personal
+    assert beneficiary["appointments"][0]["name"] == "PHC Jayanagar"
+
+
+def test_booking_request_and_slip_keep_no_personal_data(tmp_path):
+    booking_url = "https://cdn-api.co-vin.in/api/v2/appointment/schedule"
+    booking = {"beneficiaries": ["12345678901234"], "dose": 1, "session_id": "s1", "slot": "09:00AM-11:00AM"}
+    slip_url = ("https://cdn-api.co-vin.in/api/v2/appointment/appointmentslip/download?"
+                "appointment_id=a1b2c3d4-0000-0000-0000-000000000000")
+    records = record(tmp_path,
+                     ("POST", booking_url, fake_response(booking_url, {"appointment_confirmation_no": "x"},
+                                                         method="POST", request_body=booking)),
+                     ("GET", slip_url, fake_response(slip_url, b"%PDF-1.4 Asha Kumari 12345678901234",
+                                                     content_type="application/pdf")))
+
+    text = json.dumps(records)
+    for value in PERSONAL_VALUES:
+        assert value not in text
+    assert records[1]["body"] == ""
+    assert "body_b64" not in records[1]
+
+
+def test_calendar_urls_are_recorded_as_sent():
+    url = ("https://cdn-api.co-vin.in/api/v2/appointment/sessions/calendarByDistrict?district_id=294&date=18-10-2026"
+           "&vaccine=SPUTNIK V")
+    assert traffic.redact_url(url) == url